@@ -0,0 +1,60 @@
+"""
+Compare the size and speed of each available cache codec (see CACHE_CODEC) against the plain pickles we used to
+store.
+
+    python -m benchmarks.bench_codec
+"""
+import pickle
+import time
+
+from dogpile.cache.api import CachedValue
+
+from server.util import codec
+from benchmarks import payloads
+
+REPEATS = 200
+
+
+def _cached(value):
+    # what dogpile actually hands the backend to store
+    return CachedValue(value, {"ct": time.time(), "v": 1})
+
+
+PAYLOADS = {
+    'twitter counts page (31 days)': _cached(payloads.twitter_counts_page()),
+    'twitter search page (50 tweets)': _cached(payloads.twitter_search_page()),
+    'youtube search page (50 videos)': _cached(payloads.youtube_search_page()),
+    'pushshift sample (50 submissions)': _cached(payloads.pushshift_search()),
+    'pushshift histogram (3 years)': _cached(payloads.pushshift_search(submissions=0, histogram_days=365*3)),
+    'media cloud split count (3 years)': _cached(payloads.mediacloud_story_count(days=365*3)),
+    'daily count bucket': _cached(1234),
+}
+
+
+def _time_per_call(fn, arg) -> float:
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        fn(arg)
+    return (time.perf_counter() - start) / REPEATS * 1000000
+
+
+def _pickle(value) -> bytes:
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def run():
+    print("{:<36} {:>6} {:>10} {:>10} {:>7} {:>10} {:>10} {:>10} {:>10}".format(
+        "payload", "codec", "pickle B", "codec B", "ratio", "pickle enc", "codec enc", "pickle dec", "codec dec"))
+    for name, value in PAYLOADS.items():
+        pickled = _pickle(value)
+        for codec_name in codec.available_codecs():
+            encoded = codec.encode(value, codec_name)
+            assert codec.decode(encoded) == value
+            print("{:<36} {:>6} {:>10} {:>10} {:>7.2f} {:>8.1f}us {:>8.1f}us {:>8.1f}us {:>8.1f}us".format(
+                name, codec_name, len(pickled), len(encoded), len(encoded) / len(pickled),
+                _time_per_call(_pickle, value), _time_per_call(lambda v: codec.encode(v, codec_name), value),
+                _time_per_call(pickle.loads, pickled), _time_per_call(codec.decode, encoded)))
+
+
+if __name__ == '__main__':
+    run()
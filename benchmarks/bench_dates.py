@@ -0,0 +1,57 @@
+"""
+Compare the per-row cost of parsing upstream timestamps with the generic parsers against our fast paths, on a series
+of 10k buckets.
+
+    python -m benchmarks.bench_dates
+"""
+import datetime as dt
+import time
+
+import dateutil.parser
+
+from server.util import dates
+from benchmarks import payloads
+
+BUCKETS = 10000
+
+
+def _time_per_row(fn, values) -> float:
+    start = time.perf_counter()
+    for value in values:
+        fn(value)
+    return (time.perf_counter() - start) / len(values) * 1000000
+
+
+def _cases():
+    twitter = [d['start'] for d in payloads.twitter_counts_page(days=BUCKETS)['data']]
+    pushshift = [b['key'] for b in payloads.pushshift_search(submissions=0, histogram_days=BUCKETS)[
+        'metadata']['es']['aggregations']['calendar_histogram']['buckets']]
+    solr = [d['date'][:10] for d in payloads.mediacloud_story_count(days=BUCKETS)['counts']]
+    cases = [
+        ('twitter ISO "Z" timestamps', twitter, [
+            ('dateutil.parser.parse', dateutil.parser.parse, BUCKETS),
+            ('dates.parse_iso_date', dates.parse_iso_date, BUCKETS),
+        ]),
+        ('pushshift epoch millis', pushshift, [
+            ('datetime.fromtimestamp', lambda ms: dt.datetime.fromtimestamp(ms/1000), BUCKETS),
+            ('dates.parse_epoch_millis', dates.parse_epoch_millis, BUCKETS),
+        ]),
+        ('media cloud solr dates', solr, [
+            ('datetime.strptime', lambda s: dt.datetime.strptime(s, dates.SOLR_DATE_FORMAT), BUCKETS),
+            ('dates.solr_date_to_date', dates.solr_date_to_date, BUCKETS),
+        ]),
+    ]
+    return cases
+
+
+def run():
+    print("{:<28} {:<28} {:>8} {:>12} {:>14}".format("format", "parser", "rows", "per row", "10k buckets"))
+    for name, values, parsers in _cases():
+        for parser_name, parser, rows in parsers:
+            per_row = _time_per_row(parser, values[:rows])
+            print("{:<28} {:<28} {:>8} {:>10.2f}us {:>12.1f}ms".format(name, parser_name, rows, per_row,
+                                                                     per_row * BUCKETS / 1000))
+
+
+if __name__ == '__main__':
+    run()
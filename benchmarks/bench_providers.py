@@ -0,0 +1,173 @@
+"""
+Replay upstream responses through each provider and the Flask endpoints, offline, and report per-operation latency
+(with a cold cache and a warm one), throughput and peak memory allocated.
+
+    python -m benchmarks.bench_providers
+    python -m benchmarks.bench_providers --only twitter --repeats 50
+    python -m benchmarks.bench_providers --fixtures benchmarks/fixtures --record   # needs real API keys
+
+Without fixtures every upstream request is answered with synthetic payloads sized to match it. Pass --fixtures to
+replay recorded responses instead (any request without one falls back to a synthetic payload), and --record to
+capture them from the real APIs first. Caching goes to an in-memory backend, so no Redis is needed.
+"""
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+import statistics
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+
+# providers refuse to start without credentials; these placeholders are never sent anywhere unless recording
+for _key in ['TWITTER_API_BEARER_TOKEN', 'YOUTUBE_API_KEY', 'MEDIA_CLOUD_API_KEY', 'MC_API_KEY']:
+    os.environ.setdefault(_key, 'benchmark')
+
+from server import app
+from server.platforms import provider_for
+from benchmarks.replay import Replayer, use_memory_cache
+
+# a closed range, so results are cached the way they would be in production (not as recent results)
+START_DATE = dt.datetime(2019, 1, 1)
+END_DATE = dt.datetime(2021, 12, 31)
+SAMPLE_SIZE = 50
+TERMS = 'climate change'
+
+
+def _provider_operations() -> List[Tuple[str, str, Callable]]:
+    twitter = provider_for('twitter', 'twitter')
+    reddit = provider_for('reddit', 'pushshift')
+    youtube = provider_for('youtube', 'youtube')
+    onlinenews = provider_for('onlinenews', 'mediacloud')
+    args = (TERMS, START_DATE, END_DATE)
+    return [
+        ('twitter', 'count_over_time', lambda: twitter.count_over_time(*args)),
+        ('twitter', 'count_over_time (week)', lambda: twitter.count_over_time(*args, granularity='week')),
+        ('twitter', 'sample', lambda: twitter.sample(*args, limit=SAMPLE_SIZE)),
+        ('reddit', 'count_over_time', lambda: reddit.count_over_time(*args)),
+        ('reddit', 'normalized_count_over_time', lambda: reddit.normalized_count_over_time(*args)),
+        ('reddit', 'sample', lambda: reddit.sample(*args, limit=SAMPLE_SIZE)),
+        ('youtube', 'count', lambda: youtube.count(*args)),
+        ('youtube', 'sample', lambda: youtube.sample(*args, limit=SAMPLE_SIZE)),
+        ('onlinenews', 'count_over_time', lambda: onlinenews.count_over_time(*args)),
+        ('onlinenews', 'normalized_count_over_time', lambda: onlinenews.normalized_count_over_time(*args)),
+        ('onlinenews', 'sample', lambda: onlinenews.sample(*args, limit=SAMPLE_SIZE)),
+    ]
+
+
+def _endpoint_operations() -> List[Tuple[str, str, Callable]]:
+    client = app.test_client()
+    query = dict(terms=TERMS, startDate=START_DATE.isoformat(), endDate=END_DATE.isoformat())
+
+    def post(path: str, **data) -> Callable:
+        def call():
+            response = client.post(path, json=dict(query, **data))
+            assert response.status_code == 200, response.get_data(as_text=True)
+        return call
+
+    def get(path: str, **args) -> Callable:
+        def call():
+            response = client.get(path, query_string=dict(query, **args))
+            assert response.status_code == 200, response.get_data(as_text=True)
+            response.get_data()  # drain streamed exports
+        return call
+
+    operations = []
+    for platform in ['twitter / twitter', 'reddit / pushshift', 'onlinenews / mediacloud']:
+        name = platform.split(' / ')[0]
+        operations += [
+            (name, 'POST /api/count-over-time.json', post('/api/count-over-time.json', platform=platform)),
+            (name, 'GET /api/count-over-time.csv', get('/api/count-over-time.csv', platform=platform)),
+            (name, 'POST /api/sample.json', post('/api/sample.json', platform=platform)),
+            (name, 'POST /api/glimpse.json', post('/api/glimpse.json', platform=platform)),
+        ]
+    for platform in ['reddit / pushshift', 'onlinenews / mediacloud']:
+        name = platform.split(' / ')[0]
+        operations += [
+            (name, 'POST /api/normalized-count-over-time.json',
+             post('/api/normalized-count-over-time.json', platform=platform)),
+            (name, 'POST /api/batch.json', post('/api/batch.json', platform=platform, normalize=True,
+                                                queries=['climate', 'weather', 'climate change', 'climate'])),
+        ]
+    return operations
+
+
+def _time(fn: Callable, repeats: int, before_each: Callable = None) -> List[float]:
+    timings = []
+    for _ in range(repeats):
+        if before_each is not None:
+            before_each()
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def _peak_allocated_kb(fn: Callable, before: Callable) -> float:
+    before()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def _p95(timings: List[float]) -> float:
+    return sorted(timings)[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+
+def run(operations: List[Tuple[str, str, Callable]], repeats: int, replayer: Replayer, clear_cache: Callable) -> List:
+    rows = []
+    for platform, operation, fn in operations:
+        calls_before = replayer.upstream_calls
+        cold = _time(fn, repeats, before_each=clear_cache)
+        calls = (replayer.upstream_calls - calls_before) / repeats
+        warm = _time(fn, repeats)
+        rows.append(dict(platform=platform, operation=operation, upstream_calls=calls,
+                         cold_mean_ms=statistics.mean(cold), cold_p95_ms=_p95(cold),
+                         warm_mean_ms=statistics.mean(warm), warm_p95_ms=_p95(warm),
+                         cold_ops_per_sec=1000 / statistics.mean(cold), warm_ops_per_sec=1000 / statistics.mean(warm),
+                         cold_peak_kb=_peak_allocated_kb(fn, clear_cache),
+                         warm_peak_kb=_peak_allocated_kb(fn, lambda: None)))
+    return rows
+
+
+def _print_table(title: str, rows: List) -> None:
+    print("\n" + title)
+    print("{:<11} {:<42} {:>6} {:>10} {:>10} {:>9} {:>10} {:>10} {:>9} {:>10} {:>10}".format(
+        'platform', 'operation', 'calls', 'cold ms', 'cold p95', 'cold/s', 'cold KB', 'warm ms', 'warm p95', 'warm/s',
+        'warm KB'))
+    for row in rows:
+        print("{platform:<11} {operation:<42} {upstream_calls:>6.1f} {cold_mean_ms:>10.2f} {cold_p95_ms:>10.2f} "
+              "{cold_ops_per_sec:>9.1f} {cold_peak_kb:>10.1f} {warm_mean_ms:>10.2f} {warm_p95_ms:>10.2f} "
+              "{warm_ops_per_sec:>9.1f} {warm_peak_kb:>10.1f}".format(**row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--repeats', type=int, default=20, help="calls per operation for each of cold and warm")
+    parser.add_argument('--fixtures', help="directory of recorded upstream responses to replay")
+    parser.add_argument('--record', action='store_true', help="call the real APIs and save responses as fixtures")
+    parser.add_argument('--only', help="just benchmark this platform (ie. twitter)")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+    if args.record and not args.fixtures:
+        parser.error("--record needs a --fixtures directory to save responses to")
+    logging.disable(logging.INFO)  # providers log every upstream call at debug level
+    backend = use_memory_cache()
+    with Replayer(fixtures_dir=args.fixtures, record=args.record) as replayer:
+        results = {}
+        for title, operations in [('providers', _provider_operations()), ('endpoints', _endpoint_operations())]:
+            operations = [o for o in operations if (args.only is None) or (o[0] == args.only)]
+            # recording only needs each distinct request once
+            results[title] = run(operations, 1 if args.record else args.repeats, replayer, backend.clear)
+            _print_table(title, results[title])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
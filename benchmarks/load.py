@@ -0,0 +1,241 @@
+"""
+Hammer a glimpse app with a realistic mix of API requests at a set concurrency, and report latency percentiles, how
+many calls reached the upstream APIs and how often the cache answered instead. Start the simulated upstream first
+(see benchmarks/upstream.py), then either point this at an app that is already using it:
+
+    python -m benchmarks.load --url http://localhost:8000 --concurrency 50 --duration 60
+
+or have it start one with gunicorn's gevent worker, the way we run in production:
+
+    python -m benchmarks.load --start-app --workers 2 --concurrency 50 --requests 5000
+
+Cache stats come from whichever worker answers `/api/cache-stats.json`, so run a single worker for exact hit ratios.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import datetime as dt
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import gevent
+from gevent.pool import Pool
+import numpy as np
+import requests
+
+PLATFORMS = ['twitter / twitter', 'reddit / pushshift', 'youtube / youtube']
+# closed ranges are cached for good, while the one ending today keeps expiring (see CACHE_RECENT_DAYS)
+RANGES = [(dt.date(2021, 1, 1), dt.date(2021, 12, 31)), (dt.date(2022, 1, 1), dt.date(2022, 3, 31)),
+          (dt.date(2020, 6, 1), dt.date(2020, 6, 30))]
+RECENT_RANGE_DAYS = 30
+TERMS = ['climate', 'election', 'vaccine', 'inflation', 'ukraine', 'olympics', 'earthquake', 'housing', 'strike',
+         'wildfire', 'crypto', 'tariffs', 'heatwave', 'drought', 'protest', 'budget', 'refugees', 'measles', 'ai',
+         'supreme court']
+
+
+def _operations(platform: str) -> List[Tuple[str, str, str]]:
+    """
+    :return: the (name, method, path) of each request to send for a platform, with the popular ones repeated
+    """
+    if platform.startswith('youtube'):
+        # YouTube can't count over time
+        return [('count', 'POST', '/api/count.json'), ('sample', 'POST', '/api/sample.json')]
+    operations = [('count-over-time', 'GET', '/api/count-over-time.json')] * 3 + [
+        ('count', 'GET', '/api/count.json'),
+        ('sample', 'POST', '/api/sample.json'),
+        ('glimpse', 'POST', '/api/glimpse.json'),
+    ]
+    if platform.startswith('reddit'):
+        operations.append(('normalized-count-over-time', 'GET', '/api/normalized-count-over-time.json'))
+    return operations
+
+
+class LoadDriver:
+
+    def __init__(self, url: str, platforms: List[str], queries: int, recent_share: float, seed: int = 0):
+        """
+        :param url: where the app is
+        :param platforms: which platforms to query
+        :param queries: how many distinct search terms to use (fewer means more cache hits)
+        :param recent_share: the fraction of requests for the range ending today, which can't be cached for long
+        :param seed: so runs send the same requests in the same order
+        """
+        self._url = url.rstrip('/')
+        self._rng = random.Random(seed)
+        terms = (TERMS * (queries // len(TERMS) + 1))[:queries]
+        self._terms = [t if i < len(TERMS) else '{} {}'.format(t, i) for i, t in enumerate(terms)]
+        # a few queries are far more popular than the rest, like in real traffic
+        self._term_weights = [1 / (rank + 1) for rank in range(len(self._terms))]
+        self._operations = [(platform, operation) for platform in platforms for operation in _operations(platform)]
+        self._recent_share = recent_share
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=1000)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self.results = defaultdict(list)  # operation name -> [(status code, seconds)]
+
+    def _next_request(self) -> Tuple[str, str, str, Dict]:
+        platform, (name, method, path) = self._rng.choice(self._operations)
+        if self._rng.random() < self._recent_share:
+            end = dt.date.today()
+            start = end - dt.timedelta(days=RECENT_RANGE_DAYS)
+        else:
+            start, end = self._rng.choice(RANGES)
+        query = dict(platform=platform, terms=self._rng.choices(self._terms, self._term_weights)[0],
+                     startDate=start.isoformat(), endDate=end.isoformat())
+        return name, method, path, query
+
+    def _send(self) -> None:
+        name, method, path, query = self._next_request()
+        start = time.perf_counter()
+        try:
+            if method == 'GET':
+                response = self._session.get(self._url + path, params=query, timeout=600)
+            else:
+                response = self._session.post(self._url + path, json=query, timeout=600)
+            status = response.status_code
+        except requests.RequestException:
+            status = 0
+        self.results[name].append((status, time.perf_counter() - start))
+
+    def run(self, concurrency: int, total_requests: Optional[int] = None, duration: Optional[float] = None) -> float:
+        """
+        Send requests from `concurrency` greenlets at once until we have sent total_requests or run for duration.
+        :return: how many seconds it took
+        """
+        sent = 0
+        start = time.monotonic()
+
+        def more() -> bool:
+            if total_requests is not None:
+                return sent < total_requests
+            return time.monotonic() - start < duration
+
+        def worker():
+            nonlocal sent
+            while more():
+                sent += 1
+                self._send()
+
+        pool = Pool(concurrency)
+        for _ in range(concurrency):
+            pool.spawn(worker)
+        pool.join()
+        return time.monotonic() - start
+
+    def get_json(self, url: str) -> Optional[Dict]:
+        try:
+            return self._session.get(url, timeout=30).json()
+        except (requests.RequestException, ValueError):
+            return None
+
+
+def _latency_rows(results: Dict[str, List[Tuple[int, float]]]) -> List[Dict]:
+    everything = [r for rows in results.values() for r in rows]
+    rows = []
+    for name, samples in sorted(results.items()) + [('all', everything)]:
+        seconds = np.array([s for _, s in samples]) * 1000
+        p50, p95, p99 = np.percentile(seconds, [50, 95, 99])
+        rows.append(dict(operation=name, requests=len(samples), errors=len([c for c, _ in samples if c != 200]),
+                         p50=p50, p95=p95, p99=p99, max=seconds.max()))
+    return rows
+
+
+def _diff(after: Optional[Dict], before: Optional[Dict]) -> Dict:
+    if (after is None) or (before is None):
+        return {}
+    return {key: after[key] - before.get(key, 0) for key in after}
+
+
+def _ratio(hits: int, misses: int) -> str:
+    return "{:.1%}".format(hits / (hits + misses)) if hits + misses > 0 else "-"
+
+
+def report(results: Dict, elapsed: float, upstream_before: Optional[Dict], upstream_after: Optional[Dict],
+           cache_before: Optional[Dict], cache_after: Optional[Dict]) -> None:
+    rows = _latency_rows(results)
+    print("\n{:<28} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9}".format('operation', 'requests', 'errors', 'p50 ms', 'p95 ms',
+                                                               'p99 ms', 'max ms'))
+    for row in rows:
+        print("{operation:<28} {requests:>9} {errors:>7} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f} {max:>9.1f}".format(**row))
+    print("\n{} requests in {:.1f}s ({:.1f} requests/sec)".format(rows[-1]['requests'], elapsed,
+                                                                  rows[-1]['requests'] / elapsed))
+    if upstream_after is not None:
+        print("\n{:<20} {:>8} {:>13} {:>15} {:>8}".format('upstream endpoint', 'calls', 'rate limited',
+                                                          'quota exceeded', 'errors'))
+        for endpoint in sorted(upstream_after['calls'].keys()):
+            counts = [upstream_after[kind].get(endpoint, 0) - ((upstream_before or {}).get(kind) or {}).get(endpoint, 0)
+                      for kind in ['calls', 'rate_limited', 'quota_exceeded', 'errors']]
+            print("{:<20} {:>8} {:>13} {:>15} {:>8}".format(endpoint, *counts))
+    cache = _diff(cache_after, cache_before)
+    if cache:
+        print("\ncache hit ratio: in-process {} / redis {} ({} calls coalesced)".format(
+            _ratio(cache['l1_hits'], cache['l1_misses']), _ratio(cache['l2_hits'], cache['l2_misses']),
+            cache['coalesced']))
+
+
+def start_app(port: int, workers: int, upstream: str) -> subprocess.Popen:
+    """
+    Run the app under gunicorn's gevent worker, with every upstream API pointed at the simulated one.
+    """
+    upstream = upstream.rstrip('/')
+    env = dict(os.environ, TWITTER_API_URL=upstream + '/2/', YT_SEARCH_API_URL=upstream + '/youtube/v3/search',
+               REDDIT_PUSHSHIFT_URL=upstream)
+    for key in ['TWITTER_API_BEARER_TOKEN', 'YOUTUBE_API_KEY', 'MEDIA_CLOUD_API_KEY', 'MC_API_KEY']:
+        env.setdefault(key, 'load-test')
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'server:app', '-k', 'gevent', '--workers',
+                                str(workers), '--timeout', '500', '-b', '127.0.0.1:{}'.format(port)], env=env)
+    for _ in range(120):
+        try:
+            if requests.get('http://127.0.0.1:{}/api/health.json'.format(port), timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        if process.poll() is not None:
+            break
+        gevent.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("The app didn't start on port {}".format(port))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--url', default='http://localhost:8000', help="the app to load test")
+    parser.add_argument('--upstream', default='http://localhost:8081', help="the simulated upstream")
+    parser.add_argument('--start-app', action='store_true', help="start the app with gunicorn first")
+    parser.add_argument('--workers', type=int, default=1, help="gunicorn workers, with --start-app")
+    parser.add_argument('--port', type=int, default=8765, help="port for the app, with --start-app")
+    parser.add_argument('--concurrency', type=int, default=20, help="requests in flight at once")
+    parser.add_argument('--requests', type=int, help="send this many requests")
+    parser.add_argument('--duration', type=float, default=30, help="or send requests for this many seconds")
+    parser.add_argument('--platforms', default=",".join(PLATFORMS), help="comma-separated platforms to query")
+    parser.add_argument('--queries', type=int, default=50, help="distinct search terms to use")
+    parser.add_argument('--recent-share', type=float, default=0.2, help="fraction of requests for recent dates")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    app = None
+    if args.start_app:
+        app = start_app(args.port, args.workers, args.upstream)
+        args.url = 'http://127.0.0.1:{}'.format(args.port)
+    try:
+        driver = LoadDriver(args.url, [p.strip() for p in args.platforms.split(',')], args.queries,
+                            args.recent_share, args.seed)
+        upstream_before = driver.get_json(args.upstream.rstrip('/') + '/_stats')
+        cache_before = driver.get_json(args.url.rstrip('/') + '/api/cache-stats.json')
+        elapsed = driver.run(args.concurrency, args.requests, args.duration)
+        report(driver.results, elapsed, upstream_before, driver.get_json(args.upstream.rstrip('/') + '/_stats'),
+               cache_before, driver.get_json(args.url.rstrip('/') + '/api/cache-stats.json'))
+    finally:
+        if app is not None:
+            app.terminate()
+            app.wait()
+
+
+if __name__ == '__main__':
+    main()
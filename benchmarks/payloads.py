@@ -0,0 +1,136 @@
+"""
+Deterministic, realistically sized stand-ins for the responses each upstream API sends us. The shapes and field
+names match what the real APIs return; only the content is made up.
+"""
+import datetime as dt
+import random
+import string
+
+WORDS = ("the a of to and in that is for on with as it at by this from be are was have or an they which you one "
+         "robots climate election vaccine policy market city school river music game health police court science "
+         "budget senate border energy housing storm protest strike trade union water wildfire").split()
+
+
+def _rng(seed: int) -> random.Random:
+    return random.Random(seed)
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _token(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(string.ascii_letters + string.digits) for _ in range(length))
+
+
+def _days(start: dt.datetime, days: int):
+    return [start + dt.timedelta(days=i) for i in range(days)]
+
+
+def twitter_counts_page(days: int = 31, start: dt.datetime = dt.datetime(2021, 1, 1), seed: int = 1,
+                        next_token: str = None) -> dict:
+    rng = _rng(seed)
+    data = [{
+        'end': (day + dt.timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        'start': day.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        'tweet_count': rng.randint(0, 50000),
+    } for day in _days(start, days)]
+    meta = {'total_tweet_count': sum(d['tweet_count'] for d in data)}
+    if next_token is not None:
+        meta['next_token'] = next_token
+    return {'data': data, 'meta': meta}
+
+
+def twitter_search_page(tweets: int = 50, start: dt.datetime = dt.datetime(2021, 1, 1), seed: int = 2) -> dict:
+    rng = _rng(seed)
+    users = [{'id': str(rng.randint(10**9, 10**10)), 'name': _text(rng, 2).title(), 'username': _token(rng, 12)}
+             for _ in range(tweets)]
+    data = [{
+        'id': str(rng.randint(10**18, 10**19)),
+        'text': _text(rng, rng.randint(10, 45)),
+        'author_id': users[i]['id'],
+        'created_at': (start + dt.timedelta(seconds=rng.randint(0, 86400*30))).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        'public_metrics': {'retweet_count': rng.randint(0, 5000), 'reply_count': rng.randint(0, 500),
+                           'like_count': rng.randint(0, 20000), 'quote_count': rng.randint(0, 300)},
+    } for i in range(tweets)]
+    return {'data': data, 'includes': {'users': users},
+            'meta': {'newest_id': data[0]['id'], 'oldest_id': data[-1]['id'], 'result_count': tweets,
+                     'next_token': _token(rng, 40)}}
+
+
+def youtube_search_page(videos: int = 50, start: dt.datetime = dt.datetime(2021, 1, 1), seed: int = 3) -> dict:
+    rng = _rng(seed)
+    items = []
+    for _ in range(videos):
+        published = (start + dt.timedelta(seconds=rng.randint(0, 86400*100))).strftime("%Y-%m-%dT%H:%M:%SZ")
+        video_id = _token(rng, 11)
+        channel_id = "UC" + _token(rng, 22)
+        items.append({
+            'kind': 'youtube#searchResult',
+            'etag': _token(rng, 27),
+            'id': {'kind': 'youtube#video', 'videoId': video_id},
+            'snippet': {
+                'publishedAt': published,
+                'channelId': channel_id,
+                'title': _text(rng, rng.randint(4, 14)).title(),
+                'description': _text(rng, rng.randint(15, 30)),
+                'thumbnails': {size: {'url': 'https://i.ytimg.com/vi/{}/{}.jpg'.format(video_id, size),
+                                      'width': width, 'height': height}
+                               for size, width, height in [('default', 120, 90), ('medium', 320, 180),
+                                                           ('high', 480, 360)]},
+                'channelTitle': _text(rng, 2).title(),
+                'liveBroadcastContent': 'none',
+                'publishTime': published,
+            }
+        })
+    return {'kind': 'youtube#searchListResponse', 'etag': _token(rng, 27), 'nextPageToken': _token(rng, 6),
+            'regionCode': 'US', 'pageInfo': {'totalResults': 1000000, 'resultsPerPage': videos}, 'items': items}
+
+
+def pushshift_search(submissions: int = 50, histogram_days: int = 0, start: dt.datetime = dt.datetime(2021, 1, 1),
+                     seed: int = 4) -> dict:
+    rng = _rng(seed)
+    data = []
+    for _ in range(submissions):
+        subreddit = rng.choice(['politics', 'worldnews', 'news', 'conspiracy', 'Libertarian', 'TrueReddit'])
+        submission_id = _token(rng, 6).lower()
+        created = int((start + dt.timedelta(seconds=rng.randint(0, 86400*30))).timestamp())
+        data.append({
+            'author': _token(rng, 10), 'author_fullname': 't2_' + _token(rng, 8), 'created_utc': created,
+            'domain': 'example.com', 'full_link': 'https://www.reddit.com/r/{}/comments/{}/'.format(subreddit,
+                                                                                                 submission_id),
+            'id': submission_id, 'is_self': False, 'num_comments': rng.randint(0, 3000),
+            'over_18': False, 'permalink': '/r/{}/comments/{}/'.format(subreddit, submission_id),
+            'retrieved_on': created + 3600, 'score': rng.randint(0, 80000), 'selftext': '',
+            'subreddit': subreddit, 'subreddit_id': 't5_' + _token(rng, 5), 'title': _text(rng, rng.randint(6, 20)),
+            'updated_utc': created + 7200, 'upvote_ratio': round(rng.random(), 2),
+            'url': 'https://example.com/{}'.format(_token(rng, 30)),
+        })
+    es = {'hits': {'total': {'value': rng.randint(1000, 10**6), 'relation': 'eq'}}}
+    if histogram_days > 0:
+        es['aggregations'] = {'calendar_histogram': {'buckets': [
+            {'key': int(day.timestamp() * 1000), 'key_as_string': day.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+             'doc_count': rng.randint(0, 20000)} for day in _days(start, histogram_days)]}}
+    return {'data': data, 'metadata': {'es': es, 'es_query': {'size': submissions}}}
+
+
+def mediacloud_story_count(days: int = 365, start: dt.datetime = dt.datetime(2021, 1, 1), seed: int = 5) -> dict:
+    rng = _rng(seed)
+    return {'counts': [{'date': day.strftime("%Y-%m-%d %H:%M:%S"), 'count': rng.randint(0, 30000)}
+                       for day in _days(start, days)],
+            'gap': '+1DAY', 'start': start.strftime("%Y-%m-%d"),
+            'end': (start + dt.timedelta(days=days)).strftime("%Y-%m-%d")}
+
+
+def mediacloud_story_list(stories: int = 50, start: dt.datetime = dt.datetime(2021, 1, 1), seed: int = 6) -> list:
+    rng = _rng(seed)
+    return [{
+        'stories_id': rng.randint(10**9, 2*10**9), 'media_id': rng.randint(1, 10**6), 'media_name': _text(rng, 2),
+        'media_url': 'https://{}.com'.format(_token(rng, 8).lower()), 'title': _text(rng, rng.randint(6, 16)),
+        'url': 'https://example.com/{}'.format(_token(rng, 40)), 'guid': _token(rng, 40), 'language': 'en',
+        'publish_date': (start + dt.timedelta(seconds=rng.randint(0, 86400*30))).strftime("%Y-%m-%d %H:%M:%S"),
+        'collect_date': start.strftime("%Y-%m-%d %H:%M:%S.%f"), 'processed_stories_id': rng.randint(10**9, 2*10**9),
+        'ap_syndicated': False, 'feeds': None, 'word_count': rng.randint(100, 2000),
+        'story_tags': [{'tags_id': rng.randint(1, 10**7), 'tag': _token(rng, 8), 'tag_sets_id': rng.randint(1, 3000)}
+                       for _ in range(rng.randint(2, 10))],
+    } for _ in range(stories)]
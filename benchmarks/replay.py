@@ -0,0 +1,181 @@
+"""
+Offline stand-ins for every upstream API, so providers and endpoints can be benchmarked without a network or Redis.
+
+`Replayer` patches `HTTPAdapter.send`, which every upstream request goes through (our pooled transport and the
+mediacloud client alike). Each request is answered from a recorded fixture if there is one, and otherwise with a
+synthetic response from `benchmarks.payloads` sized to match what was asked for (ie. a count for every day in the
+requested range). In record mode requests go upstream for real and their responses are saved as fixtures, with API
+keys stripped out.
+"""
+import datetime as dt
+import hashlib
+import json
+import os
+import re
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit, parse_qsl
+import requests
+from requests.adapters import HTTPAdapter
+from dogpile.cache.api import NO_VALUE
+from dogpile.cache.backends.memory import MemoryBackend
+
+from server.util import codec
+from benchmarks import payloads
+
+# request params that hold credentials, which never go into fixture names or files
+SECRET_PARAMS = ['key']
+SOLR_DATE_RANGE_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2})T[\d:]+Z? TO (\d{4}-\d{2}-\d{2})')
+
+
+class CodecMemoryBackend(MemoryBackend):
+    """
+    Keeps cached values in a dict, encoded with our codec just like `CodecRedisBackend` does, so benchmarks pay the
+    same serialization costs as production without needing a Redis server.
+    """
+
+    def get(self, key):
+        value = self._cache.get(key, NO_VALUE)
+        return value if value is NO_VALUE else codec.decode(value)
+
+    def get_multi(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value):
+        self._cache[key] = codec.encode(value)
+
+    def set_multi(self, mapping):
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def clear(self):
+        self._cache.clear()
+
+
+def use_memory_cache() -> CodecMemoryBackend:
+    """
+    Swap the Redis backend underneath our cache region (and its in-process tier) for an in-memory one.
+    :return: the new backend, so callers can clear it between runs
+    """
+    from server.util.cache import cache, local_cache
+    backend = CodecMemoryBackend({})
+    if cache.backend is local_cache:
+        local_cache.proxied = backend
+    else:
+        cache.backend = backend
+    return backend
+
+
+def _request_params(request: requests.PreparedRequest) -> Dict[str, str]:
+    params = dict(parse_qsl(urlsplit(request.url).query))
+    if request.body and ('application/x-www-form-urlencoded' in request.headers.get('Content-Type', '')):
+        body = request.body.decode('utf-8') if isinstance(request.body, bytes) else request.body
+        params.update(dict(parse_qsl(body)))
+    return {name: value for name, value in params.items() if name not in SECRET_PARAMS}
+
+
+def fixture_name(request: requests.PreparedRequest) -> str:
+    parts = urlsplit(request.url)
+    signature = json.dumps([request.method, parts.netloc, parts.path, sorted(_request_params(request).items())])
+    return hashlib.sha1(signature.encode('utf-8')).hexdigest() + '.json'
+
+
+def _iso_date(value: str) -> dt.datetime:
+    return dt.datetime.strptime(value[:10], "%Y-%m-%d")
+
+
+def synthetic_response(request: requests.PreparedRequest) -> Tuple[int, object]:
+    """
+    :return: a status code and JSON-ready body shaped like the upstream API's answer to this request
+    """
+    parts = urlsplit(request.url)
+    params = _request_params(request)
+    if parts.path.endswith('/tweets/counts/all'):
+        start, end = _iso_date(params['start_time']), _iso_date(params['end_time'])
+        return 200, payloads.twitter_counts_page(days=max(1, (end - start).days), start=start)
+    if parts.path.endswith('/tweets/search/all'):
+        return 200, payloads.twitter_search_page(tweets=int(params.get('max_results', 10)))
+    if parts.path.endswith('/youtube/v3/search'):
+        return 200, payloads.youtube_search_page(videos=int(params.get('maxResults', 20)))
+    if parts.path.endswith('/reddit/search/submissions'):
+        if 'calendar_histogram' in params:
+            start = dt.datetime.utcfromtimestamp(int(params['since']))
+            days = max(1, (int(params['until']) - int(params['since'])) // (60 * 60 * 24))
+            return 200, payloads.pushshift_search(submissions=0, histogram_days=days, start=start)
+        return 200, payloads.pushshift_search(submissions=int(params.get('limit', 25)))
+    if parts.path.endswith('/stories_public/count'):
+        dates = SOLR_DATE_RANGE_PATTERN.search(params.get('fq', ''))
+        if params.get('split') == '1' and dates:
+            start, end = _iso_date(dates.group(1)), _iso_date(dates.group(2))
+            return 200, payloads.mediacloud_story_count(days=(end - start).days + 1, start=start)
+        return 200, {'count': 123456}
+    if parts.path.endswith('/stories_public/list'):
+        return 200, payloads.mediacloud_story_list(stories=int(params.get('rows', 20)))
+    return 404, {'error': 'No synthetic response for {}'.format(parts.path)}
+
+
+class Replayer:
+    """
+    Answers upstream requests from fixtures while installed:
+
+        with Replayer(fixtures_dir='benchmarks/fixtures'):
+            provider.count_over_time(...)
+    """
+
+    def __init__(self, fixtures_dir: Optional[str] = None, record: bool = False):
+        self._fixtures_dir = fixtures_dir
+        self._record = record
+        self._original_send = None
+        self._bodies = {}  # responses are built once, then replayed from memory
+        self.upstream_calls = 0
+
+    def __enter__(self) -> 'Replayer':
+        self._original_send = HTTPAdapter.send
+        replayer = self
+
+        def send(adapter, request, **kwargs):
+            return replayer.send(adapter, request, **kwargs)
+        HTTPAdapter.send = send
+        return self
+
+    def __exit__(self, *exc_info):
+        HTTPAdapter.send = self._original_send
+
+    def send(self, adapter: HTTPAdapter, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        self.upstream_calls += 1
+        name = fixture_name(request)
+        if self._record:
+            response = self._original_send(adapter, request, **kwargs)
+            self._save(name, request, response)
+            return response
+        if name not in self._bodies:
+            self._bodies[name] = self._load(name) or self._synthesize(request)
+        status, body = self._bodies[name]
+        response = requests.Response()
+        response.status_code = status
+        response._content = body
+        response.headers['Content-Type'] = 'application/json'
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def _synthesize(self, request: requests.PreparedRequest) -> Tuple[int, bytes]:
+        status, body = synthetic_response(request)
+        return status, json.dumps(body).encode('utf-8')
+
+    def _load(self, name: str) -> Optional[Tuple[int, bytes]]:
+        if self._fixtures_dir is None:
+            return None
+        path = os.path.join(self._fixtures_dir, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            fixture = json.load(f)
+        return fixture['status'], fixture['body'].encode('utf-8')
+
+    def _save(self, name: str, request: requests.PreparedRequest, response: requests.Response) -> None:
+        os.makedirs(self._fixtures_dir, exist_ok=True)
+        parts = urlsplit(request.url)
+        with open(os.path.join(self._fixtures_dir, name), 'w') as f:
+            json.dump(dict(method=request.method, url='{}://{}{}'.format(parts.scheme, parts.netloc, parts.path),
+                           params=_request_params(request), status=response.status_code, body=response.text), f)
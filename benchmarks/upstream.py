@@ -0,0 +1,296 @@
+"""
+A local stand-in for the Twitter (counts and search), YouTube search and Pushshift APIs, for load testing. It pages
+through results the way each real API does, and can model slow responses, rate limits and running out of quota:
+
+    python -m benchmarks.upstream --port 8081 --latency lognormal:250:0.6 --endpoint-latency twitter-counts=fixed:900
+    python -m benchmarks.upstream --rate-limit 300 --rate-window 900 --quota 5000 --error-rate 0.01
+
+Point glimpse at it with:
+
+    TWITTER_API_URL=http://localhost:8081/2/ YT_SEARCH_API_URL=http://localhost:8081/youtube/v3/search \
+        REDDIT_PUSHSHIFT_URL=http://localhost:8081 ./run.sh
+
+Latency specs are `fixed:MS`, `uniform:MIN_MS:MAX_MS`, `normal:MEAN_MS:STDDEV_MS`, `lognormal:MEDIAN_MS:SIGMA` or
+`exponential:MEAN_MS`. `GET /_stats` returns how many calls each endpoint has had (and how many were refused), and
+`POST /_reset` zeroes those counts along with the rate limits and quotas.
+"""
+import argparse
+import datetime as dt
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Callable, Dict, Optional
+
+import gevent
+from gevent.pywsgi import WSGIServer
+from flask import Flask, jsonify, request
+
+from benchmarks import payloads
+
+TWITTER_COUNTS = 'twitter-counts'
+TWITTER_SEARCH = 'twitter-search'
+YOUTUBE_SEARCH = 'youtube-search'
+PUSHSHIFT_SEARCH = 'pushshift-search'
+ENDPOINTS = [TWITTER_COUNTS, TWITTER_SEARCH, YOUTUBE_SEARCH, PUSHSHIFT_SEARCH]
+
+# the most buckets a page of Twitter counts holds, by granularity
+TWITTER_COUNTS_PAGE_SIZE = {'day': 31, 'hour': 168, 'minute': 1440}
+TWITTER_GRANULARITY_SECONDS = {'day': 60 * 60 * 24, 'hour': 60 * 60, 'minute': 60}
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    :param spec: a distribution and its parameters in milliseconds, ie. `lognormal:250:0.6` (see the module docs)
+    :return: a function that draws a delay in seconds from that distribution
+    """
+    name, *args = spec.split(':')
+    args = [float(a) for a in args]
+    distributions = {
+        'fixed': lambda rng: args[0],
+        'uniform': lambda rng: rng.uniform(args[0], args[1]),
+        'normal': lambda rng: rng.gauss(args[0], args[1]),
+        'lognormal': lambda rng: args[0] * rng.lognormvariate(0, args[1]),
+        'exponential': lambda rng: rng.expovariate(1 / args[0]) if args[0] > 0 else 0,
+    }
+    if name not in distributions:
+        raise ValueError("Unknown latency distribution {} (use one of {})".format(name, list(distributions.keys())))
+    draw = distributions[name]
+    return lambda rng: max(0.0, draw(rng)) / 1000
+
+
+def _stable_count(*parts) -> int:
+    # the same query always gets the same counts, so responses are cacheable and comparable across runs
+    return zlib.crc32(':'.join(str(p) for p in parts).encode('utf-8')) % 20000
+
+
+def _twitter_time(value: dt.datetime) -> str:
+    return value.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def _parse_twitter_time(value: str) -> dt.datetime:
+    return dt.datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+
+
+class SimulatedUpstream:
+    """
+    Holds the behaviour settings and per-endpoint call counts, rate limit windows and quotas for one simulated server.
+    """
+
+    def __init__(self, latency: str = 'fixed:0', endpoint_latency: Dict[str, str] = None, rate_limit: int = 0,
+                 rate_window: float = 900, quota: int = 0, error_rate: float = 0, results: int = 2000, seed: int = 0):
+        """
+        :param latency: the default latency spec for every endpoint
+        :param endpoint_latency: latency specs for specific endpoints (any of ENDPOINTS)
+        :param rate_limit: requests each endpoint allows per rate_window before answering with a 429 (0 for no limit)
+        :param rate_window: seconds in each rate limit window
+        :param quota: requests each platform allows in total before its quota runs out (0 for no quota)
+        :param error_rate: the fraction of requests that get a 429 even when under the limits
+        :param results: how many tweets, videos or submissions each search matches, to page through
+        :param seed: for the random latencies and errors
+        """
+        self._latency = {endpoint: parse_latency((endpoint_latency or {}).get(endpoint, latency))
+                         for endpoint in ENDPOINTS}
+        self._rate_limit = rate_limit
+        self._rate_window = rate_window
+        self._quota = quota
+        self._error_rate = error_rate
+        self.results = results
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stats = dict(calls=Counter(), rate_limited=Counter(), quota_exceeded=Counter(), errors=Counter())
+            self._windows = {}  # endpoint -> (window start, requests in it)
+
+    def admit(self, endpoint: str) -> Optional[str]:
+        """
+        Count a request, sleep for its simulated latency and decide whether to serve it.
+        :return: None to serve it, or why it is refused ('quota', 'rate' or 'error')
+        """
+        with self._lock:
+            self.stats['calls'][endpoint] += 1
+            delay = self._latency[endpoint](self._rng)
+            platform_calls = sum(count for e, count in self.stats['calls'].items()
+                                 if e.split('-')[0] == endpoint.split('-')[0])
+            window_start, window_calls = self._windows.get(endpoint, (time.monotonic(), 0))
+            if time.monotonic() - window_start >= self._rate_window:
+                window_start, window_calls = time.monotonic(), 0
+            self._windows[endpoint] = (window_start, window_calls + 1)
+            if (self._quota > 0) and (platform_calls > self._quota):
+                refusal = 'quota'
+                self.stats['quota_exceeded'][endpoint] += 1
+            elif (self._rate_limit > 0) and (window_calls >= self._rate_limit):
+                refusal = 'rate'
+                self.stats['rate_limited'][endpoint] += 1
+            elif self._rng.random() < self._error_rate:
+                refusal = 'error'
+                self.stats['errors'][endpoint] += 1
+            else:
+                refusal = None
+        gevent.sleep(delay)
+        return refusal
+
+    def rate_limit_reset(self, endpoint: str) -> int:
+        window_start, _ = self._windows.get(endpoint, (time.monotonic(), 0))
+        return int(time.time() + max(0.0, self._rate_window - (time.monotonic() - window_start)))
+
+
+def _offset(token: Optional[str]) -> int:
+    return int(token) if token else 0
+
+
+def twitter_counts(params: Dict) -> Dict:
+    """
+    Counts for each bucket in the range, newest first, a page at a time (like the real API).
+    """
+    granularity = params.get('granularity', 'hour')
+    step = TWITTER_GRANULARITY_SECONDS[granularity]
+    start = _parse_twitter_time(params['start_time'])
+    end = _parse_twitter_time(params['end_time'])
+    buckets = max(1, int((end - start).total_seconds() // step))
+    offset = _offset(params.get('next_token'))
+    page = range(offset, min(buckets, offset + TWITTER_COUNTS_PAGE_SIZE[granularity]))
+    data = []
+    for index in page:
+        bucket_end = end - dt.timedelta(seconds=step * index)
+        bucket_start = bucket_end - dt.timedelta(seconds=step)
+        data.append({'start': _twitter_time(bucket_start), 'end': _twitter_time(bucket_end),
+                     'tweet_count': _stable_count(params.get('query'), bucket_start)})
+    meta = {'total_tweet_count': sum(d['tweet_count'] for d in data)}
+    if page.stop < buckets:
+        meta['next_token'] = str(page.stop)
+    return {'data': data, 'meta': meta}
+
+
+def twitter_search(params: Dict, results: int) -> Dict:
+    offset = _offset(params.get('next_token'))
+    count = max(0, min(int(params.get('max_results', 10)), results - offset))
+    if count == 0:
+        return {'meta': {'result_count': 0}}
+    page = payloads.twitter_search_page(tweets=count, seed=offset)
+    page['meta']['next_token'] = str(offset + count) if offset + count < results else None
+    if page['meta']['next_token'] is None:
+        del page['meta']['next_token']
+    return page
+
+
+def youtube_search(params: Dict, results: int) -> Dict:
+    offset = _offset(params.get('pageToken'))
+    count = max(0, min(int(params.get('maxResults', 5)), results - offset))
+    page = payloads.youtube_search_page(videos=count, seed=offset)
+    if offset + count < results:
+        page['nextPageToken'] = str(offset + count)
+    else:
+        del page['nextPageToken']
+    page['pageInfo']['totalResults'] = results
+    return page
+
+
+def pushshift_search(params: Dict, results: int) -> Dict:
+    """
+    Histogram searches get a bucket per day. Otherwise submissions are spread evenly over the range, and each search
+    returns the newest ones created before `until` (which is how clients page through them).
+    """
+    since = int(params.get('since', 0))
+    until = int(params.get('until', time.time()))
+    if 'calendar_histogram' in params:
+        days = max(1, (until - since) // (60 * 60 * 24))
+        return payloads.pushshift_search(submissions=0, histogram_days=days,
+                                         start=dt.datetime.utcfromtimestamp(since))
+    spacing = max(1, (until - since) // max(1, results))
+    newest = until - 1 - ((until - 1 - since) % spacing)  # line up with the same grid on every page
+    created = [c for c in range(newest, since - 1, -spacing)][:int(params.get('limit', 25))]
+    page = payloads.pushshift_search(submissions=len(created), seed=newest)
+    for submission, created_utc in zip(page['data'], created):
+        submission['created_utc'] = created_utc
+        submission['id'] = format(created_utc, 'x')
+    return page
+
+
+def _refusal_response(endpoint: str, refusal: str, upstream: SimulatedUpstream):
+    """
+    :return: an error shaped like the one the real platform sends for this
+    """
+    if endpoint == YOUTUBE_SEARCH:
+        reason = 'quotaExceeded' if refusal == 'quota' else 'rateLimitExceeded'
+        return jsonify(error={'code': 403, 'message': "The request cannot be completed because you have exceeded "
+                                                      "your quota." if refusal == 'quota' else "Rate Limit Exceeded",
+                              'errors': [{'domain': 'youtube.quota', 'reason': reason}]}), 403
+    if endpoint in [TWITTER_COUNTS, TWITTER_SEARCH]:
+        if refusal == 'quota':
+            body = dict(title='UsageCapExceeded', detail='Usage cap exceeded: Monthly product cap', status=429,
+                        type='https://api.twitter.com/2/problems/usage-capped')
+        else:
+            body = dict(title='Too Many Requests', detail='Too Many Requests', status=429, type='about:blank')
+        headers = {'x-rate-limit-remaining': '0', 'x-rate-limit-reset': str(upstream.rate_limit_reset(endpoint))}
+        return jsonify(body), 429, headers
+    return jsonify(detail='Too Many Requests'), 429
+
+
+def create_app(upstream: SimulatedUpstream) -> Flask:
+    app = Flask(__name__)
+
+    def serve(endpoint: str, build: Callable[[Dict], Dict]):
+        refusal = upstream.admit(endpoint)
+        if refusal is not None:
+            return _refusal_response(endpoint, refusal, upstream)
+        return jsonify(build(request.args.to_dict()))
+
+    @app.route('/2/tweets/counts/all')
+    def twitter_counts_all():
+        return serve(TWITTER_COUNTS, twitter_counts)
+
+    @app.route('/2/tweets/search/all')
+    def twitter_search_all():
+        return serve(TWITTER_SEARCH, lambda params: twitter_search(params, upstream.results))
+
+    @app.route('/youtube/v3/search')
+    def youtube_v3_search():
+        return serve(YOUTUBE_SEARCH, lambda params: youtube_search(params, upstream.results))
+
+    @app.route('/reddit/search/submissions')
+    def reddit_search_submissions():
+        return serve(PUSHSHIFT_SEARCH, lambda params: pushshift_search(params, upstream.results))
+
+    @app.route('/_stats')
+    def stats():
+        return jsonify(upstream.stats)
+
+    @app.route('/_reset', methods=['POST'])
+    def reset():
+        upstream.reset()
+        return jsonify(upstream.stats)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', default='lognormal:250:0.6', help="latency spec for every endpoint")
+    parser.add_argument('--endpoint-latency', action='append', default=[], metavar='ENDPOINT=SPEC',
+                        help="latency spec for one of {}".format(", ".join(ENDPOINTS)))
+    parser.add_argument('--rate-limit', type=int, default=0, help="requests per endpoint per window (0 for none)")
+    parser.add_argument('--rate-window', type=float, default=900, help="seconds in each rate limit window")
+    parser.add_argument('--quota', type=int, default=0, help="requests per platform before quota runs out (0 for none)")
+    parser.add_argument('--error-rate', type=float, default=0, help="fraction of requests that get a random 429")
+    parser.add_argument('--results', type=int, default=2000, help="items each search matches")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    endpoint_latency = dict(spec.split('=', 1) for spec in args.endpoint_latency)
+    unknown = set(endpoint_latency.keys()) - set(ENDPOINTS)
+    if unknown:
+        parser.error("Unknown endpoints {} (use {})".format(sorted(unknown), ", ".join(ENDPOINTS)))
+    upstream = SimulatedUpstream(args.latency, endpoint_latency, args.rate_limit, args.rate_window, args.quota,
+                                 args.error_rate, args.results, args.seed)
+    print("Simulated upstream listening on http://{}:{}".format(args.host, args.port))
+    WSGIServer((args.host, args.port), create_app(upstream), log=None).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
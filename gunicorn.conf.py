@@ -0,0 +1,40 @@
+# gunicorn reads this automatically when started from the project root (see run.sh and Procfile)
+import os
+import signal
+
+
+def post_worker_init(worker):
+    # optionally build all the platform providers as soon as each worker boots, instead of on its first request
+    if os.environ.get('WARM_UP_PROVIDERS', '').lower() in ['1', 'true', 'yes']:
+        import server.platforms
+        server.platforms.warm_up()
+    # `kill -USR1 <master pid>` makes every worker reopen its logs (gunicorn's default) and also rebuild its platform
+    # providers with the API keys currently in the environment and .env file
+    reopen_logs = worker.handle_usr1
+
+    def reload_on_usr1(sig, frame):
+        import threading
+        import server.platforms
+        reopen_logs(sig, frame)
+        # not in the signal handler itself, which could have interrupted a thread holding the providers lock
+        threading.Thread(target=server.platforms.reload_providers, daemon=True).start()
+
+    worker.handle_usr1 = reload_on_usr1
+    signal.signal(signal.SIGUSR1, reload_on_usr1)
+
+
+def on_starting(server):
+    # metrics files left over from the workers of a previous run would otherwise get added to this run's totals
+    metrics_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+        for name in os.listdir(metrics_dir):
+            if name.endswith('.db'):
+                os.remove(os.path.join(metrics_dir, name))
+
+
+def child_exit(server, worker):
+    # tell prometheus_client a worker is gone, so its live values stop being reported
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
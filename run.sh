@@ -1,3 +1,9 @@
 #!/usr/bin/env bash
 
-gunicorn server:app -k gevent --timeout 500 -b "0.0.0.0:8000"
+# run a job worker (see worker.py) in the background, restarting it if it dies, unless jobs are run by a separate
+# container (RUN_JOB_WORKER=false)
+if [ "${RUN_JOB_WORKER:-true}" = "true" ]; then
+  (while true; do python worker.py; echo "Job worker exited, restarting" >&2; sleep 5; done) &
+fi
+
+exec gunicorn server:app -k gevent --timeout 500 -b "0.0.0.0:8000"
@@ -22,12 +22,103 @@ logger.info("-------------------------------------------------------------------
 # load the env vars
 load_dotenv()
 
-MC_API_KEY = os.environ.get('MC_API_KEY', None)
 CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', None)
 SENTRY_DSN = os.environ.get('SENTRY_DSN', None)
-YOUTUBE_API_KEY = os.environ.get('YOUTUBE_API_KEY', None)
-TWITTER_API_BEARER_TOKEN = os.environ.get('TWITTER_API_BEARER_TOKEN', None)
-MEDIA_CLOUD_API_KEY = os.environ.get('MEDIA_CLOUD_API_KEY', None)
+# upstream API credentials (set by `load_api_keys` below)
+MC_API_KEY = None
+YOUTUBE_API_KEY = None
+TWITTER_API_BEARER_TOKEN = None
+MEDIA_CLOUD_API_KEY = None
+
+
+def load_api_keys() -> None:
+    """
+    (Re)read the upstream API credentials from the environment, so they can be changed without a restart (see
+    `server.platforms.reload_providers`). Read them as `server.YOUTUBE_API_KEY` etc. to see the latest values.
+    """
+    global MC_API_KEY, YOUTUBE_API_KEY, TWITTER_API_BEARER_TOKEN, MEDIA_CLOUD_API_KEY
+    MC_API_KEY = os.environ.get('MC_API_KEY', None)
+    YOUTUBE_API_KEY = os.environ.get('YOUTUBE_API_KEY', None)
+    TWITTER_API_BEARER_TOKEN = os.environ.get('TWITTER_API_BEARER_TOKEN', None)
+    MEDIA_CLOUD_API_KEY = os.environ.get('MEDIA_CLOUD_API_KEY', None)
+
+
+load_api_keys()
+
+# tuning for the pooled HTTP connections we use to talk to upstream platform APIs
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 60))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 3))
+HTTP_RETRY_BACKOFF = float(os.environ.get('HTTP_RETRY_BACKOFF', 0.5))
+
+# how long to cache results: ranges ending in the last few days expire quickly, closed ones are kept up to the ceiling
+CACHE_RECENT_DAYS = int(os.environ.get('CACHE_RECENT_DAYS', 2))
+CACHE_RECENT_EXPIRATION_TIME = int(os.environ.get('CACHE_RECENT_EXPIRATION_TIME', 60*60))
+CACHE_REDIS_EXPIRATION_TIME = int(os.environ.get('CACHE_REDIS_EXPIRATION_TIME', 60*60*24*30))
+# seconds one process can hold the lock on regenerating a cached value, so a crashed one can't block it forever
+CACHE_LOCK_TIMEOUT = int(os.environ.get('CACHE_LOCK_TIMEOUT', 60*10))
+
+# optional in-process cache in front of redis (disabled when max entries is 0)
+CACHE_L1_MAX_ENTRIES = int(os.environ.get('CACHE_L1_MAX_ENTRIES', 0))
+CACHE_L1_MAX_BYTES = int(os.environ.get('CACHE_L1_MAX_BYTES', 64*1024*1024))
+CACHE_L1_TTL = float(os.environ.get('CACHE_L1_TTL', 30))
+# seconds that dates in cache keys get rounded down to, so near-identical date ranges share cached results
+CACHE_KEY_DATE_GRANULARITY = int(os.environ.get('CACHE_KEY_DATE_GRANULARITY', 60*60))
+# cached values at least this many bytes get compressed (with this codec, at this level) before going to redis
+CACHE_CODEC = os.environ.get('CACHE_CODEC', 'zlib')
+CACHE_COMPRESSION_THRESHOLD = int(os.environ.get('CACHE_COMPRESSION_THRESHOLD', 1024))
+CACHE_COMPRESSION_LEVEL = int(os.environ.get('CACHE_COMPRESSION_LEVEL', 3))
+
+# seconds to cache each kind of online news result for - samples change the most, aggregate counts the least
+ONLINE_NEWS_SAMPLE_CACHE_TTL = int(os.environ.get('ONLINE_NEWS_SAMPLE_CACHE_TTL', 60*60))
+ONLINE_NEWS_COUNT_CACHE_TTL = int(os.environ.get('ONLINE_NEWS_COUNT_CACHE_TTL', 60*60*12))
+ONLINE_NEWS_WORDS_CACHE_TTL = int(os.environ.get('ONLINE_NEWS_WORDS_CACHE_TTL', 60*60*24))
+ONLINE_NEWS_TAGS_CACHE_TTL = int(os.environ.get('ONLINE_NEWS_TAGS_CACHE_TTL', 60*60*24))
+
+# the total-content series that normalized counts divide by is shared by every query on a platform, so its recent
+# days only get re-fetched this often (seconds); it can also be precomputed for this many days back at warm up
+NORMALIZATION_CACHE_TTL = int(os.environ.get('NORMALIZATION_CACHE_TTL', 60*60*24))
+NORMALIZATION_WARM_UP_DAYS = int(os.environ.get('NORMALIZATION_WARM_UP_DAYS', 0))
+
+# API responses at least this many bytes get compressed (brotli if it is installed and the client accepts it, else
+# gzip) at these levels
+RESPONSE_COMPRESSION_THRESHOLD = int(os.environ.get('RESPONSE_COMPRESSION_THRESHOLD', 1024))
+RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', 6))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', 5))
+
+# seconds browsers and proxies may reuse GET API responses for closed date ranges (recent ones use
+# CACHE_RECENT_EXPIRATION_TIME)
+HTTP_CACHE_MAX_AGE = int(os.environ.get('HTTP_CACHE_MAX_AGE', 60*60*24))
+
+# how many items sample exports include by default, and at most
+EXPORT_SAMPLE_SIZE = int(os.environ.get('EXPORT_SAMPLE_SIZE', 1000))
+EXPORT_MAX_SAMPLE_SIZE = int(os.environ.get('EXPORT_MAX_SAMPLE_SIZE', 50000))
+
+# batch requests can compare up to this many queries, running this many at once, within this many seconds
+BATCH_MAX_QUERIES = int(os.environ.get('BATCH_MAX_QUERIES', 50))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 4))
+BATCH_TIMEOUT = float(os.environ.get('BATCH_TIMEOUT', 120))
+
+# how many jobs each job worker process runs at once, and seconds to keep their status and results around
+JOB_WORKER_THREADS = int(os.environ.get('JOB_WORKER_THREADS', 4))
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 60*60*24))
+
+# where to reach the upstream platform APIs (override these to point at a stand-in, ie. benchmarks/upstream.py)
+TWITTER_API_URL = os.environ.get('TWITTER_API_URL', 'https://api.twitter.com/2/')
+YT_SEARCH_API_URL = os.environ.get('YT_SEARCH_API_URL', 'https://www.googleapis.com/youtube/v3/search')
+REDDIT_PUSHSHIFT_URL = os.environ.get('REDDIT_PUSHSHIFT_URL', 'https://beta.pushshift.io')
+
+# a directory (wiped when gunicorn starts) for each worker to write its metrics to, so /metrics can report totals
+# across all of them; prometheus_client reads this itself, it just has to be set before it is imported
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR', None)
+
+# profile a random sample of API requests (this fraction of them), and any sent with this token in the
+# X-Glimpse-Profile header, keeping the most recent profiles in this directory
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_ADMIN_TOKEN = os.environ.get('PROFILE_ADMIN_TOKEN', None)
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(base_dir, 'logs', 'profiles'))
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
 
 # setup optional sentry logging service
 if SENTRY_DSN is not None:
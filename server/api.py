@@ -1,93 +1,367 @@
 import logging
-from flask import jsonify, render_template, request, make_response
+from flask import render_template, request, send_file, Response
 from dateutil import parser as date_parser
-import io
-import csv
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial, reduce
+import operator
 
-from server import app
-from server.util.request import api_error_handler, arguments_required
+from server import app, EXPORT_SAMPLE_SIZE, EXPORT_MAX_SAMPLE_SIZE, BATCH_MAX_QUERIES, BATCH_CONCURRENCY, \
+    BATCH_TIMEOUT
+from server.util.cache import cache_stats, cache_on_arguments, recency_expiration, canonical_key, canonical_query
+from server.util.concurrency import timed_call, in_current_context, run_with_deadlines, STATUS_OK, STATUS_ERROR
+from server.util.request import api_error_handler, arguments_required, json_error_response, validate_params_exist
+from server.util.response import encode_json, json_response, json_bytes_response, compress_response, \
+    conditional_response, http_max_age, export_response
 import server.platforms as platforms
+import server.jobs as jobs
+from server.platforms.exceptions import UnsupportedOperationException
+from server.platforms.provider import ContentProvider
+from server.util.timeseries import TimeSeries, DAY, GRANULARITIES
+from server.util import metrics, profiling
 
 logger = logging.getLogger(__name__)
 
+# seconds each platform gets to answer a fan-out query before we give up on it
+DEFAULT_FAN_OUT_TIMEOUT = 20
+FAN_OUT_OPERATIONS = ['count', 'count_over_time', 'sample']
+# columns of the series exports
+COUNT_FIELDS = ['date', 'timestamp', 'count']
+NORMALIZED_COUNT_FIELDS = ['date', 'total_count', 'count', 'ratio']
+
+app.before_request(metrics.start_request_timer)
+app.before_request(profiling.start_request)
+# after_request hooks run in reverse order, so the profiler (registered first) stops last
+app.after_request(profiling.finish_request)
+app.after_request(compress_response)
+app.after_request(metrics.observe_request)
+app.teardown_request(profiling.abandon_request)
+
 
 # set up all the views
 @app.route('/')
 def index():
     logger.debug("homepage request")
     plaform_list = platforms.available_platforms()
-    return render_template('index.html', platforms=plaform_list)
+    return render_template('index.html', platforms=plaform_list, granularities=GRANULARITIES)
 
 
 def _parse_query():
-    data = request.json
-    platform_parts = [d.strip() for d in data['platform'].split("/")]
-    query = dict(
-        terms=data['terms'],
+    # GET requests have the same fields in the query string
+    data = request.json if request.method == 'POST' else request.args
+    query = _parse_platform_and_range(data)
+    query['terms'] = data['terms']
+    return query
+
+
+def _parse_platform_and_range(data) -> dict:
+    platform, platform_source = platforms.platform_parts(data['platform'])
+    return dict(
         start_date=date_parser.parse(data['startDate']),
         end_date=date_parser.parse(data['endDate']),
-        platform=platform_parts[0],
-        platform_source=platform_parts[1]
+        platform=platform,
+        platform_source=platform_source,
+        granularity=data.get('granularity', DAY),
     )
-    return query
 
 
-@app.route('/api/count-over-time.json', methods=['POST'])
+@cache_on_arguments(expiration_time=recency_expiration())
+def _cached_json(operation: str, platform: str, source: str, terms: str, start_date, end_date, **kwargs) -> bytes:
+    """
+    Run a provider operation and cache its results already encoded as JSON, so repeat requests can be sent straight
+    from the cache.
+    """
+    provider = platforms.provider_for(platform, source)
+    return encode_json(getattr(provider, operation)(terms, start_date, end_date, **kwargs))
+
+
+def _cached_json_response(operation: str, query: dict, **kwargs):
+    response = json_bytes_response(_cached_json(operation, query['platform'], query['platform_source'],
+                                                query['terms'], query['start_date'], query['end_date'], **kwargs))
+    if request.method == 'GET':
+        # only GETs can be reused by browsers and proxies
+        key = canonical_key('api:{}'.format(operation), query=query, kwargs=kwargs)
+        response = conditional_response(response, key, http_max_age(query['end_date']))
+    return response
+
+
+@app.route('/api/count-over-time.json', methods=['GET', 'POST'])
 @api_error_handler
 def api_count_over_time():
+    query = _parse_query()
+    return _cached_json_response('count_over_time', query, granularity=query['granularity'])
+
+
+@app.route('/api/count-over-time.<any(csv, ndjson):export_format>', methods=['GET'])
+@api_error_handler
+@arguments_required('platform', 'terms', 'startDate', 'endDate')
+def api_count_over_time_export(export_format):
     query = _parse_query()
     provider = platforms.provider_for(query['platform'], query['platform_source'])
-    results = provider.count_over_time(query['terms'], query['start_date'], query['end_date'])
-    return jsonify(results)
+    series = provider.count_series(query['terms'], query['start_date'], query['end_date'],
+                                   granularity=query['granularity'])
+    return export_response(series.iter_counts(), export_format, 'count-over-time', COUNT_FIELDS)
 
 
-@app.route('/api/count-over-time.csv', methods=['GET'])
+@app.route('/api/normalized-count-over-time.<any(csv, ndjson):export_format>', methods=['GET'])
 @api_error_handler
 @arguments_required('platform', 'terms', 'startDate', 'endDate')
-def api_count_over_time_csv():
-    platform_parts = [d.strip() for d in request.args['platform'].split("/")]
-    query = dict(
-        terms=request.args['terms'],
-        start_date=date_parser.parse(request.args['startDate']),
-        end_date=date_parser.parse(request.args['endDate']),
-        platform=platform_parts[0],
-        platform_source=platform_parts[1]
-    )
+def api_normalized_count_over_time_export(export_format):
+    query = _parse_query()
     provider = platforms.provider_for(query['platform'], query['platform_source'])
-    results = provider.count_over_time(query['terms'], query['start_date'], query['end_date'])
-    # now send csv
-    si = io.StringIO()
-    cw = csv.DictWriter(si, fieldnames=results['counts'][0].keys())
-    cw.writeheader()
-    cw.writerows(results['counts'])
-    output = make_response(si.getvalue())
-    output.headers["Content-Disposition"] = "attachment; filename=export.csv"
-    output.headers["Content-type"] = "text/csv"
-    return output
-
-
-@app.route('/api/normalized-count-over-time.json', methods=['POST'])
+    matching_series, no_query_series = provider.normalized_count_series(
+        query['terms'], query['start_date'], query['end_date'], granularity=query['granularity'])
+    return export_response(matching_series.iter_normalized_counts(no_query_series), export_format,
+                           'normalized-count-over-time', NORMALIZED_COUNT_FIELDS)
+
+
+@app.route('/api/sample.<any(csv, ndjson):export_format>', methods=['GET'])
 @api_error_handler
-def api_normalized_count_over_time():
+@arguments_required('platform', 'terms', 'startDate', 'endDate')
+def api_sample_export(export_format):
+    """
+    Stream up to `limit` items of content, paging through the platform's results as they are written out.
+    """
     query = _parse_query()
+    limit = int(request.args.get('limit', EXPORT_SAMPLE_SIZE))
+    if not 0 < limit <= EXPORT_MAX_SAMPLE_SIZE:
+        raise ValueError("limit must be between 1 and {}".format(EXPORT_MAX_SAMPLE_SIZE))
     provider = platforms.provider_for(query['platform'], query['platform_source'])
-    results = provider.normalized_count_over_time(query['terms'], query['start_date'], query['end_date'])
-    return jsonify(results)
+    rows = provider.iter_sample(query['terms'], query['start_date'], query['end_date'], limit=limit)
+    return export_response(rows, export_format, 'sample')
 
 
-@app.route('/api/count.json', methods=['POST'])
+@app.route('/api/normalized-count-over-time.json', methods=['GET', 'POST'])
+@api_error_handler
+def api_normalized_count_over_time():
+    query = _parse_query()
+    return _cached_json_response('normalized_count_over_time', query, granularity=query['granularity'])
+
+
+@app.route('/api/count.json', methods=['GET', 'POST'])
 @api_error_handler
 def api_count():
     query = _parse_query()
-    provider = platforms.provider_for(query['platform'], query['platform_source'])
-    results = provider.count(query['terms'], query['start_date'], query['end_date'])
-    return jsonify(results)
+    return _cached_json_response('count', query)
 
 
-@app.route('/api/sample.json', methods=['POST'])
+@app.route('/api/sample.json', methods=['GET', 'POST'])
 @api_error_handler
 def api_sample():
+    query = _parse_query()
+    return _cached_json_response('sample', query, limit=50)
+
+
+@app.route('/api/glimpse.json', methods=['POST'])
+@api_error_handler
+def api_glimpse():
+    """
+    Everything the search page needs in one request: attention over time, total attention and a sample of content.
+    The parts are fetched concurrently, and the total is derived from the series where possible so we don't go
+    upstream twice for the same data.
+    """
     query = _parse_query()
     provider = platforms.provider_for(query['platform'], query['platform_source'])
-    results = provider.sample(query['terms'], query['start_date'], query['end_date'], limit=50)
-    return jsonify(results)
+    args = (query['terms'], query['start_date'], query['end_date'])
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = {}
+        futures['count_over_time'] = executor.submit(in_current_context(timed_call), provider.count_over_time,
+                                                     *args, granularity=query['granularity'])
+        futures['count'] = executor.submit(in_current_context(timed_call), _count_from_series, provider,
+                                           futures['count_over_time'], *args)
+        futures['sample'] = executor.submit(in_current_context(timed_call), provider.sample, *args, limit=50)
+    results = dict(timings={}, errors={})
+    for part, future in futures.items():
+        try:
+            results[part], results['timings'][part] = future.result()
+        except Exception as e:
+            results[part] = None
+            results['errors'][part] = str(e)
+    return json_response(results)
+
+
+def _count_from_series(provider: ContentProvider, series_future: Future, *args) -> int:
+    try:
+        series, _ = series_future.result()
+    except UnsupportedOperationException:
+        # some platforms can count but not count over time, so we have to ask them directly
+        return provider.count(*args)
+    if 'total' in series:
+        return series['total']
+    return sum([d['count'] for d in series['counts']])
+
+
+@app.route('/api/fan-out.json', methods=['POST'])
+@api_error_handler
+def api_fan_out():
+    """
+    Run the same query against many platforms at once. Each platform gets its own timeout, and we return whatever
+    came back in time along with a status for each platform (`ok`, `timeout` or `error`).
+    Optional JSON fields: `platforms` (defaults to all of them), `operation` (one of FAN_OUT_OPERATIONS, defaults to
+    `count`) and `timeout` (seconds, either one number for all platforms or a dict keyed by platform).
+    """
+    data = request.json
+    start_date = date_parser.parse(data['startDate'])
+    end_date = date_parser.parse(data['endDate'])
+    operation = data.get('operation', 'count')
+    if operation not in FAN_OUT_OPERATIONS:
+        raise ValueError("Unsupported operation {}".format(operation))
+    platform_names = data.get('platforms', platforms.available_platforms())
+    # a malformed name is a mistake in the request, so it fails the whole thing instead of just that platform
+    platform_keys = {platform_name: platforms.platform_parts(platform_name) for platform_name in platform_names}
+    timeout = data.get('timeout', DEFAULT_FAN_OUT_TIMEOUT)
+    tasks = {}
+    timeouts = {}
+    unavailable = {}
+    for platform_name in platform_names:
+        try:
+            provider = platforms.provider_for(*platform_keys[platform_name])
+        except Exception as e:
+            # one unknown (or misconfigured) platform shouldn't stop us answering for the others
+            unavailable[platform_name] = dict(status=STATUS_ERROR, result=None, error=str(e), elapsed=0)
+            continue
+        tasks[platform_name] = partial(getattr(provider, operation), data['terms'], start_date, end_date)
+        timeouts[platform_name] = float(timeout.get(platform_name, DEFAULT_FAN_OUT_TIMEOUT)
+                                        if isinstance(timeout, dict) else timeout)
+    results = dict(run_with_deadlines(tasks, timeouts), **unavailable)
+    return json_response({platform_name: results[platform_name] for platform_name in platform_names})
+
+
+@app.route('/api/batch.json', methods=['POST'])
+@api_error_handler
+def api_batch():
+    """
+    Compare how much content matches each of a list of queries over time, on one platform and date range. Queries
+    run concurrently (BATCH_CONCURRENCY at a time) and share anything they have in common: repeated queries are only
+    run once, and with `normalize` set the denominator series is fetched just once for all of them. Every series comes
+    back aligned to the same list of `dates`, and each query gets its own `status` (`ok`, `timeout` or `error`).
+    JSON fields: `platform`, `startDate`, `endDate`, `queries` (a list of search terms) and optionally `granularity`
+    and `normalize`.
+    """
+    data = request.json
+    query = _parse_platform_and_range(data)
+    queries = data['queries']
+    if not 0 < len(queries) <= BATCH_MAX_QUERIES:
+        raise ValueError("Send between 1 and {} queries".format(BATCH_MAX_QUERIES))
+    provider = platforms.provider_for(query['platform'], query['platform_source'])
+    args = (query['start_date'], query['end_date'])
+    tasks = {}
+    for terms in queries:
+        tasks.setdefault(canonical_query(terms), partial(provider.count_series, terms, *args,
+                                                         granularity=query['granularity']))
+    if data.get('normalize', False):
+        # the one thing every query needs, so it goes first
+        tasks = dict(__denominator__=partial(provider.denominator_series, *args, granularity=query['granularity']),
+                     **tasks)
+    results = run_with_deadlines(tasks, {name: BATCH_TIMEOUT for name in tasks}, max_workers=BATCH_CONCURRENCY)
+    denominator = results.pop('__denominator__', None)
+    # line every series up on the same periods
+    series = [r['result'] for r in results.values() if r['status'] == STATUS_OK]
+    if (denominator is not None) and (denominator['status'] == STATUS_OK):
+        series.append(denominator['result'])
+    # adding them together gives a series covering every period any of them has
+    aligned = reduce(operator.add, series) if len(series) > 0 else TimeSeries([], [])
+    return json_response(dict(
+        dates=aligned.dates(),
+        denominator=None if denominator is None else _batch_series(denominator, aligned),
+        results=[dict(terms=terms, **_batch_series(results[canonical_query(terms)], aligned,
+                                                   denominator=denominator)) for terms in queries],
+        progress={status: len([r for r in results.values() if r['status'] == status])
+                  for status in set(r['status'] for r in results.values())},
+    ))
+
+
+def _batch_series(result: dict, aligned: TimeSeries, denominator: dict = None) -> dict:
+    summary = dict(status=result['status'], error=result['error'], elapsed=result['elapsed'], counts=None,
+                   total=None)
+    if denominator is not None:
+        summary['ratios'] = None
+    if result['status'] == STATUS_OK:
+        series = result['result'].reindex(aligned.periods)
+        summary['counts'] = series.counts
+        summary['total'] = series.total()
+        if (denominator is not None) and (denominator['status'] == STATUS_OK):
+            summary['ratios'] = series.ratio(denominator['result'].reindex(aligned.periods))
+    return summary
+
+
+@app.route('/api/jobs.json', methods=['POST'])
+@api_error_handler
+def api_submit_job():
+    """
+    Queue up a slow query to be run in the background, instead of waiting on it. JSON fields: `operation` (one of
+    JOB_OPERATIONS) plus the fields the matching endpoint takes (and `limit` for samples).
+    :return: the new job's status, including its `id` for polling
+    """
+    data = request.json
+    validate_params_exist(data, ['operation', 'platform', 'terms', 'startDate', 'endDate'])
+    if int(data.get('limit', 0)) > EXPORT_MAX_SAMPLE_SIZE:
+        raise ValueError("limit can't be more than {}".format(EXPORT_MAX_SAMPLE_SIZE))
+    job_id = jobs.submit(data['operation'], {name: data[name] for name in jobs.JOB_PARAMS if name in data})
+    return json_response(jobs.status(job_id), 202)
+
+
+@app.route('/api/jobs/<job_id>.json', methods=['GET'])
+@api_error_handler
+def api_job_status(job_id):
+    job = jobs.status(job_id)
+    if job is None:
+        return json_error_response("No job {}".format(job_id), 404)
+    return json_response(job)
+
+
+@app.route('/api/jobs/<job_id>/result.json', methods=['GET'])
+@api_error_handler
+def api_job_result(job_id):
+    job = jobs.status(job_id)
+    if job is None:
+        return json_error_response("No job {}".format(job_id), 404)
+    if job['status'] != jobs.STATUS_DONE:
+        return json_error_response("Job {} is {}".format(job_id, job['status']), 409)
+    body = jobs.result(job_id)
+    if body is None:
+        return json_error_response("The results of job {} have expired".format(job_id), 404)
+    return json_bytes_response(body)
+
+
+@app.route('/api/health.json', methods=['GET'])
+@api_error_handler
+def api_health():
+    return json_response(platforms.health())
+
+
+@app.route('/api/cache-stats.json', methods=['GET'])
+@api_error_handler
+def api_cache_stats():
+    return json_response(cache_stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Request latency, upstream calls and cache efficiency, in the Prometheus text format (see server.util.metrics)
+    """
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
+@app.route('/api/profiles.json', methods=['GET'])
+def api_profiles():
+    """
+    List the saved request profiles, newest first (needs the admin token in the X-Glimpse-Profile header).
+    """
+    if not profiling.is_admin_request():
+        return json_error_response("Not found", 404)
+    return json_response(dict(profiles=profiling.list_ids()))
+
+
+@app.route('/api/profiles/<profile_id>.<any(json, pstats, collapsed):file_type>', methods=['GET'])
+def api_profile(profile_id, file_type):
+    """
+    Download one profile: a JSON summary (the slowest functions and the time spent in each span), pstats (for
+    `python -m pstats` or snakeviz) or collapsed span stacks (for flamegraph.pl or speedscope). Needs the admin token
+    in the X-Glimpse-Profile header.
+    """
+    path = profiling.profile_path(profile_id, file_type) if profiling.is_admin_request() else None
+    if path is None:
+        return json_error_response("No profile {}".format(profile_id), 404)
+    return send_file(path, mimetype='application/json' if file_type == 'json' else 'application/octet-stream')
@@ -0,0 +1,240 @@
+"""
+Long-running queries (ie. multi-year normalized series or big samples) can be submitted as jobs instead, so they don't
+hold a web worker for minutes. Jobs are queued in Redis and run by a separate worker process (see `worker.py`), which
+stores their status, progress and finally their results (already encoded as JSON) back in Redis for clients to poll.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+from dateutil import parser as date_parser
+
+from server import JOB_WORKER_THREADS, JOB_RESULT_TTL
+from server.util.cache import redis_client
+from server.util.response import encode_json
+from server.util.timeseries import DAY
+import server.platforms as platforms
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+JOB_OPERATIONS = ['count', 'count_over_time', 'normalized_count_over_time', 'sample']
+# the request fields a job keeps, to run the operation with later
+JOB_PARAMS = ['platform', 'terms', 'startDate', 'endDate', 'granularity', 'limit']
+
+QUEUE_KEY = 'glimpse:jobs:queue'
+# every running worker process, which each keep the jobs they have taken off the queue in a list of their own until
+# they are finished with them, and regularly renew a heartbeat key (that expires if they die)
+WORKERS_KEY = 'glimpse:jobs:workers'
+# seconds without a heartbeat before a worker counts as dead, and the jobs it was running go back on the queue
+HEARTBEAT_TTL = 60
+# a job that was running on workers that died this many times is failed, instead of being retried again
+MAX_ATTEMPTS = 3
+# samples report their progress every this many items
+PROGRESS_INTERVAL = 100
+# seconds a worker thread waits on an empty queue before checking whether it should stop
+QUEUE_POLL_TIMEOUT = 5
+
+
+def _job_key(job_id: str) -> str:
+    return 'glimpse:job:{}'.format(job_id)
+
+
+def _result_key(job_id: str) -> str:
+    return 'glimpse:job:{}:result'.format(job_id)
+
+
+def _processing_key(worker_id: str) -> str:
+    return 'glimpse:jobs:processing:{}'.format(worker_id)
+
+
+def _heartbeat_key(worker_id: str) -> str:
+    return 'glimpse:jobs:worker:{}'.format(worker_id)
+
+
+def submit(operation: str, params: Dict) -> str:
+    """
+    Queue up a provider operation to be run by a job worker.
+    :param operation: one of JOB_OPERATIONS
+    :param params: the same fields the matching API endpoint takes (see JOB_PARAMS)
+    :return: the new job's id
+    """
+    if operation not in JOB_OPERATIONS:
+        raise ValueError("Unsupported operation {}".format(operation))
+    platforms.platform_parts(params.get('platform', ''))  # fail now, rather than once a worker picks it up
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    pipe = redis_client().pipeline()
+    pipe.hset(_job_key(job_id), mapping=dict(operation=operation, params=json.dumps(params), status=STATUS_QUEUED,
+                                             progress=0, error='', created=now, updated=now))
+    pipe.expire(_job_key(job_id), JOB_RESULT_TTL)
+    pipe.lpush(QUEUE_KEY, job_id)
+    pipe.execute()
+    return job_id
+
+
+def status(job_id: str) -> Optional[Dict]:
+    """
+    :param job_id:
+    :return: the job's `status` (queued, running, done or failed), `progress` (from 0 to 1), any `error` and when it
+    was `created` and last `updated`, or None if there is no such job (or it has expired)
+    """
+    values = redis_client().hgetall(_job_key(job_id))
+    if len(values) == 0:
+        return None
+    job = {key.decode('utf-8'): value.decode('utf-8') for key, value in values.items()}
+    return dict(id=job_id, operation=job['operation'], status=job['status'], progress=float(job['progress']),
+                error=job['error'] or None, created=float(job['created']), updated=float(job['updated']))
+
+
+def result(job_id: str) -> Optional[bytes]:
+    """
+    :return: the finished job's results, encoded as JSON, or None if they aren't ready (or have expired)
+    """
+    return redis_client().get(_result_key(job_id))
+
+
+def _update(job_id: str, **fields) -> None:
+    fields['updated'] = time.time()
+    redis_client().hset(_job_key(job_id), mapping=fields)
+
+
+def run_job(job_id: str) -> None:
+    values = redis_client().hgetall(_job_key(job_id))
+    if len(values) == 0:
+        logger.warning("Job {} expired before it could run".format(job_id))
+        return
+    job = {key.decode('utf-8'): value.decode('utf-8') for key, value in values.items()}
+    attempts = redis_client().hincrby(_job_key(job_id), 'attempts', 1)
+    if attempts > MAX_ATTEMPTS:
+        logger.warning("Job {} ({}) gave up after {} attempts".format(job_id, job['operation'], MAX_ATTEMPTS))
+        _update(job_id, status=STATUS_FAILED, error="The worker running this job died {} times".format(MAX_ATTEMPTS))
+        return
+    _update(job_id, status=STATUS_RUNNING)
+    start = time.perf_counter()
+    try:
+        results = _run_operation(job['operation'], json.loads(job['params']),
+                                 lambda progress: _update(job_id, progress=progress))
+        pipe = redis_client().pipeline()
+        pipe.setex(_result_key(job_id), JOB_RESULT_TTL, encode_json(results))
+        pipe.hset(_job_key(job_id), mapping=dict(status=STATUS_DONE, progress=1, updated=time.time()))
+        pipe.execute()
+        logger.info("Job {} ({}) done in {:.1f}s".format(job_id, job['operation'], time.perf_counter() - start))
+    except Exception as e:
+        logger.exception("Job {} ({}) failed".format(job_id, job['operation']))
+        _update(job_id, status=STATUS_FAILED, error=str(e))
+
+
+def _run_operation(operation: str, params: Dict, report_progress: Callable[[float], None]):
+    provider = platforms.provider_for(*platforms.platform_parts(params['platform']))
+    args = (params['terms'], date_parser.parse(params['startDate']), date_parser.parse(params['endDate']))
+    if operation == 'sample':
+        limit = int(params.get('limit', 20))
+        rows = []
+        for row in provider.iter_sample(*args, limit=limit):
+            rows.append(row)
+            if len(rows) % PROGRESS_INTERVAL == 0:
+                report_progress(len(rows) / limit)
+        return rows
+    if operation == 'count':
+        return provider.count(*args)
+    return getattr(provider, operation)(*args, granularity=params.get('granularity', DAY))
+
+
+def run_worker(threads: int = JOB_WORKER_THREADS, stop: threading.Event = None) -> None:
+    """
+    Run jobs from the queue on a pool of threads, until `stop` is set (or the process is interrupted). Jobs that
+    were running on workers that have since died are put back on the queue first.
+    :param threads: how many jobs to run at once
+    :param stop:
+    """
+    stop = stop or threading.Event()
+    worker_id = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+    _heartbeat(worker_id)
+    requeue_abandoned_jobs()
+    workers = [threading.Thread(target=_consume_queue, args=(worker_id, stop), daemon=True) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    logger.info("Job worker {} running {} threads".format(worker_id, threads))
+    last_heartbeat = time.monotonic()
+    try:
+        while any(worker.is_alive() for worker in workers):
+            # join with a timeout so a KeyboardInterrupt can get through
+            workers[0].join(1)
+            workers = [worker for worker in workers if worker.is_alive()]
+            if time.monotonic() - last_heartbeat > HEARTBEAT_TTL / 3:
+                _heartbeat(worker_id)
+                requeue_abandoned_jobs()
+                last_heartbeat = time.monotonic()
+    except KeyboardInterrupt:
+        # any jobs still running go back on the queue once our heartbeat expires
+        stop.set()
+        return
+    # every thread finished its last job, so there's nothing of ours to requeue
+    pipe = redis_client().pipeline()
+    pipe.srem(WORKERS_KEY, worker_id)
+    pipe.delete(_heartbeat_key(worker_id))
+    pipe.execute()
+
+
+def _heartbeat(worker_id: str) -> None:
+    try:
+        pipe = redis_client().pipeline()
+        pipe.sadd(WORKERS_KEY, worker_id)
+        pipe.set(_heartbeat_key(worker_id), time.time(), ex=HEARTBEAT_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.warning("Can't renew the heartbeat of job worker {}: {}".format(worker_id, e))
+
+
+def requeue_abandoned_jobs() -> int:
+    """
+    Put the jobs that workers which stopped heartbeating (ie. crashed or were killed) took off the queue back on it.
+    :return: how many jobs were requeued
+    """
+    client = redis_client()
+    requeued = 0
+    try:
+        for worker_id in client.smembers(WORKERS_KEY):
+            worker_id = worker_id.decode('utf-8')
+            if client.exists(_heartbeat_key(worker_id)):
+                continue
+            # one at a time, so two workers doing this at once can't requeue a job twice
+            while True:
+                item = client.rpoplpush(_processing_key(worker_id), QUEUE_KEY)
+                if item is None:
+                    break
+                job_id = item.decode('utf-8')
+                logger.warning("Requeued job {} from dead worker {}".format(job_id, worker_id))
+                if client.exists(_job_key(job_id)):
+                    _update(job_id, status=STATUS_QUEUED)
+                requeued += 1
+            client.srem(WORKERS_KEY, worker_id)
+    except Exception as e:
+        logger.warning("Can't requeue abandoned jobs: {}".format(e))
+    return requeued
+
+
+def _consume_queue(worker_id: str, stop: threading.Event) -> None:
+    processing_key = _processing_key(worker_id)
+    while not stop.is_set():
+        try:
+            # the job stays in our processing list while it runs, so it isn't lost if this process dies
+            item = redis_client().brpoplpush(QUEUE_KEY, processing_key, timeout=QUEUE_POLL_TIMEOUT)
+        except Exception as e:
+            logger.warning("Can't read the job queue: {}".format(e))
+            time.sleep(QUEUE_POLL_TIMEOUT)
+            continue
+        if item is not None:
+            try:
+                run_job(item.decode('utf-8'))
+            finally:
+                redis_client().lrem(processing_key, 1, item)
@@ -1,7 +1,10 @@
 import logging
-from typing import List
+import threading
+import time
+from typing import List, Dict, Tuple
+from dotenv import load_dotenv
 
-from server import YOUTUBE_API_KEY, TWITTER_API_BEARER_TOKEN, MEDIA_CLOUD_API_KEY
+import server
 from server.platforms.provider import ContentProvider
 from server.platforms.reddit import RedditPushshiftProvider
 from server.platforms.twitter import TwitterTwitterProvider
@@ -22,6 +25,11 @@ PLATFORM_SOURCE_TWITTER = 'twitter'
 PLATFORM_SOURCE_YOUTUBE = 'youtube'
 PLATFORM_SOURCE_MEDIA_CLOUD = 'mediacloud'
 
+# long-lived providers for this worker, keyed by (platform, source), built lazily on first use
+_providers: Dict[Tuple[str, str], ContentProvider] = {}
+_provider_stats: Dict[Tuple[str, str], Dict] = {}
+_providers_lock = threading.Lock()
+
 
 def available_platforms() -> List[str]:
     return [
@@ -32,27 +40,112 @@ def available_platforms() -> List[str]:
     ]
 
 
+def platform_parts(platform_name: str) -> Tuple[str, str]:
+    """
+    Split a name like those from `available_platforms` into its platform and source.
+    :param platform_name: "platform / source"
+    :return: (platform, source)
+    """
+    parts = [p.strip() for p in str(platform_name).split("/")]
+    if (len(parts) != 2) or not all(parts):
+        raise ValueError('Unknown platform "{}", expected one like "{}"'.format(platform_name,
+                                                                              available_platforms()[0]))
+    return parts[0], parts[1]
+
+
 def provider_for(platform: str, source: str) -> ContentProvider:
     """
-    A factory method that returns the appropriate data provider. Throws an exception to let you know if the
-    arguments are unsupported.
+    Return the appropriate data provider. Each one is built once per worker, on first use, and then reused for every
+    request after that. Throws an exception to let you know if the arguments are unsupported.
     :param platform: One of the PLATFORM_* constants above.
     :param source: One of the PLATFORM_SOURCE>* constants above.
     :return:
     """
+    platform_provider = _registered_provider(platform, source)
+    with _providers_lock:
+        # the stats may have just been cleared by a reload
+        _provider_stats.setdefault((platform, source), dict(created=time.time(), uses=0))['uses'] += 1
+    return platform_provider
+
+
+def _registered_provider(platform: str, source: str) -> ContentProvider:
+    key = (platform, source)
+    platform_provider = _providers.get(key)
+    if platform_provider is None:
+        with _providers_lock:
+            platform_provider = _providers.get(key)
+            if platform_provider is None:
+                platform_provider = _build_provider(platform, source)
+                _providers[key] = platform_provider
+                _provider_stats[key] = dict(created=time.time(), uses=0)
+    return platform_provider
+
+
+def _build_provider(platform: str, source: str) -> ContentProvider:
+    """
+    A factory method that constructs a new data provider, with the current config.
+    :param platform:
+    :param source:
+    :return:
+    """
     if (platform == PLATFORM_TWITTER) and (source == PLATFORM_SOURCE_TWITTER):
-        platform_provider = TwitterTwitterProvider(TWITTER_API_BEARER_TOKEN)
+        platform_provider = TwitterTwitterProvider(server.TWITTER_API_BEARER_TOKEN)
     elif (platform == PLATFORM_REDDIT) and (source == PLATFORM_SOURCE_PUSHSHIFT):
         platform_provider = RedditPushshiftProvider()
     elif (platform == PLATFORM_YOUTUBE) and (source == PLATFORM_SOURCE_YOUTUBE):
-        platform_provider = YouTubeYouTubeProvider(YOUTUBE_API_KEY)
+        platform_provider = YouTubeYouTubeProvider(server.YOUTUBE_API_KEY)
     elif (platform == PLATFORM_ONLINE_NEWS) and (source == PLATFORM_SOURCE_MEDIA_CLOUD):
-        platform_provider = OnlineNewsMediaCloudProvider(MEDIA_CLOUD_API_KEY)
+        platform_provider = OnlineNewsMediaCloudProvider(server.MEDIA_CLOUD_API_KEY)
     else:
         raise UnknownProviderException(platform, source)
+    logger.info("Built provider for {} / {}".format(platform, source))
     return platform_provider
 
 
+def reload_providers() -> None:
+    """
+    Re-read the config (ie. API keys) from the environment and `.env` file, and throw away the existing providers so
+    they get rebuilt with the new config on next use. Gunicorn workers do this when the master gets a SIGUSR1 (see
+    `gunicorn.conf.py`).
+    """
+    load_dotenv(override=True)
+    server.load_api_keys()
+    with _providers_lock:
+        _providers.clear()
+        _provider_stats.clear()
+    logger.info("Reloaded provider config")
+
+
+def warm_up() -> None:
+    """
+    Build every provider ahead of the first request and let each one do any setup it wants to. Meant to be called
+    once when a worker boots (see `gunicorn.conf.py`).
+    """
+    for platform_name in available_platforms():
+        try:
+            _registered_provider(*platform_parts(platform_name)).warm_up()
+        except Exception as e:
+            logger.exception("Failed to warm up {}: {}".format(platform_name, e))
+
+
+def health() -> Dict[str, Dict]:
+    """
+    Report whether each of the available platforms is ready to serve requests, plus some basic usage stats.
+    :return: a dict keyed by platform name
+    """
+    results = {}
+    for platform_name in available_platforms():
+        key = platform_parts(platform_name)
+        try:
+            healthy = _registered_provider(*key).health_check()
+            error = None
+        except Exception as e:
+            healthy = False
+            error = str(e)
+        results[platform_name] = dict(healthy=healthy, error=error, **_provider_stats.get(key, {}))
+    return results
+
+
 class UnknownProviderException(Exception):
     def __init__(self, platform, source):
         super().__init__("Unknown provider {} from {}".format(platform, source))
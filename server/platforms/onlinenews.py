@@ -1,10 +1,30 @@
 import datetime as dt
-from typing import List, Dict
+from typing import Iterator, List, Dict
 import logging
 from mediacloud.api import MediaCloud
 
+from server import ONLINE_NEWS_SAMPLE_CACHE_TTL, ONLINE_NEWS_COUNT_CACHE_TTL, ONLINE_NEWS_WORDS_CACHE_TTL, \
+    ONLINE_NEWS_TAGS_CACHE_TTL
 from server.platforms.provider import ContentProvider
-from server.util.cache import cache
+from server.util.cache import cache_on_arguments, recency_expiration
+from server.util.dates import solr_date_to_date
+from server.util import metrics
+
+
+# the most stories Media Cloud returns per page
+STORY_PAGE_MAX = 1000
+
+
+class _InstrumentedMediaCloud(MediaCloud):
+    """
+    The Media Cloud client makes its own requests (not through `server.util.transport`), so time them here.
+    """
+
+    def _query(self, url, *args, **kwargs):
+        with metrics.upstream_call(url) as call:
+            response = super(_InstrumentedMediaCloud, self)._query(url, *args, **kwargs)
+            call['status'] = response.status_code
+        return response
 
 
 class OnlineNewsMediaCloudProvider(ContentProvider):
@@ -13,9 +33,12 @@ class OnlineNewsMediaCloudProvider(ContentProvider):
         super(OnlineNewsMediaCloudProvider, self).__init__()
         self._logger = logging.getLogger(__name__)
         self._api_key = api_key
-        self._mc_client = MediaCloud(api_key)
+        self._mc_client = _InstrumentedMediaCloud(api_key)
 
-    #@cache.cache_on_arguments()
+    def health_check(self) -> bool:
+        return self._api_key is not None
+
+    @cache_on_arguments(expiration_time=recency_expiration(recent_expiration_time=ONLINE_NEWS_SAMPLE_CACHE_TTL))
     def sample(self, query: str, start_date: dt.datetime, end_date: dt.datetime, limit: int = 20,
                **kwargs) -> List[Dict]:
         """
@@ -28,10 +51,34 @@ class OnlineNewsMediaCloudProvider(ContentProvider):
         :return:
         """
         q, fq = self._format_query(query, start_date, end_date, **kwargs)
-        story_list = self._mc_client.storyList(q, fq, rows=limit, **kwargs)
+        story_list = self._mc_client.storyList(q, fq, rows=limit)
         return story_list
 
-    #@cache.cache_on_arguments()
+    def iter_sample(self, query: str, start_date: dt.datetime, end_date: dt.datetime, limit: int = 20,
+                    **kwargs) -> Iterator[Dict]:
+        """
+        Yield up to `limit` stories matching the query, a page at a time (these pages aren't cached, because exports
+        can be huge).
+        :param query:
+        :param start_date:
+        :param end_date:
+        :param limit:
+        :param kwargs: sources and collections lists
+        :return:
+        """
+        q, fq = self._format_query(query, start_date, end_date, **kwargs)
+        remaining = limit
+        last_processed_stories_id = 0
+        while remaining > 0:
+            stories = self._mc_client.storyList(q, fq, last_processed_stories_id=last_processed_stories_id,
+                                                rows=min(remaining, STORY_PAGE_MAX))[:remaining]
+            if len(stories) == 0:
+                return
+            yield from stories
+            remaining -= len(stories)
+            last_processed_stories_id = stories[-1]['processed_stories_id']
+
+    @cache_on_arguments(expiration_time=recency_expiration(recent_expiration_time=ONLINE_NEWS_COUNT_CACHE_TTL))
     def count(self, query: str, start_date: dt.datetime, end_date: dt.datetime, **kwargs) -> int:
         """
         Count how many verified tweets match the query.
@@ -42,24 +89,25 @@ class OnlineNewsMediaCloudProvider(ContentProvider):
         :return:
         """
         q, fq = self._format_query(query, start_date, end_date, **kwargs)
-        story_count_result = self._mc_client.storyCount(q, fq, **kwargs)
+        story_count_result = self._mc_client.storyCount(q, fq)
         return story_count_result['count']
 
-    #@cache.cache_on_arguments()
-    def count_over_time(self, query: str, start_date: dt.datetime, end_date: dt.datetime, **kwargs) -> List[Dict]:
+    def _fetch_daily_counts(self, query: str, start_date: dt.datetime, end_date: dt.datetime,
+                            **kwargs) -> Dict[dt.date, int]:
         """
-        How many verified tweets over time match the query.
+        How many stories each day match the query.
         :param query:
         :param start_date:
         :param end_date:
         :param kwargs: sources and collections lists
         :return:
         """
-        q, fq = self._format_query(query, start_date, end_date, **kwargs)
+        # Media Cloud date ranges include the whole last day, so stop at the day before end_date if it is midnight
+        q, fq = self._format_query(query, start_date, end_date - dt.timedelta(microseconds=1), **kwargs)
         story_count_result = self._mc_client.storyCount(q, fq, split=True)
-        return story_count_result
+        return {solr_date_to_date(d['date'][:10]).date(): d['count'] for d in story_count_result['counts']}
 
-    #@cache.cache_on_arguments()
+    @cache_on_arguments(expiration_time=recency_expiration(recent_expiration_time=ONLINE_NEWS_WORDS_CACHE_TTL))
     def words(self, query: str, start_date: dt.datetime, end_date: dt.datetime, limit: int = 100,
               **kwargs) -> List[Dict]:
         """
@@ -72,10 +120,10 @@ class OnlineNewsMediaCloudProvider(ContentProvider):
         :return:
         """
         q, fq = self._format_query(query, start_date, end_date, **kwargs)
-        top_words = self._mc_client.wordCount(q, fq, **kwargs)[:limit]
+        top_words = self._mc_client.wordCount(q, fq)[:limit]
         return top_words
 
-    #@cache.cache_on_arguments()
+    @cache_on_arguments(expiration_time=recency_expiration(recent_expiration_time=ONLINE_NEWS_TAGS_CACHE_TTL))
     def tags(self, query: str, start_date: dt.datetime, end_date: dt.datetime, **kwargs) -> List[Dict]:
         q, fq = self._format_query(query, start_date, end_date, **kwargs)
         tags_sets_id = kwargs.get('tags_sets_id', None)
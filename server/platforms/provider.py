@@ -1,7 +1,13 @@
 import logging
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Iterator, List, Dict, Tuple
 import datetime as dt
-from server.util.api_helper import combined_split_and_normalized_counts
+from server import CACHE_RECENT_EXPIRATION_TIME, NORMALIZATION_CACHE_TTL, NORMALIZATION_WARM_UP_DAYS
+from server.util.cache import get_day_buckets, set_day_buckets, canonical_key, refresh_in_background
+from server.util.concurrency import in_current_context
+from server.util.timeseries import TimeSeries, GRANULARITIES, HOUR, DAY
+from server.platforms.exceptions import UnsupportedOperationException
 
 # helpful for turning any date into the standard Media Cloud date format
 MC_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
@@ -13,6 +19,11 @@ class ContentProvider:
     Any unimplemented methods raise an Exception
     """
 
+    # subclasses can have long count_over_time date ranges split into shards of this many days, and fetched with
+    # up to this many concurrent upstream calls
+    COUNT_SHARD_DAYS = None
+    COUNT_SHARD_CONCURRENCY = 1
+
     def __init__(self):
         self._logger = logging.getLogger(__name__)
 
@@ -20,38 +31,288 @@ class ContentProvider:
                **kwargs) -> List[Dict]:
         raise NotImplementedError("Subclasses should implement sample!")
 
+    def iter_sample(self, query: str, start_date: dt.datetime, end_date: dt.datetime, limit: int = 20,
+                    **kwargs) -> Iterator[Dict]:
+        """
+        Like `sample`, but yields up to `limit` items one at a time, going upstream for another page of results only
+        when the last one runs out, so big exports don't have to hold them all in memory. Subclasses that can page
+        through results should override this; by default it just makes one `sample` call.
+        :param query:
+        :param start_date:
+        :param end_date:
+        :param limit:
+        :param kwargs:
+        :return:
+        """
+        yield from self.sample(query, start_date, end_date, limit=limit, **kwargs)
+
     def count(self, query: str, start_date: dt.datetime, end_date: dt.datetime, **kwargs) -> int:
         raise NotImplementedError("Subclasses should implement count!")
 
-    def count_over_time(self, query: str, start_date: dt.datetime, end_date: dt.datetime, **kwargs) -> Dict:
-        raise NotImplementedError("Subclasses should implement count_over_time!")
+    def count_over_time(self, query: str, start_date: dt.datetime, end_date: dt.datetime, granularity: str = DAY,
+                        **kwargs) -> Dict:
+        """
+        How much content matches the query in each period from start_date through end_date.
+        :param query:
+        :param start_date:
+        :param end_date:
+        :param granularity: the size of each period - one of GRANULARITIES
+        :param kwargs:
+        :return: a dict with a list of `counts` for each period and their `total`
+        """
+        series = self.count_series(query, start_date, end_date, granularity=granularity, **kwargs)
+        return dict(counts=series.to_counts(), total=series.total())
+
+    def count_series(self, query: str, start_date: dt.datetime, end_date: dt.datetime, granularity: str = DAY,
+                     **kwargs) -> TimeSeries:
+        """
+        How much content matches the query in each period from start_date through end_date (inclusive). Counts for
+        each completed day are cached individually, so overlapping date ranges only go upstream for the days we
+        haven't seen yet, and coarser granularities are added up from those same daily counts. Hourly counts have to
+        go upstream, for the platforms that support them.
+        :param query:
+        :param start_date:
+        :param end_date:
+        :param granularity: the size of each period - one of GRANULARITIES
+        :param kwargs:
+        :return:
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError("Unsupported granularity {} (use one of {})".format(granularity, GRANULARITIES))
+        if granularity == HOUR:
+            hourly_counts = self._fetch_hourly_range(query, start_date, end_date, **kwargs)
+            return TimeSeries.from_hourly_counts(hourly_counts).fill_gaps(start_date.date(), end_date.date())
+        daily_counts = self._cached_daily_counts(query, start_date, end_date, **kwargs)
+        return TimeSeries.from_daily_counts(daily_counts).fill_gaps(start_date.date(), end_date.date())\
+            .resample(granularity)
+
+    def _fetch_daily_counts(self, query: str, start_date: dt.datetime, end_date: dt.datetime,
+                            **kwargs) -> Dict[dt.date, int]:
+        """
+        Go upstream for how much content matches the query each day, from start_date up to (but not including)
+        end_date. Days with no matching content can be left out.
+        :return: a dict of counts keyed by day
+        """
+        raise NotImplementedError("Subclasses should implement _fetch_daily_counts!")
+
+    def _fetch_hourly_counts(self, query: str, start_date: dt.datetime, end_date: dt.datetime,
+                             **kwargs) -> Dict[dt.datetime, int]:
+        """
+        Go upstream for how much content matches the query each hour, from start_date up to (but not including)
+        end_date. Hours with no matching content can be left out.
+        :return: a dict of counts keyed by the (naive, UTC) start of each hour
+        """
+        raise UnsupportedOperationException("Can't count {} content by hour".format(self.__class__.__name__))
+
+    def _fetch_hourly_range(self, query: str, start_date: dt.datetime, end_date: dt.datetime,
+                            **kwargs) -> Dict[dt.datetime, int]:
+        # the same whole days as _cached_daily_counts, but these aren't kept in day buckets - they are only cached
+        # as far as each provider caches its upstream calls
+        range_start = _day_start(start_date.date())
+        range_end = min(_day_start(end_date.date() + dt.timedelta(days=1)), dt.datetime.utcnow())
+        hourly_counts = {}
+        for shard_counts in self._run_sharded(partial(self._fetch_hourly_counts, query, **kwargs), range_start,
+                                              range_end):
+            hourly_counts.update(shard_counts)
+        return hourly_counts
+
+    def _cached_daily_counts(self, query: str, start_date: dt.datetime, end_date: dt.datetime,
+                             **kwargs) -> Dict[dt.date, int]:
+        return self._bucketed_daily_counts(self._day_bucket_namespace(query, **kwargs), query, start_date, end_date,
+                                           **kwargs)
+
+    def _bucketed_daily_counts(self, namespace: str, query: str, start_date: dt.datetime, end_date: dt.datetime,
+                               recent_expiration_time: int = CACHE_RECENT_EXPIRATION_TIME,
+                               cache_partial_days: bool = False, **kwargs) -> Dict[dt.date, int]:
+        """
+        Daily counts for the query, served from the day buckets in this namespace where we have them.
+        :param namespace:
+        :param query:
+        :param start_date:
+        :param end_date:
+        :param recent_expiration_time: seconds before cached counts for recent days get refreshed
+        :param cache_partial_days: cache the count for today too (it gets refreshed once the day is over)
+        :param kwargs:
+        :return:
+        """
+        # the date range is treated as whole days, including all of end_date's day (but never past right now - days
+        # that haven't started yet are left out, and get filled in as 0 without being cached)
+        first_day = start_date.date()
+        last_day = min(end_date.date(), dt.datetime.utcnow().date())
+        days = [first_day + dt.timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+        range_end = min(_day_start(last_day + dt.timedelta(days=1)), dt.datetime.utcnow())
+        daily_counts, stale_days = get_day_buckets(namespace, days, recent_expiration_time)
+        fetch_and_cache = partial(self._fetch_and_cache_days, namespace, query, range_end=range_end,
+                                  cache_partial_days=cache_partial_days, **kwargs)
+        for run_first, run_last in _missing_runs(days, daily_counts):
+            daily_counts.update(fetch_and_cache(run_first, run_last))
+        if len(stale_days) > 0:
+            # serve the stale recent days we have now, and re-fetch just that trailing window for next time
+            stale_runs = _missing_runs(days, {d: c for d, c in daily_counts.items() if d not in stale_days})
+
+            def refresh():
+                for run_first, run_last in stale_runs:
+                    fetch_and_cache(run_first, run_last)
+            refresh_in_background(namespace, refresh)
+        return daily_counts
+
+    def _fetch_and_cache_days(self, namespace: str, query: str, first_day: dt.date, last_day: dt.date,
+                              range_end: dt.datetime, cache_partial_days: bool = False,
+                              **kwargs) -> Dict[dt.date, int]:
+        fetch_start = _day_start(first_day)
+        fetch_end = min(_day_start(last_day + dt.timedelta(days=1)), range_end)
+        fetched = {}
+        if fetch_start < fetch_end:
+            for shard_counts in self._run_sharded(partial(self._fetch_daily_counts, query, **kwargs), fetch_start,
+                                                  fetch_end):
+                fetched.update(shard_counts)
+        counts = {}
+        for i in range((last_day - first_day).days + 1):
+            day = first_day + dt.timedelta(days=i)
+            counts[day] = fetched.get(day, 0)
+        # normally we only cache days we fetched all of, because partial days (ie. today) will still change, and we
+        # never cache days that hadn't started
+        set_day_buckets(namespace, {day: count for day, count in counts.items()
+                                    if (_day_start(day + dt.timedelta(days=1)) <= fetch_end)
+                                    or (cache_partial_days and (_day_start(day) < fetch_end))})
+        return counts
+
+    def _run_sharded(self, fetch: Callable[[dt.datetime, dt.datetime], Any], start_date: dt.datetime,
+                     end_date: dt.datetime) -> List:
+        """
+        Split the date range into shards of COUNT_SHARD_DAYS, call fetch(shard_start, shard_end) for each one (with
+        up to COUNT_SHARD_CONCURRENCY running at once) and return the results in date order.
+        :param fetch:
+        :param start_date:
+        :param end_date:
+        :return:
+        """
+        shards = _date_shards(start_date, end_date, self.COUNT_SHARD_DAYS)
+        if (len(shards) == 1) or (self.COUNT_SHARD_CONCURRENCY <= 1):
+            return [fetch(shard_start, shard_end) for shard_start, shard_end in shards]
+        with ThreadPoolExecutor(max_workers=min(self.COUNT_SHARD_CONCURRENCY, len(shards))) as executor:
+            futures = [executor.submit(in_current_context(fetch), *shard) for shard in shards]
+            return [future.result() for future in futures]
+
+    def _day_bucket_namespace(self, query: str, **kwargs) -> str:
+        return canonical_key("{}:daily_counts".format(self.__class__.__name__), query=query, kwargs=kwargs)
 
     def words(self, query: str, start_date: dt.datetime, end_date: dt.datetime, limit: int = 100,
               **kwargs) -> List[Dict]:
         raise NotImplementedError("Subclasses should implement words!")
 
     def normalized_count_over_time(self, query: str, start_date: dt.datetime, end_date: dt.datetime,
-                                   **kwargs) -> Dict:
+                                   granularity: str = DAY, **kwargs) -> Dict:
         """
         Useful for rendering attention-over-time charts with extra information suitable for normalizing
         :param query:
         :param start_date:
         :param end_date:
+        :param granularity: the size of each period - one of GRANULARITIES
         :param kwargs:
         :return:
         """
-        matching_content_counts = self.count_over_time(query, start_date, end_date, **kwargs)['counts']
-        matching_total = sum([d['count'] for d in matching_content_counts])
-        no_query_content_counts = self.count_over_time(self._everything_query(), start_date, end_date, **kwargs)['counts']
-        no_query_total = sum([d['count'] for d in no_query_content_counts])
+        matching_series, no_query_series = self.normalized_count_series(query, start_date, end_date,
+                                                                         granularity=granularity, **kwargs)
         return {
-            'counts': combined_split_and_normalized_counts(matching_content_counts, no_query_content_counts),
-            'total': matching_total,
-            'normalized_total': no_query_total,
+            'counts': matching_series.to_normalized_counts(no_query_series),
+            'total': matching_series.total(),
+            'normalized_total': no_query_series.total(),
         }
 
+    def normalized_count_series(self, query: str, start_date: dt.datetime, end_date: dt.datetime,
+                                granularity: str = DAY, **kwargs) -> Tuple[TimeSeries, TimeSeries]:
+        """
+        :return: the series of content matching the query, and the denominator series to normalize it by
+        """
+        return (self.count_series(query, start_date, end_date, granularity=granularity, **kwargs),
+                self.denominator_series(start_date, end_date, granularity=granularity, **kwargs))
+
+    def denominator_series(self, start_date: dt.datetime, end_date: dt.datetime, granularity: str = DAY,
+                           **kwargs) -> TimeSeries:
+        """
+        How much content there is in total in each period, for normalizing query results against. This doesn't
+        depend on the query, so its daily counts are cached in one set of day buckets that every query on this
+        platform (with the same options) shares. Recent days are only refreshed every NORMALIZATION_CACHE_TTL seconds,
+        including today's partial count.
+        :param start_date:
+        :param end_date:
+        :param granularity: the size of each period - one of GRANULARITIES
+        :param kwargs:
+        :return:
+        """
+        if granularity == HOUR:
+            return self.count_series(self._everything_query(), start_date, end_date, granularity=granularity,
+                                     **kwargs)
+        if granularity not in GRANULARITIES:
+            raise ValueError("Unsupported granularity {} (use one of {})".format(granularity, GRANULARITIES))
+        namespace = canonical_key("{}:denominator".format(self.__class__.__name__), kwargs=kwargs)
+        daily_counts = self._bucketed_daily_counts(namespace, self._everything_query(), start_date, end_date,
+                                                   recent_expiration_time=NORMALIZATION_CACHE_TTL,
+                                                   cache_partial_days=True, **kwargs)
+        return TimeSeries.from_daily_counts(daily_counts).fill_gaps(start_date.date(), end_date.date())\
+            .resample(granularity)
+
+    def health_check(self) -> bool:
+        """
+        Cheap check (no upstream calls) that this provider is configured well enough to serve requests
+        :return:
+        """
+        return True
+
+    def warm_up(self) -> None:
+        """
+        Called once when a worker boots, so subclasses can do any expensive setup before the first request. By
+        default this precomputes the last NORMALIZATION_WARM_UP_DAYS of the denominator series.
+        """
+        if NORMALIZATION_WARM_UP_DAYS <= 0:
+            return
+        now = dt.datetime.utcnow()
+        try:
+            self.denominator_series(now - dt.timedelta(days=NORMALIZATION_WARM_UP_DAYS), now)
+        except (UnsupportedOperationException, NotImplementedError):
+            # not every platform can count over time
+            pass
+
     def _everything_query(self) -> str:
         """
         :return: a query string that can be used to capture matching "everything" 
         """
         return '*'
+
+
+def _day_start(day: dt.date) -> dt.datetime:
+    return dt.datetime(day.year, day.month, day.day)
+
+
+def _date_shards(start_date: dt.datetime, end_date: dt.datetime, shard_days: int = None) -> List:
+    if start_date >= end_date:
+        return []
+    if shard_days is None:
+        return [(start_date, end_date)]
+    shards = []
+    shard_start = start_date
+    while shard_start < end_date:
+        shard_end = min(shard_start + dt.timedelta(days=shard_days), end_date)
+        shards.append((shard_start, shard_end))
+        shard_start = shard_end
+    return shards
+
+
+def _missing_runs(days: List[dt.date], found: Dict[dt.date, int]) -> List:
+    """
+    Group the days that aren't in `found` into contiguous (first, last) runs, so each one can be fetched in one call
+    """
+    runs = []
+    run_first = None
+    for day in days:
+        if day not in found:
+            if run_first is None:
+                run_first = day
+            run_last = day
+        elif run_first is not None:
+            runs.append((run_first, run_last))
+            run_first = None
+    if run_first is not None:
+        runs.append((run_first, run_last))
+    return runs
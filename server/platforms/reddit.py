@@ -1,20 +1,28 @@
 from collections import defaultdict
 import datetime as dt
-import requests
-from typing import List, Dict
+from typing import Iterator, List, Dict
 import logging
 
+from server import REDDIT_PUSHSHIFT_URL
 from server.platforms.provider import ContentProvider, MC_DATE_FORMAT
-from server.util.cache import cache
+from server.util.cache import cache_on_arguments, recency_expiration
+from server.util import transport
+from server.util.dates import parse_epoch_millis
 
-REDDIT_PUSHSHIFT_URL = "https://beta.pushshift.io"
 SUBMISSION_SEARCH_URL = "{}/reddit/search/submissions".format(REDDIT_PUSHSHIFT_URL)
 
+# the most submissions Pushshift returns per search
+SEARCH_PAGE_MAX = 1000
+
 NEWS_SUBREDDITS = ['politics', 'worldnews', 'news', 'conspiracy', 'Libertarian', 'TrueReddit', 'Conservative', 'offbeat']
 
 
 class RedditPushshiftProvider(ContentProvider):
 
+    # Pushshift is easily overloaded, so only split up really long ranges, and gently
+    COUNT_SHARD_DAYS = 180
+    COUNT_SHARD_CONCURRENCY = 2
+
     def __init__(self):
         super(RedditPushshiftProvider, self).__init__()
         self._logger = logging.getLogger(__name__)
@@ -35,6 +43,38 @@ class RedditPushshiftProvider(ContentProvider):
         cleaned_data = [self._submission_to_row(item) for item in data['data'][:limit]]
         return cleaned_data
 
+    def iter_sample(self, query: str, start_date: dt.datetime, end_date: dt.datetime, limit: int = 20,
+                    **kwargs) -> Iterator[Dict]:
+        """
+        Yield up to `limit` submissions matching the query, newest first, a page at a time. Pushshift can't page
+        through results sorted by score, so each page asks for ones created before the oldest in the last page.
+        :param query:
+        :param start_date:
+        :param end_date:
+        :param limit:
+        :param kwargs: Options: 'subreddits': List[str]
+        :return:
+        """
+        remaining = limit
+        # after the first page this is the epoch second to page back from; it goes upstream (and into the cache key)
+        # as is, because dates in cache keys are rounded off (see CACHE_KEY_DATE_GRANULARITY) and pages from the same
+        # hour would otherwise share a key
+        page_cursor = {}
+        seen_ids = set()  # submissions from the second the last page ended on will show up again
+        while remaining > 0:
+            data = self._cached_submission_search(q=query, start_date=start_date, end_date=end_date,
+                                                  limit=min(remaining + len(seen_ids), SEARCH_PAGE_MAX),
+                                                  sort='created_utc', order='desc', **page_cursor, **kwargs)
+            items = [item for item in data['data'] if item['id'] not in seen_ids][:remaining]
+            if len(items) == 0:
+                return
+            for item in items:
+                yield self._submission_to_row(item)
+            remaining -= len(items)
+            oldest = items[-1]['created_utc']
+            page_cursor = dict(until=int(oldest))
+            seen_ids = {item['id'] for item in items if item['created_utc'] == oldest}
+
     def count(self, query: str, start_date: dt.datetime, end_date: dt.datetime, **kwargs) -> int:
         """
         Count how reddit sumissions match the query.
@@ -49,30 +89,32 @@ class RedditPushshiftProvider(ContentProvider):
                                               limit=0, track_total_hits=True, **kwargs)
         return data['metadata']['es']['hits']['total']['value']
 
-    def count_over_time(self, query: str, start_date: dt.datetime, end_date: dt.datetime, **kwargs) -> Dict:
+    def _fetch_daily_counts(self, query: str, start_date: dt.datetime, end_date: dt.datetime,
+                            **kwargs) -> Dict[dt.date, int]:
+        buckets = self._calendar_histogram(query, start_date, end_date, 'day')
+        return {parse_epoch_millis(d['key']).date(): d['doc_count'] for d in buckets}
+
+    def _fetch_hourly_counts(self, query: str, start_date: dt.datetime, end_date: dt.datetime,
+                             **kwargs) -> Dict[dt.datetime, int]:
+        buckets = self._calendar_histogram(query, start_date, end_date, 'hour')
+        return {parse_epoch_millis(d['key']): d['doc_count'] for d in buckets}
+
+    def _calendar_histogram(self, query: str, start_date: dt.datetime, end_date: dt.datetime,
+                            interval: str) -> List[Dict]:
         """
-        How many reddit submissions over time match the query.
+        How many reddit submissions match the query in each day or hour.
         :param query:
         :param start_date:
         :param end_date:
-        :param kwargs: Options: 'subreddits': List[str], period: str (default '1d')
-        :return:
+        :param interval: 'day' or 'hour'
+        :return: the histogram buckets, each with a `key` (epoch milliseconds) and a `doc_count`
         """
-        period = kwargs['period'] if 'period' in kwargs else '1d'
         data = self._cached_submission_search(q=query,
                                               start_date=start_date, end_date=end_date,
-                                              calendar_histogram='day')
-        # make the results match the format we use for stories/count in the Media Cloud API
-        results = []
-        for d in data['metadata']['es']['aggregations']['calendar_histogram']['buckets']:
-            results.append({
-                'date': dt.datetime.fromtimestamp(d['key']/1000),
-                'timestamp': d['key']/1000,
-                'count': d['doc_count'],
-            })
-        return {'counts': results}
-
-    @cache.cache_on_arguments()
+                                              calendar_histogram=interval)
+        return data['metadata']['es']['aggregations']['calendar_histogram']['buckets']
+
+    @cache_on_arguments(expiration_time=recency_expiration())
     def _cached_submission_search(self, query: str = None, start_date: dt.datetime = None, end_date: dt.datetime = None,
                                   **kwargs) -> Dict:
         """
@@ -95,7 +137,7 @@ class RedditPushshiftProvider(ContentProvider):
             params['until'] = int(end_date.timestamp())
         # and now add in any other arguments they have sent in
         params.update(kwargs)
-        r = requests.get(SUBMISSION_SEARCH_URL, headers=headers, params=params)
+        r = transport.get(SUBMISSION_SEARCH_URL, headers=headers, params=params)
         # temp = r.url # useful assignment for debugging investigations
         return r.json()
 
@@ -0,0 +1,180 @@
+import unittest
+import datetime as dt
+from dogpile.cache.backends.memory import MemoryBackend
+
+from server.platforms.provider import ContentProvider, _date_shards, _missing_runs
+from server.util.cache import local_cache, get_day_buckets, canonical_key
+from server.util.timeseries import WEEK
+
+
+class FakeProvider(ContentProvider):
+    """
+    Has one item matching any query each day, out of ten in total, and remembers which date ranges it was asked to
+    count.
+    """
+
+    def __init__(self):
+        super(FakeProvider, self).__init__()
+        self.fetched = []
+        self.fetched_queries = []
+
+    def _fetch_daily_counts(self, query: str, start_date: dt.datetime, end_date: dt.datetime,
+                            **kwargs) -> dict:
+        self.fetched.append((start_date, end_date))
+        self.fetched_queries.append(query)
+        days = (end_date.date() - start_date.date()).days + (1 if end_date.time() != dt.time() else 0)
+        return {start_date.date() + dt.timedelta(days=i): 10 if query == '*' else 1 for i in range(days)}
+
+
+class ShardedFakeProvider(FakeProvider):
+    COUNT_SHARD_DAYS = 7
+    COUNT_SHARD_CONCURRENCY = 3
+
+
+class ProviderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # keep cached counts in memory instead of Redis
+        self._redis_backend = local_cache.proxied
+        local_cache.proxied = MemoryBackend({})
+        self._provider = FakeProvider()
+        self._today = dt.datetime.utcnow().date()
+
+    def tearDown(self):
+        local_cache.proxied = self._redis_backend
+
+    def _days_ago(self, days: int) -> dt.datetime:
+        day = self._today - dt.timedelta(days=days)
+        return dt.datetime(day.year, day.month, day.day)
+
+
+class FutureDaysTest(ProviderTestCase):
+
+    def test_counts_stop_at_now(self):
+        series = self._provider.count_series('robots', self._days_ago(3), self._days_ago(-3))
+        assert [c['count'] for c in series.to_counts()] == [1, 1, 1, 1, 0, 0, 0]
+        for fetch_start, fetch_end in self._provider.fetched:
+            assert fetch_start < fetch_end <= dt.datetime.utcnow()
+        namespace = self._provider._day_bucket_namespace('robots')
+        cached, _ = get_day_buckets(namespace, [self._days_ago(i).date() for i in range(3, -4, -1)])
+        # only the days that were over
+        assert sorted(cached.keys()) == [self._days_ago(i).date() for i in [3, 2, 1]]
+
+    def test_range_entirely_in_future(self):
+        series = self._provider.count_series('robots', self._days_ago(-2), self._days_ago(-5))
+        assert series.total() == 0
+        assert len(series.to_counts()) == 4
+        assert self._provider.fetched == []
+
+    def test_denominator_caches_today_but_not_future_days(self):
+        series = self._provider.denominator_series(self._days_ago(1), self._days_ago(-2))
+        assert [c['count'] for c in series.to_counts()] == [10, 10, 0, 0]
+        namespace = canonical_key('FakeProvider:denominator', kwargs={})
+        cached, _ = get_day_buckets(namespace, [self._days_ago(i).date() for i in [1, 0, -1, -2]])
+        # today's partial count is cached (and refreshed later), days that haven't started aren't
+        assert sorted(cached.keys()) == [self._days_ago(1).date(), self._today]
+
+
+class MissingRunsTest(unittest.TestCase):
+
+    def test_runs(self):
+        days = [dt.date(2022, 1, d) for d in range(1, 11)]
+        assert _missing_runs(days, {}) == [(days[0], days[-1])]
+        assert _missing_runs(days, {d: 1 for d in days}) == []
+        found = {days[i]: 1 for i in [0, 1, 4, 9]}
+        assert _missing_runs(days, found) == [(days[2], days[3]), (days[5], days[8])]
+        assert _missing_runs([], {}) == []
+
+
+class DateShardsTest(unittest.TestCase):
+
+    def test_unsharded(self):
+        start = dt.datetime(2022, 1, 1)
+        end = dt.datetime(2022, 3, 1)
+        assert _date_shards(start, end) == [(start, end)]
+
+    def test_sharded(self):
+        start = dt.datetime(2022, 1, 1)
+        end = dt.datetime(2022, 1, 20, 12)
+        shards = _date_shards(start, end, 7)
+        assert shards == [(start, dt.datetime(2022, 1, 8)), (dt.datetime(2022, 1, 8), dt.datetime(2022, 1, 15)),
+                          (dt.datetime(2022, 1, 15), end)]
+
+    def test_empty_or_inverted(self):
+        start = dt.datetime(2022, 1, 1)
+        assert _date_shards(start, start) == []
+        assert _date_shards(start, start - dt.timedelta(days=1)) == []
+        assert _date_shards(start, start - dt.timedelta(days=1), 7) == []
+
+
+class DayBucketsTest(ProviderTestCase):
+
+    def test_only_missing_days_fetched(self):
+        series = self._provider.count_series('robots', self._days_ago(20), self._days_ago(11))
+        assert series.total() == 10
+        assert self._provider.fetched == [(self._days_ago(20), self._days_ago(10))]
+        # the overlapping days come from their buckets, so only the new ones on either side go upstream
+        series = self._provider.count_series('robots', self._days_ago(25), self._days_ago(6))
+        assert series.total() == 20
+        assert self._provider.fetched[1:] == [(self._days_ago(25), self._days_ago(20)),
+                                              (self._days_ago(10), self._days_ago(5))]
+        # and a range we've seen all of doesn't go upstream at all
+        self._provider.count_series('Robots ', self._days_ago(22), self._days_ago(8))
+        assert len(self._provider.fetched) == 3
+
+    def test_partial_day_not_cached(self):
+        series = self._provider.count_series('robots', self._days_ago(2), self._days_ago(0))
+        assert series.total() == 3  # today counts, so far
+        namespace = self._provider._day_bucket_namespace('robots')
+        cached, _ = get_day_buckets(namespace, [self._days_ago(i).date() for i in [2, 1, 0]])
+        assert sorted(cached.keys()) == [self._days_ago(2).date(), self._days_ago(1).date()]
+        # so today goes upstream again next time
+        self._provider.count_series('robots', self._days_ago(2), self._days_ago(0))
+        assert self._provider.fetched[-1][0] == self._days_ago(0)
+
+    def test_resampled_from_daily_counts(self):
+        start = self._days_ago(40)
+        start -= dt.timedelta(days=start.weekday())  # a Monday
+        weekly = self._provider.count_series('robots', start, start + dt.timedelta(days=20), granularity=WEEK)
+        assert [c['count'] for c in weekly.to_counts()] == [7, 7, 7]
+        daily = self._provider.count_series('robots', start, start + dt.timedelta(days=20))
+        assert daily.total() == 21
+        assert len(self._provider.fetched) == 1
+
+
+class ShardingTest(ProviderTestCase):
+
+    def setUp(self):
+        super(ShardingTest, self).setUp()
+        self._provider = ShardedFakeProvider()
+
+    def test_shards_cover_range(self):
+        series = self._provider.count_series('robots', self._days_ago(60), self._days_ago(31))
+        # each shard's counts are merged back into one daily series
+        assert [c['count'] for c in series.to_counts()] == [1] * 30
+        shards = sorted(self._provider.fetched)
+        assert len(shards) == 5
+        assert shards[0][0] == self._days_ago(60)
+        assert shards[-1][1] == self._days_ago(30)
+        for (_, shard_end), (next_start, _) in zip(shards, shards[1:]):
+            assert shard_end == next_start
+        assert all(shard_end - shard_start <= dt.timedelta(days=7) for shard_start, shard_end in shards)
+
+
+class DenominatorTest(ProviderTestCase):
+
+    def test_ratio(self):
+        results = self._provider.normalized_count_over_time('robots', self._days_ago(10), self._days_ago(6))
+        assert results['total'] == 5
+        assert results['normalized_total'] == 50
+        assert [c['ratio'] for c in results['counts']] == [0.1] * 5
+        assert [c['total_count'] for c in results['counts']] == [10] * 5
+
+    def test_shared_by_queries(self):
+        for query in ['robots', 'ai', 'robots OR ai']:
+            self._provider.normalized_count_series(query, self._days_ago(10), self._days_ago(6))
+        assert self._provider.fetched_queries.count('*') == 1
+        # a longer range only fetches the extra days of the denominator
+        self._provider.denominator_series(self._days_ago(12), self._days_ago(6))
+        assert self._provider.fetched_queries.count('*') == 2
+        assert self._provider.fetched[-1] == (self._days_ago(12), self._days_ago(10))
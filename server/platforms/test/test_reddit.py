@@ -1,7 +1,11 @@
 import unittest
 import datetime as dt
+from unittest import mock
+from dogpile.cache.backends.memory import MemoryBackend
 
+from server.platforms import reddit
 from server.platforms.reddit import RedditPushshiftProvider
+from server.util.cache import local_cache
 
 
 class RedditPushshiftProviderTest(unittest.TestCase):
@@ -37,3 +41,37 @@ class RedditPushshiftProviderTest(unittest.TestCase):
         assert 'total' in results
         assert results['total'] > 0
         assert 'normalized_total' in results
+
+
+class IterSampleTest(unittest.TestCase):
+    """
+    Pages through a fake Pushshift, with the (in-memory) cache in between like in production.
+    """
+
+    def setUp(self):
+        self._redis_backend = local_cache.proxied
+        local_cache.proxied = MemoryBackend({})
+        self._start = dt.datetime(2022, 3, 1, 12)
+        start_timestamp = int(self._start.timestamp())
+        # two submissions a second, all within one hour
+        self._submissions = [dict(id='s{}'.format(i), created_utc=start_timestamp + 3000 - i // 2, subreddit='news',
+                                  permalink='r/news/s{}'.format(i), title='robots', url='https://example.com',
+                                  score=1, author='someone') for i in range(3400)]
+        self.calls = 0
+
+    def tearDown(self):
+        local_cache.proxied = self._redis_backend
+
+    def _search(self, url, headers=None, params=None):
+        self.calls += 1
+        data = [s for s in self._submissions if params['since'] <= s['created_utc'] <= params['until']]
+        return mock.Mock(json=mock.Mock(return_value=dict(data=data[:params['limit']])))
+
+    def test_pages_within_an_hour(self):
+        with mock.patch.object(reddit.transport, 'get', side_effect=self._search):
+            rows = list(RedditPushshiftProvider().iter_sample('robots', self._start,
+                                                              self._start + dt.timedelta(hours=1), limit=3400))
+        assert len(rows) == 3400
+        assert len({row['stories_id'] for row in rows}) == 3400
+        assert self.calls == 4
+
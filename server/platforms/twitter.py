@@ -1,24 +1,35 @@
 import datetime as dt
-import requests
-import dateparser
-from typing import List, Dict
+from typing import Iterator, List, Dict
 import logging
 
+from server import TWITTER_API_URL
 from server.platforms.provider import ContentProvider
-from server.util.cache import cache
+from server.util.cache import cache_on_arguments, recency_expiration
+from server.util import transport
+from server.util.dates import parse_iso_date
 from server.platforms.exceptions import UnsupportedOperationException
+from server.util.timeseries import TimeSeries, DAY
 
 
-TWITTER_API_URL = 'https://api.twitter.com/2/'
+# the search endpoint returns between 10 and 500 tweets per page
+SEARCH_PAGE_MIN = 10
+SEARCH_PAGE_MAX = 500
 
 
 class TwitterTwitterProvider(ContentProvider):
 
+    # the counts endpoint returns at most 31 days per page, so fetch long ranges a page-sized shard at a time
+    COUNT_SHARD_DAYS = 31
+    COUNT_SHARD_CONCURRENCY = 4
+
     def __init__(self, bearer_token=None):
         super(TwitterTwitterProvider, self).__init__()
         self._logger = logging.getLogger(__name__)
         self._bearer_token = bearer_token
 
+    def health_check(self) -> bool:
+        return self._bearer_token is not None
+
     def sample(self, query: str, start_date: dt.datetime, end_date: dt.datetime, limit: int = 10, **kwargs) -> List[Dict]:
         """
         Return a list of historical tweets matching the query.
@@ -30,7 +41,40 @@ class TwitterTwitterProvider(ContentProvider):
         :return:
         """
         # sample of historical tweets
-        params = {
+        results = self._cached_query("tweets/search/all", self._search_params(query, start_date, end_date, limit))
+        return TwitterTwitterProvider._tweets_to_rows(results)
+
+    def iter_sample(self, query: str, start_date: dt.datetime, end_date: dt.datetime, limit: int = 10,
+                    **kwargs) -> Iterator[Dict]:
+        """
+        Yield up to `limit` historical tweets matching the query, a page at a time.
+        :param query:
+        :param start_date:
+        :param end_date:
+        :param limit:
+        :param kwargs:
+        :return:
+        """
+        remaining = limit
+        next_token = None
+        while remaining > 0:
+            params = self._search_params(query, start_date, end_date,
+                                         max(SEARCH_PAGE_MIN, min(remaining, SEARCH_PAGE_MAX)))
+            if next_token is not None:
+                params['next_token'] = next_token
+            results = self._cached_query("tweets/search/all", params)
+            if 'data' not in results:
+                return
+            rows = TwitterTwitterProvider._tweets_to_rows(results)[:remaining]
+            yield from rows
+            remaining -= len(rows)
+            next_token = results.get('meta', {}).get('next_token')
+            if next_token is None:
+                return
+
+    @classmethod
+    def _search_params(cls, query: str, start_date: dt.datetime, end_date: dt.datetime, limit: int) -> Dict:
+        return {
             "query": query,
             "max_results": limit,
             "start_time": start_date.isoformat("T") + "Z",
@@ -38,8 +82,6 @@ class TwitterTwitterProvider(ContentProvider):
             "tweet.fields": ",".join(["author_id", "created_at", "public_metrics"]),
             "expansions": "author_id"
         }
-        results = self._cached_query("tweets/search/all", params)
-        return TwitterTwitterProvider._tweets_to_rows(results)
 
     def count(self, query: str, start_date: dt.datetime, end_date: dt.datetime, **kwargs) -> int:
         # this is returning spurious results, so just use count_over_time since it will probably be called and cached
@@ -55,20 +97,29 @@ class TwitterTwitterProvider(ContentProvider):
         """
         return self.count_over_time(query, start_date, end_date, **kwargs)['total']
 
-    def count_over_time(self, query: str, start_date: dt.datetime,
-                        end_date: dt.datetime,
-                        **kwargs) -> Dict:
+    def _fetch_daily_counts(self, query: str, start_date: dt.datetime, end_date: dt.datetime,
+                            **kwargs) -> Dict[dt.date, int]:
+        data = self._fetch_counts(query, start_date, end_date, 'day')
+        return {parse_iso_date(d['start']).date(): d['tweet_count'] for d in data}
+
+    def _fetch_hourly_counts(self, query: str, start_date: dt.datetime, end_date: dt.datetime,
+                             **kwargs) -> Dict[dt.datetime, int]:
+        data = self._fetch_counts(query, start_date, end_date, 'hour')
+        return {parse_iso_date(d['start']): d['tweet_count'] for d in data}
+
+    def _fetch_counts(self, query: str, start_date: dt.datetime, end_date: dt.datetime,
+                      granularity: str) -> List[Dict]:
         """
-        Count how many tweets match the query over the 31 days before end_date.
+        Count how many tweets match the query each day or hour, paging through all the results.
         :param query:
         :param start_date:
         :param end_date:
-        :param kwargs:
+        :param granularity: 'day' or 'hour'
         :return:
         """
         params = dict(
             query=query,
-            granularity='day',
+            granularity=granularity,
             start_time=start_date.isoformat("T") + "Z",
             end_time=end_date.isoformat("T") + "Z",
         )
@@ -77,7 +128,8 @@ class TwitterTwitterProvider(ContentProvider):
         data = []
         while more_data:
             params['next_token'] = next_token
-            results = self._cached_query("tweets/counts/all", params)
+            # pass a copy, because a background cache refresh may run with these params after we've changed them
+            results = self._cached_query("tweets/counts/all", dict(params))
             data += reversed(results['data'])
             if ('meta' in results) and ('next_token' in results['meta']):
                 next_token = results['meta']['next_token']
@@ -85,18 +137,9 @@ class TwitterTwitterProvider(ContentProvider):
             else:
                 next_token = None
                 more_data = False
-        to_return = []
-        total = 0
-        for d in data:
-            to_return.append({
-                'date': dateparser.parse(d['start']),
-                'timestamp': dateparser.parse(d['start']).timestamp(),
-                'count': d['tweet_count'],
-            })
-            total += d['tweet_count']
-        return dict(counts=to_return, total=total)
-
-    @cache.cache_on_arguments()
+        return data
+
+    @cache_on_arguments(expiration_time=recency_expiration(lambda arguments: arguments['params'].get('end_time')))
     def _cached_query(self, endpoint: str, params: Dict = None) -> Dict:
         """
         Run a generic query agains the Twitter historical search API
@@ -109,7 +152,7 @@ class TwitterTwitterProvider(ContentProvider):
             'Content-type': 'application/json',
             'Authorization': "Bearer {}".format(self._bearer_token)
         }
-        r = requests.get(TWITTER_API_URL+endpoint, headers=headers, params=params)
+        r = transport.get(TWITTER_API_URL+endpoint, headers=headers, params=params)
         return r.json()
 
     @classmethod
@@ -126,14 +169,15 @@ class TwitterTwitterProvider(ContentProvider):
     @classmethod
     def _tweet_to_row(cls, item: Dict) -> Dict:
         link = 'https://twitter.com/{}/status/{}'.format(item['author']['username'], item['id'])
+        created_at = parse_iso_date(item['created_at'])
         return {
             'media_name': 'Twitter',
             'media_url': 'https://twitter.com/{}'.format(item['author']['username']),
             'stories_id': item['id'],
             'content': item['text'],
-            'publish_date': dateparser.parse(item['created_at']),
+            'publish_date': created_at,
             'url': link,
-            'last_updated': dateparser.parse(item['created_at']),
+            'last_updated': created_at,
             'author': item['author']['name'],
             'language': None,
             'retweet_count': item['public_metrics']['retweet_count'],
@@ -143,5 +187,9 @@ class TwitterTwitterProvider(ContentProvider):
         }
 
     def normalized_count_over_time(self, query: str, start_date: dt.datetime, end_date: dt.datetime,
-                                   **kwargs) -> Dict:
+                                   granularity: str = DAY, **kwargs) -> Dict:
+        raise UnsupportedOperationException("Can't search twitter for all tweets in a timeframe")
+
+    def denominator_series(self, start_date: dt.datetime, end_date: dt.datetime, granularity: str = DAY,
+                           **kwargs) -> TimeSeries:
         raise UnsupportedOperationException("Can't search twitter for all tweets in a timeframe")
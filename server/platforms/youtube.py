@@ -1,17 +1,20 @@
 import datetime as dt
-from typing import List, Dict
+from typing import Iterator, List, Dict
 import logging
-import dateutil.parser
-import requests
 
-from server.util.cache import cache
+from server import YT_SEARCH_API_URL
+from server.util.cache import cache_on_arguments, recency_expiration
+from server.util import transport
+from server.util.dates import parse_iso_date
 from server.platforms.provider import ContentProvider, MC_DATE_FORMAT
 from server.platforms.exceptions import UnsupportedOperationException
+from server.util.timeseries import TimeSeries, DAY
 
 # 2014-09-21T00:00:00Z
 YT_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
-YT_SEARCH_API_URL = 'https://www.googleapis.com/youtube/v3/search'
+# the most results the search API returns per page
+YT_MAX_RESULTS = 50
 
 #YT_SEARCH_API_URL = 'https://content-youtube.googleapis.com/youtube/v3/search'
 YT_SEARCH_HEADERS = {
@@ -30,7 +33,11 @@ class YouTubeYouTubeProvider(ContentProvider):
         self._logger = logging.getLogger(__name__)
         self._api_key = api_key
 
-    def count_over_time(self, query: str, start_date: dt.datetime, end_date: dt.datetime, **kwargs) -> Dict:
+    def health_check(self) -> bool:
+        return self._api_key is not None
+
+    def count_series(self, query: str, start_date: dt.datetime, end_date: dt.datetime, granularity: str = DAY,
+                     **kwargs) -> TimeSeries:
         raise UnsupportedOperationException("Can't search youtube for videos poseted over time")
 
     def count(self, query: str, start_date: dt.datetime, end_date: dt.datetime, **kwargs) -> int:
@@ -59,19 +66,46 @@ class YouTubeYouTubeProvider(ContentProvider):
         :return:
         """
         results = self._fetch_results_from_api(query, start_date, end_date, limit, order="viewCount")
+        return self._videos_to_rows(results)
+
+    def iter_sample(self, query: str, start_date: dt.datetime, end_date: dt.datetime, limit: int = 20,
+                    **kwargs) -> Iterator[Dict]:
+        """
+        Yield up to `limit` of the most viewed videos matching the query, a page at a time.
+        :param query:
+        :param start_date:
+        :param end_date:
+        :param limit:
+        :param kwargs:
+        :return:
+        """
+        remaining = limit
+        page_token = None
+        while remaining > 0:
+            results = self._fetch_results_from_api(query, start_date, end_date, min(remaining, YT_MAX_RESULTS),
+                                                   order="viewCount", page_token=page_token)
+            rows = self._videos_to_rows(results)[:remaining]
+            yield from rows
+            remaining -= len(rows)
+            page_token = results.get('nextPageToken')
+            if (page_token is None) or (len(results['items']) == 0):
+                return
+
+    @classmethod
+    def _videos_to_rows(cls, results: Dict) -> List[Dict]:
         # make sure we pull out only the videos (even through we requested only videos
         videos = []
         for search_result in results['items']:
             if search_result["id"]["kind"] == "youtube#video":
                 videos.append(search_result)
         # format them like stories to return
-        stories = [self._content_to_row(v) for v in videos]
+        stories = [cls._content_to_row(v) for v in videos]
         return stories
 
     @classmethod
     def _content_to_row(cls, item):
         try:
-            publish_date = dateutil.parser.parse(item['snippet']['publishedAt']).strftime(MC_DATE_FORMAT)
+            publish_date = parse_iso_date(item['snippet']['publishedAt']).strftime(MC_DATE_FORMAT)
         except ValueError:
             publish_date = None
         except KeyError:
@@ -86,7 +120,7 @@ class YouTubeYouTubeProvider(ContentProvider):
             'url': "https://www.youtube.com/watch?v={}".format(item['id']['videoId'])
         }
 
-    @cache.cache_on_arguments()
+    @cache_on_arguments(expiration_time=recency_expiration())
     def _fetch_results_from_api(self, query: str, start_date: dt.datetime, end_date: dt.datetime,
                                 limit: int = 20, order: str = "relevance", page_token: str = None) -> dict:
         params = {
@@ -100,5 +134,5 @@ class YouTubeYouTubeProvider(ContentProvider):
             'order': order,
             'pageToken': page_token,
         }
-        response = requests.get(YT_SEARCH_API_URL, headers=YT_SEARCH_HEADERS, params=params)
+        response = transport.get(YT_SEARCH_API_URL, headers=YT_SEARCH_HEADERS, params=params)
         return response.json()
@@ -5,25 +5,14 @@ function downloadCsv() {
 }
 
 function submitSearch() {
-  fetchAndRender('/api/count-over-time.json', 'results-count-over-time', renderCountOverTime);
-  fetchAndRender('/api/count.json', 'results-count',
-    (destinationId, data) => document.getElementById(destinationId).innerHTML = `<h2>Total Attention</h2><p>${data}</p>`
-  );
-  fetchAndRender('/api/sample.json', 'results-sample', renderSample);
-}
-
-function getSearchParams(){
-  return {
-    platform: document.getElementById("platform").value,
-    terms: document.getElementById("terms").value,
-    startDate: document.getElementById("startDate").value,
-    endDate: document.getElementById("endDate").value
-  }
-}
-
-function fetchAndRender(url, destinationId, renderer) {
-  document.getElementById(destinationId).innerHTML = "Loading...";
-  fetch(url, {
+  // one request gets all three parts of the results, fetched concurrently on the server
+  const parts = {
+    'count_over_time': ['results-count-over-time', renderCountOverTime],
+    'count': ['results-count', renderCount],
+    'sample': ['results-sample', renderSample],
+  };
+  Object.values(parts).forEach(([destinationId, _]) => document.getElementById(destinationId).innerHTML = "Loading...");
+  fetch('/api/glimpse.json', {
         method: 'POST',
         headers: {
           'Accept': 'application/json',
@@ -31,13 +20,48 @@ function fetchAndRender(url, destinationId, renderer) {
         },
         body: JSON.stringify(getSearchParams())
       })
-    .then(response => response.json())
+    .then(response => response.json()
+      .catch(() => ({statusCode: response.status, message: response.statusText}))
+      .then(data => {
+        // a bad search fails as a whole, with a {statusCode, message} error, instead of part by part
+        if (!response.ok) {
+          throw new Error(data['message'] || `${response.status} ${response.statusText}`);
+        }
+        return data;
+      }))
     .then(data => {
-      document.getElementById(destinationId).innerHTML = "";
-      renderer(destinationId, data)
+      for (const [part, [destinationId, renderer]] of Object.entries(parts)) {
+        document.getElementById(destinationId).innerHTML = "";
+        if (data[part] !== null) {
+          renderer(destinationId, data[part]);
+        } else {
+          renderError(destinationId, data['errors'][part]);
+        }
+      }
+    })
+    .catch(error => {
+      Object.values(parts).forEach(([destinationId, _]) => renderError(destinationId, error.message));
     });
 }
 
+function renderError(destinationId, message) {
+  document.getElementById(destinationId).innerHTML = `<p>${message}</p>`;
+}
+
+function renderCount(destinationId, data) {
+  document.getElementById(destinationId).innerHTML = `<h2>Total Attention</h2><p>${data}</p>`;
+}
+
+function getSearchParams(){
+  return {
+    platform: document.getElementById("platform").value,
+    terms: document.getElementById("terms").value,
+    startDate: document.getElementById("startDate").value,
+    endDate: document.getElementById("endDate").value,
+    granularity: document.getElementById("granularity").value
+  }
+}
+
 function renderCountOverTime(destinationId, data) {
   vl.markLine()
     .width(1100)
@@ -0,0 +1,257 @@
+import json
+import unittest
+from unittest import mock
+from dogpile.cache.backends.memory import MemoryBackend
+import fakeredis
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+from server import app
+import server.api as api
+import server.jobs as jobs
+from server.util.cache import local_cache
+from server.util.timeseries import TimeSeries
+
+QUERY = dict(platform='reddit / pushshift', terms='robots', startDate='2022-01-01', endDate='2022-01-03')
+COUNTS = [dict(date='2022-01-01', count=1), dict(date='2022-01-02', count=2), dict(date='2022-01-03', count=3)]
+
+
+class ApiTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # keep cached results in memory instead of Redis
+        self._redis_backend = local_cache.proxied
+        local_cache.proxied = MemoryBackend({})
+        self._client = app.test_client()
+        self._provider = mock.Mock()
+        patcher = mock.patch.object(api.platforms, 'provider_for', return_value=self._provider)
+        self._provider_for = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        local_cache.proxied = self._redis_backend
+
+
+class GlimpseTest(ApiTestCase):
+
+    def test_all_parts(self):
+        self._provider.count_over_time.return_value = dict(counts=COUNTS)
+        self._provider.sample.return_value = [dict(id=1)]
+        response = self._client.post('/api/glimpse.json', json=QUERY)
+        assert response.status_code == 200
+        assert response.json['count_over_time'] == dict(counts=COUNTS)
+        # the total comes from the series, instead of going upstream again
+        assert response.json['count'] == 6
+        self._provider.count.assert_not_called()
+        assert response.json['sample'] == [dict(id=1)]
+        assert response.json['errors'] == {}
+        assert sorted(response.json['timings'].keys()) == ['count', 'count_over_time', 'sample']
+
+    def test_one_part_fails(self):
+        self._provider.count_over_time.return_value = dict(counts=COUNTS, total=6)
+        self._provider.sample.side_effect = RuntimeError("upstream is down")
+        response = self._client.post('/api/glimpse.json', json=QUERY)
+        assert response.status_code == 200
+        assert response.json['count'] == 6
+        assert response.json['sample'] is None
+        assert response.json['errors'] == dict(sample="upstream is down")
+
+    def test_bad_request(self):
+        response = self._client.post('/api/glimpse.json', json=dict(QUERY, startDate='not a date'))
+        assert response.status_code == 400
+        assert response.json['statusCode'] == 400
+        assert 'not a date' in response.json['message']
+
+
+class FanOutTest(ApiTestCase):
+
+    def test_each_platform(self):
+        self._provider.count.return_value = 42
+        response = self._client.post('/api/fan-out.json', json=dict(QUERY, platforms=['reddit / pushshift',
+                                                                                      'youtube / youtube']))
+        assert response.status_code == 200
+        assert sorted(response.json.keys()) == ['reddit / pushshift', 'youtube / youtube']
+        for result in response.json.values():
+            assert result['status'] == 'ok'
+            assert result['result'] == 42
+        assert sorted(call.args for call in self._provider_for.call_args_list) == [('reddit', 'pushshift'),
+                                                                                    ('youtube', 'youtube')]
+
+    def test_unavailable_platform(self):
+        # one that's well formed, but we can't build a provider for
+        self._provider_for.side_effect = [self._provider, ValueError("No provider for twitter / twitter")]
+        self._provider.count.return_value = 42
+        response = self._client.post('/api/fan-out.json', json=dict(QUERY, platforms=['reddit / pushshift',
+                                                                                      'twitter / twitter']))
+        assert response.status_code == 200
+        assert response.json['reddit / pushshift']['status'] == 'ok'
+        assert response.json['twitter / twitter']['status'] == 'error'
+
+    def test_malformed_platform(self):
+        response = self._client.post('/api/fan-out.json', json=dict(QUERY, platforms=['reddit / pushshift',
+                                                                                      'reddit']))
+        assert response.status_code == 400
+        assert '"reddit"' in response.json['message']
+        self._provider.count.assert_not_called()
+
+
+class ConditionalGetTest(ApiTestCase):
+
+    def test_not_modified(self):
+        self._provider.count.return_value = 42
+        response = self._client.get('/api/count.json', query_string=QUERY)
+        assert response.status_code == 200
+        assert response.json == 42
+        assert response.cache_control.public
+        etag = response.headers['ETag']
+        # straight from the app, because the test client's responses add a default Content-Type
+        environ = EnvironBuilder(path='/api/count.json', query_string=QUERY, headers={'If-None-Match': etag})\
+            .get_environ()
+        body, status, headers = run_wsgi_app(app, environ)
+        assert status == '304 NOT MODIFIED'
+        assert b''.join(body) == b''
+        assert 'Content-Type' not in headers
+        assert headers['ETag'] == etag
+        assert headers['Cache-Control'] == response.headers['Cache-Control']
+        # from the cache, after the first time
+        assert self._provider.count.call_count == 1
+
+    def test_changed(self):
+        self._provider.count.return_value = 42
+        etag = self._client.get('/api/count.json', query_string=QUERY).headers['ETag']
+        response = self._client.get('/api/count.json', query_string=dict(QUERY, terms='robot'),
+                                    headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_posts_not_cacheable(self):
+        self._provider.count.return_value = 42
+        response = self._client.post('/api/count.json', json=QUERY)
+        assert response.status_code == 200
+        assert 'ETag' not in response.headers
+
+
+class JobsApiTest(ApiTestCase):
+
+    def setUp(self):
+        super(JobsApiTest, self).setUp()
+        self._redis = fakeredis.FakeStrictRedis()
+        patcher = mock.patch.object(jobs, 'redis_client', return_value=self._redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_submit_and_poll(self):
+        response = self._client.post('/api/jobs.json', json=dict(QUERY, operation='count'))
+        assert response.status_code == 202
+        job_id = response.json['id']
+        assert response.json['status'] == jobs.STATUS_QUEUED
+        assert self._client.get('/api/jobs/{}.json'.format(job_id)).json['status'] == jobs.STATUS_QUEUED
+        response = self._client.get('/api/jobs/{}/result.json'.format(job_id))
+        assert response.status_code == 409
+        # what a worker does with it
+        self._provider.count.return_value = 42
+        jobs.run_job(job_id)
+        assert self._client.get('/api/jobs/{}.json'.format(job_id)).json['status'] == jobs.STATUS_DONE
+        response = self._client.get('/api/jobs/{}/result.json'.format(job_id))
+        assert response.status_code == 200
+        assert response.json == 42
+
+    def test_bad_jobs(self):
+        response = self._client.post('/api/jobs.json', json=dict(QUERY, operation='words'))
+        assert response.status_code == 400
+        response = self._client.post('/api/jobs.json', json=dict(QUERY, operation='sample', limit=10 ** 9))
+        assert response.status_code == 400
+        response = self._client.post('/api/jobs.json', json=dict(operation='count', terms='robots'))
+        assert response.status_code == 400
+        assert self._redis.llen(jobs.QUEUE_KEY) == 0
+
+    def test_unknown_job(self):
+        assert self._client.get('/api/jobs/nope.json').status_code == 404
+        assert self._client.get('/api/jobs/nope/result.json').status_code == 404
+
+
+class ExportTest(ApiTestCase):
+
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        self._series = TimeSeries.from_counts(COUNTS)
+
+    def test_count_over_time_csv(self):
+        self._provider.count_series.return_value = self._series
+        response = self._client.get('/api/count-over-time.csv', query_string=dict(QUERY, granularity='week'))
+        assert response.status_code == 200
+        assert response.mimetype == 'text/csv'
+        assert response.headers['Content-Disposition'] == 'attachment; filename=count-over-time.csv'
+        assert response.data.decode().splitlines() == [
+            'date,timestamp,count', '2022-01-01 00:00:00,1640995200,1', '2022-01-02 00:00:00,1641081600,2',
+            '2022-01-03 00:00:00,1641168000,3']
+        assert self._provider.count_series.call_args.kwargs['granularity'] == 'week'
+
+    def test_normalized_count_over_time_ndjson(self):
+        self._provider.normalized_count_series.return_value = (self._series, self._series + self._series)
+        response = self._client.get('/api/normalized-count-over-time.ndjson', query_string=QUERY)
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        rows = [json.loads(line) for line in response.data.splitlines()]
+        assert [r['ratio'] for r in rows] == [0.5, 0.5, 0.5]
+        assert [r['total_count'] for r in rows] == [2, 4, 6]
+
+    def test_sample(self):
+        self._provider.iter_sample.return_value = iter([dict(id=i, content='robot {}'.format(i)) for i in range(3)])
+        response = self._client.get('/api/sample.csv', query_string=dict(QUERY, limit=3))
+        assert response.status_code == 200
+        assert response.data.decode().splitlines() == ['id,content', '0,robot 0', '1,robot 1', '2,robot 2']
+        assert self._provider.iter_sample.call_args.kwargs['limit'] == 3
+
+    def test_bad_exports(self):
+        assert self._client.get('/api/sample.csv', query_string=dict(QUERY, limit=0)).status_code == 400
+        response = self._client.get('/api/count-over-time.csv', query_string=dict(platform='reddit / pushshift'))
+        assert response.status_code == 400
+        assert 'terms' in response.json['message']
+        assert self._client.get('/api/count-over-time.xml', query_string=QUERY).status_code == 404
+
+
+class BatchTest(ApiTestCase):
+
+    def test_aligned_series(self):
+        series = {
+            'robots': TimeSeries.from_counts(COUNTS[:2]),
+            'ai': TimeSeries.from_counts(COUNTS[1:]),
+        }
+        self._provider.count_series.side_effect = lambda terms, *args, **kwargs: series[terms.strip().lower()]
+        self._provider.denominator_series.return_value = TimeSeries.from_counts(
+            [dict(c, count=10) for c in COUNTS])
+        response = self._client.post('/api/batch.json', json=dict(QUERY, queries=['robots', 'ai', 'Robots '],
+                                                                  normalize=True))
+        assert response.status_code == 200
+        assert response.json['dates'] == ['2022-01-01T00:00:00Z', '2022-01-02T00:00:00Z', '2022-01-03T00:00:00Z']
+        assert response.json['denominator']['counts'] == [10, 10, 10]
+        results = response.json['results']
+        assert [r['terms'] for r in results] == ['robots', 'ai', 'Robots ']
+        assert results[0]['counts'] == [1, 2, 0]
+        assert results[1]['counts'] == [0, 2, 3]
+        assert results[1]['ratios'] == [0, 0.2, 0.3]
+        assert results[2]['counts'] == results[0]['counts']
+        # the repeated query (and the denominator) only ran once
+        assert self._provider.count_series.call_count == 2
+        assert self._provider.denominator_series.call_count == 1
+        assert response.json['progress'] == dict(ok=2)
+
+    def test_failed_query(self):
+        def count_series(terms, *args, **kwargs):
+            if terms == 'ai':
+                raise RuntimeError("upstream is down")
+            return TimeSeries.from_counts(COUNTS)
+        self._provider.count_series.side_effect = count_series
+        response = self._client.post('/api/batch.json', json=dict(QUERY, queries=['robots', 'ai']))
+        assert response.status_code == 200
+        assert response.json['denominator'] is None
+        robots, ai = response.json['results']
+        assert (robots['status'], robots['total']) == ('ok', 6)
+        assert (ai['status'], ai['error'], ai['counts']) == ('error', "upstream is down", None)
+        assert response.json['progress'] == dict(ok=1, error=1)
+
+    def test_too_many_queries(self):
+        assert self._client.post('/api/batch.json', json=dict(QUERY, queries=[])).status_code == 400
+        response = self._client.post('/api/batch.json', json=dict(QUERY, queries=['robots'] * 1000))
+        assert response.status_code == 400
+        self._provider.count_series.assert_not_called()
@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+import fakeredis
+
+from server import jobs
+
+PARAMS = dict(platform='reddit / pushshift', terms='robots', startDate='2022-01-01', endDate='2022-01-31')
+
+
+class JobsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._redis = fakeredis.FakeStrictRedis()
+        patcher = mock.patch.object(jobs, 'redis_client', return_value=self._redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _take_job(self, worker_id: str) -> str:
+        # what a worker thread does before running a job
+        return self._redis.brpoplpush(jobs.QUEUE_KEY, jobs._processing_key(worker_id), timeout=1).decode('utf-8')
+
+
+class SubmitTest(JobsTestCase):
+
+    def test_queued(self):
+        job_id = jobs.submit('count', PARAMS)
+        job = jobs.status(job_id)
+        assert job['id'] == job_id
+        assert job['operation'] == 'count'
+        assert job['status'] == jobs.STATUS_QUEUED
+        assert job['progress'] == 0
+        assert job['error'] is None
+        assert jobs.result(job_id) is None
+        assert self._redis.lrange(jobs.QUEUE_KEY, 0, -1) == [job_id.encode('utf-8')]
+
+    def test_unsupported_operation(self):
+        self.assertRaises(ValueError, jobs.submit, 'words', PARAMS)
+        assert self._redis.llen(jobs.QUEUE_KEY) == 0
+
+    def test_unknown_job(self):
+        assert jobs.status('nope') is None
+        assert jobs.result('nope') is None
+
+    def test_malformed_platform(self):
+        self.assertRaises(ValueError, jobs.submit, 'count', dict(PARAMS, platform='reddit'))
+        assert self._redis.llen(jobs.QUEUE_KEY) == 0
+
+
+class WorkerTest(JobsTestCase):
+
+    def setUp(self):
+        super(WorkerTest, self).setUp()
+        self._provider = mock.Mock()
+        patcher = mock.patch.object(jobs.platforms, 'provider_for', return_value=self._provider)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _run_worker_until_finished(self, job_ids):
+        stop = threading.Event()
+        worker = threading.Thread(target=jobs.run_worker, args=(2, stop))
+        with mock.patch.object(jobs, 'QUEUE_POLL_TIMEOUT', 0.1):
+            worker.start()
+            for _ in range(100):
+                if all(jobs.status(job_id)['status'] in [jobs.STATUS_DONE, jobs.STATUS_FAILED] for job_id in job_ids):
+                    break
+                time.sleep(0.05)
+            stop.set()
+            worker.join(5)
+        assert not worker.is_alive()
+
+    def test_runs_jobs(self):
+        self._provider.count.return_value = 42
+        self._provider.iter_sample.return_value = iter([dict(id=i) for i in range(250)])
+        count_job = jobs.submit('count', PARAMS)
+        sample_job = jobs.submit('sample', dict(PARAMS, limit=250))
+        self._run_worker_until_finished([count_job, sample_job])
+        assert jobs.status(count_job)['status'] == jobs.STATUS_DONE
+        assert jobs.status(count_job)['progress'] == 1
+        assert json.loads(jobs.result(count_job)) == 42
+        assert len(json.loads(jobs.result(sample_job))) == 250
+        # it cleaned up after itself
+        assert self._redis.llen(jobs.QUEUE_KEY) == 0
+        assert self._redis.keys('glimpse:jobs:processing:*') == []
+        assert self._redis.scard(jobs.WORKERS_KEY) == 0
+
+    def test_failed_job(self):
+        self._provider.count.side_effect = RuntimeError("upstream is down")
+        job_id = jobs.submit('count', PARAMS)
+        self._run_worker_until_finished([job_id])
+        job = jobs.status(job_id)
+        assert job['status'] == jobs.STATUS_FAILED
+        assert job['error'] == "upstream is down"
+        assert jobs.result(job_id) is None
+
+
+class RequeueTest(JobsTestCase):
+
+    def test_dead_worker_jobs_requeued(self):
+        job_id = jobs.submit('count', PARAMS)
+        self._redis.sadd(jobs.WORKERS_KEY, 'dead')
+        assert self._take_job('dead') == job_id
+        jobs._update(job_id, status=jobs.STATUS_RUNNING)
+        assert self._redis.llen(jobs.QUEUE_KEY) == 0
+        # it never renewed its heartbeat
+        assert jobs.requeue_abandoned_jobs() == 1
+        assert self._redis.lrange(jobs.QUEUE_KEY, 0, -1) == [job_id.encode('utf-8')]
+        assert self._redis.llen(jobs._processing_key('dead')) == 0
+        assert not self._redis.sismember(jobs.WORKERS_KEY, 'dead')
+        assert jobs.status(job_id)['status'] == jobs.STATUS_QUEUED
+
+    def test_live_worker_jobs_kept(self):
+        job_id = jobs.submit('count', PARAMS)
+        jobs._heartbeat('alive')
+        assert self._take_job('alive') == job_id
+        assert jobs.requeue_abandoned_jobs() == 0
+        assert self._redis.llen(jobs._processing_key('alive')) == 1
+
+    def test_gives_up_after_max_attempts(self):
+        job_id = jobs.submit('count', PARAMS)
+        self._redis.hset(jobs._job_key(job_id), 'attempts', jobs.MAX_ATTEMPTS)
+        with mock.patch.object(jobs, '_run_operation') as run_operation:
+            jobs.run_job(job_id)
+        run_operation.assert_not_called()
+        assert jobs.status(job_id)['status'] == jobs.STATUS_FAILED
@@ -0,0 +1,91 @@
+import lzma
+import pickle
+import zlib
+from typing import List
+
+from server import CACHE_CODEC, CACHE_COMPRESSION_THRESHOLD, CACHE_COMPRESSION_LEVEL
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # optional - only needed for CACHE_CODEC=zstd
+
+# the first byte of every encoded value says how the rest of it was encoded, so the format can change later (and
+# values written with one CACHE_CODEC can still be read after switching to another)
+FORMAT_PICKLE = 1
+FORMAT_PICKLE_ZLIB = 2
+FORMAT_PICKLE_LZMA = 3
+FORMAT_PICKLE_ZSTD = 4
+# values written before we had a codec are bare pickles, which always start with the PROTO opcode
+LEGACY_PICKLE_HEADER = 0x80
+
+# the CACHE_CODEC setting that picks each format for the values big enough to compress
+CODECS = {
+    'none': FORMAT_PICKLE,
+    'zlib': FORMAT_PICKLE_ZLIB,
+    'lzma': FORMAT_PICKLE_LZMA,
+    'zstd': FORMAT_PICKLE_ZSTD,
+}
+
+# how each compressed format is compressed (at a level) and uncompressed again
+_COMPRESSORS = {
+    FORMAT_PICKLE_ZLIB: (zlib.compress, zlib.decompress),
+    FORMAT_PICKLE_LZMA: (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+if zstandard is not None:
+    _COMPRESSORS[FORMAT_PICKLE_ZSTD] = (lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+                                        lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+
+def available_codecs() -> List[str]:
+    """
+    :return: the CACHE_CODEC settings that can be used here (zstd needs the optional `zstandard` package)
+    """
+    return [name for name, data_format in CODECS.items()
+            if (data_format == FORMAT_PICKLE) or (data_format in _COMPRESSORS)]
+
+
+def _format_for(codec: str) -> int:
+    if codec not in CODECS:
+        raise ValueError("Unknown cache codec {} (use one of {})".format(codec, list(CODECS.keys())))
+    if codec not in available_codecs():
+        raise ValueError("The {} cache codec needs the optional zstandard package".format(codec))
+    return CODECS[codec]
+
+
+# checked on import, so a bad setting stops the app starting instead of failing every cache write
+_default_format = _format_for(CACHE_CODEC)
+
+
+def encode(value, codec: str = None) -> bytes:
+    """
+    Serialize a value for storage in the cache, compressing it if it is big enough to be worth it.
+    :param value:
+    :param codec: one of CODECS (defaults to the CACHE_CODEC setting)
+    :return:
+    """
+    data_format = _default_format if codec is None else _format_for(codec)
+    pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    if (data_format == FORMAT_PICKLE) or (len(pickled) < CACHE_COMPRESSION_THRESHOLD):
+        return bytes([FORMAT_PICKLE]) + pickled
+    compress, _ = _COMPRESSORS[data_format]
+    return bytes([data_format]) + compress(pickled, CACHE_COMPRESSION_LEVEL)
+
+
+def decode(data: bytes):
+    """
+    Turn bytes created by `encode` (with any codec, or by the older pickle-only cache) back into the original value.
+    :param data:
+    :return:
+    """
+    header = data[0]
+    if header == FORMAT_PICKLE:
+        return pickle.loads(memoryview(data)[1:])
+    if header in _COMPRESSORS:
+        _, decompress = _COMPRESSORS[header]
+        return pickle.loads(decompress(memoryview(data)[1:]))
+    if header == LEGACY_PICKLE_HEADER:
+        return pickle.loads(data)
+    if header == FORMAT_PICKLE_ZSTD:
+        raise ValueError("Reading zstd-compressed cache values needs the optional zstandard package")
+    raise ValueError("Unknown cache encoding format {}".format(header))
@@ -0,0 +1,68 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from functools import partial
+from typing import Any, Callable, Dict, Tuple
+
+STATUS_OK = 'ok'
+STATUS_TIMEOUT = 'timeout'
+STATUS_ERROR = 'error'
+
+
+def timed_call(fn: Callable, *args, **kwargs) -> Tuple[Any, float]:
+    """
+    Call the function and report how long it took.
+    :param fn:
+    :param args:
+    :param kwargs:
+    :return: a tuple of the function's result and the elapsed wall-clock time in milliseconds
+    """
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, round((time.perf_counter() - start) * 1000, 1)
+
+
+def in_current_context(fn: Callable) -> Callable:
+    """
+    Threads don't inherit the context variables of whoever started them (ie. the profile of the request being
+    handled, see `server.util.profiling`), so wrap functions you hand to another thread with this.
+    :param fn:
+    :return: fn, to be run in a copy of the calling thread's current context
+    """
+    return partial(contextvars.copy_context().run, fn)
+
+
+def run_with_deadlines(tasks: Dict[str, Callable], timeouts: Dict[str, float],
+                       max_workers: int = None) -> Dict[str, Dict]:
+    """
+    Run every task at the same time, each against its own deadline (in seconds). This returns as soon as every task
+    has either finished or run out of time, so the wait is set by the slowest deadline rather than the sum of them.
+    Tasks that miss their deadline are left to finish in the background, but ones still waiting for a worker (with
+    max_workers set) are cancelled.
+    :param tasks: no-argument callables, keyed by name
+    :param timeouts: seconds each named task is allowed to run (counted from when they were all submitted, so with
+    max_workers set this includes any time spent waiting for a turn)
+    :param max_workers: the most tasks to run at once (defaults to all of them)
+    :return: a dict keyed by task name, each with a `status`, `result`, `error` and `elapsed` milliseconds
+    """
+    results = {}
+    if len(tasks) == 0:
+        return results
+    executor = ThreadPoolExecutor(max_workers=len(tasks) if max_workers is None else min(max_workers, len(tasks)))
+    start = time.monotonic()
+    futures = {name: executor.submit(in_current_context(timed_call), task) for name, task in tasks.items()}
+    for name, future in futures.items():
+        remaining = max(0, timeouts[name] - (time.monotonic() - start))
+        try:
+            result, elapsed = future.result(timeout=remaining)
+            results[name] = dict(status=STATUS_OK, result=result, error=None, elapsed=elapsed)
+        except FuturesTimeoutError:
+            results[name] = dict(status=STATUS_TIMEOUT, result=None,
+                                 error="No results within {} seconds".format(timeouts[name]),
+                                 elapsed=round((time.monotonic() - start) * 1000, 1))
+        except Exception as e:
+            results[name] = dict(status=STATUS_ERROR, result=None, error=str(e),
+                                 elapsed=round((time.monotonic() - start) * 1000, 1))
+    # don't wait for the stragglers that started; they can finish (and fill the cache) on their own
+    executor.shutdown(wait=False, cancel_futures=True)
+    return results
@@ -1,7 +1,12 @@
 from datetime import datetime as dt
+from datetime import timezone
+import dateutil.parser
 
 SOLR_DATE_FORMAT = '%Y-%m-%d'
 
+# the length of "2021-01-01T00:00:00", the part of an ISO 8601 timestamp our fast paths read
+ISO_DATETIME_LENGTH = 19
+
 
 def unix_to_solr_date(timestamp):
     date = dt.fromtimestamp(timestamp)
@@ -9,4 +14,43 @@ def unix_to_solr_date(timestamp):
 
 
 def solr_date_to_date(date_str):
-    return dt.strptime(date_str, SOLR_DATE_FORMAT)
+    try:
+        return dt.fromisoformat(date_str)
+    except ValueError:
+        return dt.strptime(date_str, SOLR_DATE_FORMAT)
+
+
+def parse_iso_date(date_str: str) -> dt:
+    """
+    Parse the ISO 8601 timestamps upstream APIs send us (ie. "2021-01-01T00:00:00.000Z" from Twitter or
+    "2021-01-01T00:00:00Z" from YouTube) much faster than the generic parsers can. Anything else falls back to
+    dateutil.
+    :param date_str:
+    :return: a naive datetime in UTC
+    """
+    if date_str.endswith('Z') or (len(date_str) == ISO_DATETIME_LENGTH):
+        try:
+            return dt.fromisoformat(date_str[:ISO_DATETIME_LENGTH])
+        except ValueError:
+            pass
+    return parse_date(date_str)
+
+
+def parse_epoch_millis(millis: int) -> dt:
+    """
+    :param millis: milliseconds since the Unix epoch (ie. Elasticsearch histogram bucket keys from Pushshift)
+    :return: a naive datetime in UTC
+    """
+    return dt.utcfromtimestamp(millis / 1000)
+
+
+def parse_date(date_str: str) -> dt:
+    """
+    The slow, generic fallback for date strings in formats we don't have a fast path for.
+    :param date_str:
+    :return: a naive datetime in UTC (or in whatever timezone it was given in, if it didn't say)
+    """
+    date = dateutil.parser.parse(date_str)
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
@@ -0,0 +1,99 @@
+import time
+from contextlib import contextmanager
+from typing import Tuple
+from urllib.parse import urlsplit
+from flask import g, request, Response
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+
+from server import PROMETHEUS_MULTIPROC_DIR
+from server.util import profiling
+
+# the platforms requests can be labelled with - anything else is counted as 'other', to keep label values bounded
+PLATFORM_LABELS = ['twitter', 'reddit', 'youtube', 'onlinenews']
+
+# from quick cache hits up to the slowest upstream queries we wait on
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+REQUEST_LATENCY = Histogram('glimpse_request_duration_seconds', "Time to answer API requests",
+                            ['route', 'method', 'platform', 'status'], buckets=LATENCY_BUCKETS)
+RESPONSE_SIZE = Histogram('glimpse_response_bytes', "Size of API response bodies (before compression)",
+                          ['route'], buckets=SIZE_BUCKETS)
+UPSTREAM_CALLS = Counter('glimpse_upstream_requests_total', "Requests sent to upstream platform APIs, by host and "
+                                                            "status code", ['upstream', 'status'])
+UPSTREAM_LATENCY = Histogram('glimpse_upstream_request_duration_seconds', "Time upstream platform APIs took to answer",
+                             ['upstream'], buckets=LATENCY_BUCKETS)
+CACHE_LOOKUPS = Counter('glimpse_cache_lookups_total', "Cache lookups by tier (l1 in-process, l2 Redis) and result "
+                                                        "(hits or misses)", ['tier', 'result'])
+CACHE_REGENERATIONS = Counter('glimpse_cache_regenerations_total', "Cached values computed from scratch (including "
+                                                                   "background refreshes), by function", ['function'])
+CACHE_COALESCED = Counter('glimpse_cache_coalesced_total', "Calls that shared the result of an identical one in "
+                                                           "flight instead of running their own")
+CACHE_VALUE_SIZE = Histogram('glimpse_cache_value_bytes', "Size of encoded values written to Redis",
+                             buckets=SIZE_BUCKETS)
+
+
+def render() -> Tuple[bytes, str]:
+    """
+    :return: every metric, in the Prometheus text exposition format, and its content type. Under gunicorn with
+    PROMETHEUS_MULTIPROC_DIR set these are the totals across all the workers, not just the one answering.
+    """
+    if PROMETHEUS_MULTIPROC_DIR is not None:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def _request_platform() -> str:
+    data = request.get_json(silent=True) if request.method == 'POST' else request.args
+    platform = data.get('platform') if hasattr(data, 'get') else None
+    if not platform:
+        return 'none'
+    platform = str(platform).split('/')[0].strip()
+    return platform if platform in PLATFORM_LABELS else 'other'
+
+
+def start_request_timer() -> None:
+    """
+    Register with `app.before_request`.
+    """
+    g.request_started_at = time.perf_counter()
+
+
+def observe_request(response: Response) -> Response:
+    """
+    Register with `app.after_request` to record how long each request took, by route and platform. Streamed responses
+    are timed up to when they start streaming.
+    """
+    started_at = g.pop('request_started_at', None)
+    if started_at is None:
+        return response
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUEST_LATENCY.labels(route, request.method, _request_platform(), str(response.status_code))\
+        .observe(time.perf_counter() - started_at)
+    if not response.is_streamed:
+        RESPONSE_SIZE.labels(route).observe(response.calculate_content_length() or 0)
+    return response
+
+
+@contextmanager
+def upstream_call(url: str):
+    """
+    Time a call to an upstream API and count it by status code. Set `status` on the yielded dict once you know it;
+    exceptions are counted by their `status_code` if they have one, or as 'error'.
+    """
+    host = urlsplit(url).netloc
+    call = dict(status=None)
+    started_at = time.perf_counter()
+    try:
+        with profiling.span('upstream', host):
+            yield call
+    except Exception as e:
+        call['status'] = getattr(e, 'status_code', None) or 'error'
+        raise
+    finally:
+        UPSTREAM_LATENCY.labels(host).observe(time.perf_counter() - started_at)
+        UPSTREAM_CALLS.labels(host, str(call['status'])).inc()
@@ -0,0 +1,228 @@
+import contextvars
+import cProfile
+import datetime as dt
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import nullcontext
+from typing import Dict, List, Optional, Tuple
+from flask import g, request, Response
+
+from server import PROFILE_SAMPLE_RATE, PROFILE_ADMIN_TOKEN, PROFILE_DIR, PROFILE_MAX_FILES
+
+logger = logging.getLogger(__name__)
+
+# send this header with the value of PROFILE_ADMIN_TOKEN to profile a request (or to fetch profiles)
+PROFILE_HEADER = 'X-Glimpse-Profile'
+# profiled responses say which profile they went into
+PROFILE_ID_HEADER = 'X-Glimpse-Profile-Id'
+PROFILE_ID_PATTERN = re.compile(r'^\d{8}T\d{9}-[0-9a-f]{8}$')  # ie. 20220301T142501123-0f3a9c2e, in UTC
+# where the API serves saved profiles from
+PROFILES_PATH = '/api/profiles'
+# how many functions the summary lists, slowest (by cumulative time) first
+SUMMARY_FUNCTIONS = 30
+
+_NO_SPAN = nullcontext()
+# the profile of the request this greenlet (or thread) is handling, if it is being profiled, and the spans it is in
+_current: contextvars.ContextVar[Optional[Tuple['RequestProfile', Tuple[str, ...]]]] = \
+    contextvars.ContextVar('profile', default=None)
+# only one cProfile can run in a thread at a time, and under gevent every request in a worker shares the thread
+_profiler_lock = threading.Lock()
+
+
+class RequestProfile:
+    """
+    A cProfile of one request, plus the time spent in each span (upstream call, cache operation or regeneration of
+    a cached value) it went through, by the stack of spans it was nested in.
+    """
+
+    def __init__(self):
+        # ids sort by when they were taken (to the millisecond)
+        self.id = '{}-{}'.format(dt.datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')[:-3], uuid.uuid4().hex[:8])
+        self.started_at = time.perf_counter()
+        self.profiler = cProfile.Profile()
+        self._lock = threading.Lock()  # spans can end in other threads (see `in_current_context`)
+        self.span_totals: Dict[Tuple[str, ...], float] = defaultdict(float)  # stack of span names -> seconds
+        self.span_counts: Dict[Tuple[str, ...], int] = defaultdict(int)
+
+    def add_span(self, stack: Tuple[str, ...], seconds: float) -> None:
+        with self._lock:
+            self.span_totals[stack] += seconds
+            self.span_counts[stack] += 1
+
+    def collapsed_stacks(self, total: float) -> List[str]:
+        """
+        :return: lines of `span;nested span;... microseconds` (of self time), the input format flamegraph tools take.
+        Spans that ran concurrently (ie. count shards) can add up to more than their parent, which then shows 0.
+        """
+        totals = dict(self.span_totals)
+        totals[('request',)] = total
+        child_totals = defaultdict(float)
+        for stack, seconds in totals.items():
+            if len(stack) > 1:
+                child_totals[stack[:-1]] += seconds
+        return ['{} {}'.format(';'.join(stack), max(0, int((seconds - child_totals[stack]) * 1000000)))
+                for stack, seconds in sorted(totals.items())]
+
+    def span_breakdown(self) -> List[Dict]:
+        """
+        :return: total seconds and calls for each kind of span (wherever it was nested), slowest first
+        """
+        by_span = defaultdict(lambda: dict(seconds=0.0, calls=0))
+        for stack, seconds in self.span_totals.items():
+            # a span nested in one with the same name (ie. a regeneration inside a regeneration) is already counted
+            if stack[-1] not in stack[:-1]:
+                by_span[stack[-1]]['seconds'] += seconds
+                by_span[stack[-1]]['calls'] += self.span_counts[stack]
+        return sorted([dict(span=span, **totals) for span, totals in by_span.items()], key=lambda s: -s['seconds'])
+
+
+class _Span:
+
+    def __init__(self, profile: RequestProfile, stack: Tuple[str, ...]):
+        self._profile = profile
+        self._stack = stack
+
+    def __enter__(self):
+        self._context_token = _current.set((self._profile, self._stack))
+        self._started_at = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self._profile.add_span(self._stack, time.perf_counter() - self._started_at)
+        _current.reset(self._context_token)
+
+
+def span(kind: str, name: str):
+    """
+    Time a block as part of the profile of the current request, ie. `with profiling.span('cache', 'get'):`. When the
+    request isn't being profiled this costs one context variable lookup.
+    """
+    current = _current.get()
+    if current is None:
+        return _NO_SPAN
+    profile, stack = current
+    return _Span(profile, stack + ('{}:{}'.format(kind, name),))
+
+
+def is_admin_request() -> bool:
+    return (PROFILE_ADMIN_TOKEN is not None) and (request.headers.get(PROFILE_HEADER) == PROFILE_ADMIN_TOKEN)
+
+
+def start_request() -> None:
+    """
+    Register with `app.before_request`. Profiles this request if it asked to be (with the admin token) or it was
+    picked at random, at PROFILE_SAMPLE_RATE.
+    """
+    if (PROFILE_ADMIN_TOKEN is None) and (PROFILE_SAMPLE_RATE <= 0):
+        return
+    if not (is_admin_request() or (random.random() < PROFILE_SAMPLE_RATE)):
+        return
+    if request.path.startswith(PROFILES_PATH):
+        return  # fetching profiles would just fill the directory with profiles of doing that
+    if not _profiler_lock.acquire(blocking=False):
+        logger.debug("Not profiling {} because another request is being profiled".format(request.path))
+        return
+    profile = RequestProfile()
+    g.profile = profile
+    g.profile_context_token = _current.set((profile, ('request',)))
+    profile.profiler.enable()
+
+
+def finish_request(response: Response) -> Response:
+    """
+    Register with `app.after_request` (before any other after_request hooks, so it runs last and profiles them
+    too). Saves the profile of this request, if there is one. Streamed responses are profiled up to when they start
+    streaming.
+    """
+    profile = _stop()
+    if profile is None:
+        return response
+    try:
+        save(profile, time.perf_counter() - profile.started_at, response.status_code)
+        response.headers[PROFILE_ID_HEADER] = profile.id
+    except OSError as e:
+        logger.warning("Couldn't save profile {}: {}".format(profile.id, e))
+    return response
+
+
+def abandon_request(exception: Optional[BaseException]) -> None:
+    """
+    Register with `app.teardown_request`, so a request that failed before `finish_request` ran doesn't leave the
+    profiler running.
+    """
+    _stop()
+
+
+def _stop() -> Optional[RequestProfile]:
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.profiler.disable()
+        _current.reset(g.pop('profile_context_token'))
+        _profiler_lock.release()
+    return profile
+
+
+def _path(profile_id: str, extension: str) -> str:
+    return os.path.join(PROFILE_DIR, '{}.{}'.format(profile_id, extension))
+
+
+def save(profile: RequestProfile, total: float, status_code: int) -> None:
+    """
+    Write the pstats (for `python -m pstats` or snakeviz), collapsed span stacks (for flamegraph.pl or speedscope)
+    and a JSON summary of a request's profile to PROFILE_DIR, and remove the oldest profiles beyond PROFILE_MAX_FILES.
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile.profiler.dump_stats(_path(profile.id, 'pstats'))
+    with open(_path(profile.id, 'collapsed'), 'w') as f:
+        f.write("\n".join(profile.collapsed_stacks(total)) + "\n")
+    stats = pstats.Stats(profile.profiler, stream=io.StringIO())
+    functions = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:SUMMARY_FUNCTIONS]
+    summary = dict(
+        id=profile.id, method=request.method, path=request.full_path, status=status_code, seconds=total,
+        spans=profile.span_breakdown(),
+        functions=[dict(function='{}:{}({})'.format(*key), calls=calls, seconds=own_seconds,
+                        cumulative_seconds=cumulative_seconds)
+                   for key, (_, calls, own_seconds, cumulative_seconds, _) in functions],
+    )
+    with open(_path(profile.id, 'json'), 'w') as f:
+        json.dump(summary, f)
+    _prune()
+
+
+def _prune() -> None:
+    ids = list_ids()
+    for profile_id in ids[PROFILE_MAX_FILES:]:
+        for extension in ['json', 'pstats', 'collapsed']:
+            try:
+                os.remove(_path(profile_id, extension))
+            except FileNotFoundError:
+                pass
+
+
+def list_ids() -> List[str]:
+    """
+    :return: the ids of the saved profiles, newest first
+    """
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    ids = [name[:-len('.json')] for name in os.listdir(PROFILE_DIR) if name.endswith('.json')]
+    return sorted([i for i in ids if PROFILE_ID_PATTERN.match(i)], reverse=True)
+
+
+def profile_path(profile_id: str, extension: str) -> Optional[str]:
+    """
+    :return: where a saved profile's file of this type ('json', 'pstats' or 'collapsed') is, or None if there isn't
+    one (or the id isn't valid)
+    """
+    if (not PROFILE_ID_PATTERN.match(profile_id)) or (extension not in ['json', 'pstats', 'collapsed']):
+        return None
+    path = _path(profile_id, extension)
+    return path if os.path.exists(path) else None
@@ -0,0 +1,174 @@
+import csv
+import gzip
+import hashlib
+import itertools
+import logging
+from typing import Any, Dict, Iterable, Iterator, List
+import orjson
+from flask import Response, request, stream_with_context
+
+from server import RESPONSE_COMPRESSION_THRESHOLD, RESPONSE_GZIP_LEVEL, RESPONSE_BROTLI_QUALITY, HTTP_CACHE_MAX_AGE
+from server.util.cache import expiration_for_range_ending
+from server.util import profiling
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # optional - without it we fall back to gzip
+
+logger = logging.getLogger(__name__)
+
+JSON_MIMETYPE = 'application/json'
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+# streamed exports send rows in chunks of about this many bytes
+EXPORT_CHUNK_BYTES = 16 * 1024
+# only bother compressing text formats, and only once they are big enough to be worth it
+COMPRESSIBLE_MIMETYPES = [JSON_MIMETYPE, 'text/csv', 'text/html', 'text/plain', 'application/x-ndjson']
+# the headers a 304 has to repeat from the response it stands in for (see RFC 7232, section 4.1)
+NOT_MODIFIED_HEADERS = ['Cache-Control', 'Content-Location', 'Date', 'ETag', 'Expires', 'Last-Modified', 'Vary']
+
+# naive datetimes are always UTC in this app, so say so (ie. "2022-01-01T00:00:00Z"); numpy values and dicts keyed
+# by dates come straight out of the time series code
+JSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def encode_json(data: Any) -> bytes:
+    """
+    Serialize results to JSON much faster than Flask's encoder can, with native support for datetimes (as ISO 8601).
+    :param data:
+    :return:
+    """
+    with profiling.span('encode', 'json'):
+        return orjson.dumps(data, option=JSON_OPTIONS)
+
+
+def json_response(data: Any, status_code: int = 200) -> Response:
+    """
+    Drop-in replacement for `jsonify` that uses our faster encoder.
+    """
+    return json_bytes_response(encode_json(data), status_code)
+
+
+def json_bytes_response(body: bytes, status_code: int = 200) -> Response:
+    """
+    Send JSON that has already been encoded (ie. straight out of the cache) without decoding and re-encoding it.
+    """
+    return Response(body, status=status_code, mimetype=JSON_MIMETYPE)
+
+
+def export_response(rows: Iterable[Dict], export_format: str, filename: str, fieldnames: List[str] = None) -> Response:
+    """
+    Stream rows to the client as a CSV or NDJSON download while they are being generated, so even huge exports start
+    sending right away and never have to fit in memory.
+    :param rows: any iterable of dicts (ie. a generator that pages through upstream results)
+    :param export_format: 'csv' or 'ndjson'
+    :param filename: without the extension
+    :param fieldnames: CSV columns (defaults to the keys of the first row)
+    :return:
+    """
+    if export_format == 'csv':
+        lines = _csv_lines(rows, fieldnames)
+    else:
+        lines = (encode_json(row) + b'\n' for row in rows)
+    chunks = _chunked(lines)
+    # generate the first chunk now, so errors up front (ie. a bad query) still get a normal error response
+    first_chunk = next(chunks, None)
+    body = itertools.chain([] if first_chunk is None else [first_chunk], chunks)
+    response = Response(stream_with_context(body), mimetype=EXPORT_MIMETYPES[export_format])
+    response.headers['Content-Disposition'] = 'attachment; filename={}.{}'.format(filename, export_format)
+    return response
+
+
+class _LineWriter:
+    # lets csv writers hand back each line they write, instead of writing it to a file
+    def write(self, line: str) -> str:
+        return line
+
+
+def _csv_lines(rows: Iterable[Dict], fieldnames: List[str] = None) -> Iterator[bytes]:
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(_LineWriter(), fieldnames=fieldnames or list(row.keys()), extrasaction='ignore')
+            yield writer.writeheader().encode('utf-8')
+        yield writer.writerow(row).encode('utf-8')
+    if (writer is None) and (fieldnames is not None):
+        # no rows, but the header is still useful
+        yield csv.DictWriter(_LineWriter(), fieldnames=fieldnames).writeheader().encode('utf-8')
+
+
+def _chunked(lines: Iterator[bytes]) -> Iterator[bytes]:
+    # send the first line (ie. the header) right away, then batch the rest so we don't send a chunk per row
+    chunk = []
+    chunk_size = 0
+    for i, line in enumerate(lines):
+        if i == 0:
+            yield line
+            continue
+        chunk.append(line)
+        chunk_size += len(line)
+        if chunk_size >= EXPORT_CHUNK_BYTES:
+            yield b''.join(chunk)
+            chunk = []
+            chunk_size = 0
+    if len(chunk) > 0:
+        yield b''.join(chunk)
+
+
+def http_max_age(end_date) -> int:
+    """
+    :param end_date: the end of the date range the response is about
+    :return: seconds that browsers and proxies can reuse the response for, which is shorter for recent ranges
+    """
+    expiration_time = expiration_for_range_ending(end_date)
+    return HTTP_CACHE_MAX_AGE if expiration_time == -1 else min(expiration_time, HTTP_CACHE_MAX_AGE)
+
+
+def conditional_response(response: Response, key: str, max_age: int) -> Response:
+    """
+    Make a response cacheable by browsers and proxies: tag it with an ETag built from the canonical key of the query
+    and the version of the data we sent, and answer with a 304 if the client already has that version.
+    :param response:
+    :param key: a canonical cache key for the query (see `canonical_key`)
+    :param max_age: seconds the response can be reused for
+    :return:
+    """
+    # weak, because compression changes the bytes but not what they mean
+    response.set_etag(hashlib.sha1(key.encode('utf-8') + response.get_data()).hexdigest(), weak=True)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if request.method not in ['GET', 'HEAD'] or not request.if_none_match.contains_weak(response.get_etag()[0]):
+        return response
+    # no body, and none of the headers describing one (werkzeug's own 304s keep the Content-Type)
+    not_modified = Response(status=304)
+    del not_modified.headers['Content-Type']
+    for header in NOT_MODIFIED_HEADERS:
+        if header in response.headers:
+            not_modified.headers[header] = response.headers[header]
+    if response.mimetype in COMPRESSIBLE_MIMETYPES:
+        # `compress_response` only gets to see the 200s, but they vary by this
+        not_modified.vary.add('Accept-Encoding')
+    return not_modified
+
+
+def compress_response(response: Response) -> Response:
+    """
+    Compress big enough responses with brotli or gzip, if the client accepts them. Meant to be registered as an
+    `after_request` handler.
+    :param response:
+    :return:
+    """
+    if (response.status_code != 200) or response.direct_passthrough or response.is_streamed or \
+            ('Content-Encoding' in response.headers) or (response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < RESPONSE_COMPRESSION_THRESHOLD:
+        return response
+    if (brotli is not None) and ('br' in request.accept_encodings):
+        response.set_data(brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY))
+        response.headers['Content-Encoding'] = 'br'
+    elif 'gzip' in request.accept_encodings:
+        response.set_data(gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
@@ -0,0 +1,56 @@
+import copy
+import threading
+from typing import Any, Callable, Dict
+
+from server.util import metrics
+
+# how many callers got their result by waiting on someone else's in-flight call
+stats = dict(coalesced=0)
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# calls that are in flight right now in this worker, keyed by cache key
+_calls: Dict[str, _Call] = {}
+# under the gevent worker these are monkey-patched into greenlet-aware primitives
+_calls_lock = threading.Lock()
+
+
+def do(key: str, fn: Callable[[], Any]) -> Any:
+    """
+    Run the function, unless a call for the same key is already in flight in this worker - in which case wait for
+    that one to finish and share its result (or exception). This keeps a burst of identical requests from piling up
+    on the upstream API (or on the distributed cache lock).
+    :param key: a canonical cache key
+    :param fn: a no-argument callable
+    :return: the result of fn; callers that waited get their own copy, so they can't trip over each other
+    """
+    with _calls_lock:
+        call = _calls.get(key)
+        is_leader = call is None
+        if is_leader:
+            call = _Call()
+            _calls[key] = call
+    if not is_leader:
+        stats['coalesced'] += 1
+        metrics.CACHE_COALESCED.inc()
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return copy.deepcopy(call.result)
+    try:
+        call.result = fn()
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _calls_lock:
+            del _calls[key]
+        call.done.set()
@@ -0,0 +1,204 @@
+import calendar
+import pickle
+import unittest
+import datetime as dt
+import time
+from unittest import mock
+from dogpile.cache import make_region
+from dogpile.cache.api import NO_VALUE
+from dogpile.cache.backends.memory import MemoryBackend
+import fakeredis
+
+from server.util.cache import canonical_query, canonical_key, _keyword_safe_key_generator, _refresh_in_background, \
+    LocalLRUProxy, local_cache, get_day_buckets, set_day_buckets
+
+
+class Provider:
+
+    def search(self, query: str, start_date: dt.datetime, end_date: dt.datetime, limit: int = 20, **kwargs):
+        pass
+
+
+class CanonicalKeyTest(unittest.TestCase):
+
+    def setUp(self):
+        self._generate_key = _keyword_safe_key_generator(None, Provider.search)
+
+    def test_canonical_query(self):
+        assert canonical_query("  Robots  and   AI ") == "robots and ai"
+        assert canonical_query("Robots OR AI") == "robots OR ai"
+        assert canonical_query('(Robots OR "Artificial Intelligence")') == '(robots OR "artificial intelligence")'
+
+    def test_canonical_query_keeps_query_syntax(self):
+        assert canonical_query("Robots AND publish_date:[2020-01-01T00:00:00Z TO NOW]") == \
+            "robots AND publish_date:[2020-01-01T00:00:00Z TO NOW]"
+        assert canonical_query("Robots   [2020-01-01T00:00:00Z TO NOW-1DAY]") == \
+            "robots [2020-01-01T00:00:00Z TO NOW-1DAY]"
+        assert canonical_query("title:Robots") == "title:Robots"
+
+    def test_keyword_order(self):
+        start = dt.datetime(2022, 1, 1)
+        end = dt.datetime(2022, 2, 1)
+        key1 = self._generate_key(Provider(), "robots", start, end, sort='score', order='desc')
+        key2 = self._generate_key(Provider(), query="robots", end_date=end, start_date=start, order='desc',
+                                  sort='score')
+        key3 = self._generate_key(Provider(), "Robots ", start, end, 20, order='desc', sort='score')
+        assert key1 == key2
+        assert key1 == key3
+
+    def test_different_args(self):
+        start = dt.datetime(2022, 1, 1)
+        end = dt.datetime(2022, 2, 1)
+        key1 = self._generate_key(Provider(), "robots", start, end, limit=10)
+        key2 = self._generate_key(Provider(), "robots", start, end, limit=20)
+        key3 = self._generate_key(Provider(), "robots AND ai", start, end)
+        key4 = self._generate_key(Provider(), "robots and ai", start, end)
+        assert key1 != key2
+        assert key3 != key4
+
+    def test_date_granularity(self):
+        now = dt.datetime(2022, 1, 1, 10, 15, 2, 1234)
+        key1 = canonical_key('test', end_date=now)
+        key2 = canonical_key('test', end_date=now + dt.timedelta(microseconds=10))
+        key3 = canonical_key('test', end_date=now + dt.timedelta(days=1))
+        assert key1 == key2
+        assert key1 != key3
+        key4 = canonical_key('test', params=dict(end_time=now.isoformat("T") + "Z"))
+        key5 = canonical_key('test', params=dict(end_time=now.replace(microsecond=0).isoformat("T") + "Z"))
+        assert key4 == key5
+
+    def test_fixed_length(self):
+        key1 = canonical_key('test', query="robots")
+        key2 = canonical_key('test', query=" OR ".join(["robots"] * 1000))
+        assert len(key1) == len(key2)
+        assert key1.startswith('test|')
+
+    def test_unordered_lists(self):
+        start = dt.datetime(2022, 1, 1)
+        end = dt.datetime(2022, 2, 1)
+        key1 = self._generate_key(Provider(), "robots", start, end, sources=[1, 2, 3], collections=[9])
+        key2 = self._generate_key(Provider(), "robots", start, end, collections=[9], sources=[3, 1, 2])
+        key3 = self._generate_key(Provider(), "robots", start, end, collections=[9], sources=[3, 1])
+        assert key1 == key2
+        assert key1 != key3
+
+
+class BackgroundRefreshTest(unittest.TestCase):
+
+    def setUp(self):
+        self._region = make_region(async_creation_runner=_refresh_in_background).configure(
+            'glimpse.redis', expiration_time=3600,
+            arguments=dict(url='redis://localhost:6379/0', distributed_lock=True, lock_timeout=10))
+        self._region.backend.client = fakeredis.FakeStrictRedis()
+        self._versions = iter(range(10))
+
+    def _get(self):
+        return self._region.get_or_create('key', lambda: next(self._versions))
+
+    def _wait_for_refresh(self, version: int):
+        for _ in range(200):
+            if self._region.get('key', ignore_expiration=True) == version:
+                return
+            time.sleep(0.01)
+        self.fail("Value never got refreshed to {}".format(version))
+
+    def test_stale_values_refresh_in_background(self):
+        assert self._get() == 0
+        for version in [1, 2]:
+            time.sleep(0.01)
+            self._region.invalidate(hard=False)
+            assert self._get() == version - 1  # stale, while it refreshes in another thread
+            self._wait_for_refresh(version)
+            assert self._get() == version
+        assert self._region.backend.client.keys('_lock*') == []  # the refresh thread released the lock
+
+
+class LocalLRUProxyTest(unittest.TestCase):
+
+    @staticmethod
+    def _proxy(max_entries: int = 3, max_bytes: int = 1024 * 1024, ttl: float = 30) -> LocalLRUProxy:
+        return LocalLRUProxy(max_entries, max_bytes, ttl).wrap(MemoryBackend({}))
+
+    def test_evicts_least_recently_used(self):
+        proxy = self._proxy()
+        for key in ['a', 'b', 'c']:
+            proxy.set(key, key.upper())
+        assert proxy.get('a') == 'A'
+        proxy.set('d', 'D')
+        assert list(proxy._entries.keys()) == ['c', 'a', 'd']
+        # evicted from this tier only
+        assert proxy.get('b') == 'B'
+        assert proxy.stats == dict(l1_hits=1, l1_misses=1, l2_hits=1, l2_misses=0)
+
+    def test_size_bound(self):
+        proxy = self._proxy(max_entries=100, max_bytes=200)
+        for i in range(10):
+            proxy.set(str(i), 'x' * 50)
+        assert proxy._bytes <= 200
+        assert proxy._bytes == sum(len(pickled) for _, pickled in proxy._entries.values())
+        assert list(proxy._entries.keys())[-1] == '9'
+        # values too big for this tier still go to the one behind it
+        proxy.set('big', 'x' * 500)
+        assert 'big' not in proxy._entries
+        assert proxy.get('big') == 'x' * 500
+
+    def test_expires(self):
+        proxy = self._proxy(ttl=0.01)
+        proxy.set('a', 'A')
+        time.sleep(0.02)
+        assert proxy.get('a') == 'A'
+        assert proxy.stats['l1_misses'] == 1 and proxy.stats['l2_hits'] == 1
+
+    def test_returns_copies(self):
+        proxy = self._proxy()
+        proxy.set('a', [1, 2])
+        proxy.get('a').append(3)
+        assert proxy.get('a') == [1, 2]
+        # kept without the codec's header or compression
+        assert proxy._entries['a'][1] == pickle.dumps([1, 2], pickle.HIGHEST_PROTOCOL)
+
+    def test_disabled(self):
+        proxy = self._proxy(max_entries=0)
+        proxy.set('a', 'A')
+        assert len(proxy._entries) == 0
+        assert proxy.get('a') == 'A'
+        assert proxy.get('b') is NO_VALUE
+        assert proxy.stats == dict(l1_hits=0, l1_misses=2, l2_hits=1, l2_misses=1)
+
+
+class DayBucketsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._redis_backend = local_cache.proxied
+        local_cache.proxied = MemoryBackend({})
+        self._today = dt.datetime.utcnow().date()
+
+    def tearDown(self):
+        local_cache.proxied = self._redis_backend
+
+    @staticmethod
+    def _at(day: dt.date, hour: int) -> float:
+        return calendar.timegm((day.year, day.month, day.day, hour, 0, 0))
+
+    def test_round_trip(self):
+        days = [dt.date(2022, 1, d) for d in range(1, 4)]
+        set_day_buckets('test', {days[0]: 5, days[1]: 0})
+        counts, stale_days = get_day_buckets('test', days)
+        assert counts == {days[0]: 5, days[1]: 0}
+        assert stale_days == []
+        # namespaces don't share buckets
+        assert get_day_buckets('other', days) == ({}, [])
+
+    def test_partial_day_stale_once_over(self):
+        yesterday = self._today - dt.timedelta(days=1)
+        with mock.patch('time.time', return_value=self._at(yesterday, 12)):
+            set_day_buckets('test', {yesterday: 3})
+        counts, stale_days = get_day_buckets('test', [yesterday])
+        assert counts == {yesterday: 3}
+        assert stale_days == [yesterday]
+
+    def test_recent_days_expire(self):
+        with mock.patch('time.time', return_value=time.time() - 2 * 60 * 60):
+            set_day_buckets('test', {self._today: 3})
+        assert get_day_buckets('test', [self._today], recent_expiration_time=60 * 60)[1] == [self._today]
+        assert get_day_buckets('test', [self._today], recent_expiration_time=3 * 60 * 60)[1] == []
@@ -0,0 +1,53 @@
+import pickle
+import unittest
+from unittest import mock
+
+from server.util import codec
+
+
+class CodecTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        small = {'count': 12}
+        big = {'counts': [{'date': '2022-01-01', 'count': i} for i in range(1000)]}
+        assert codec.decode(codec.encode(small)) == small
+        assert codec.decode(codec.encode(big)) == big
+
+    def test_compression(self):
+        small = {'count': 12}
+        big = {'counts': [{'date': '2022-01-01', 'count': i} for i in range(1000)]}
+        assert codec.encode(small)[0] == codec.FORMAT_PICKLE
+        assert codec.encode(big)[0] == codec.FORMAT_PICKLE_ZLIB
+        assert len(codec.encode(big)) < len(pickle.dumps(big, pickle.HIGHEST_PROTOCOL))
+
+    def test_legacy_pickles(self):
+        value = {'count': 12}
+        assert codec.decode(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)) == value
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            codec.decode(b'\x09abc')
+
+    def test_codecs(self):
+        big = {'counts': [{'date': '2022-01-01', 'count': i} for i in range(1000)]}
+        assert 'zlib' in codec.available_codecs() and 'lzma' in codec.available_codecs()
+        for codec_name in codec.available_codecs():
+            encoded = codec.encode(big, codec_name)
+            assert encoded[0] == codec.CODECS[codec_name]
+            # reading doesn't depend on which codec is set
+            assert codec.decode(encoded) == big
+        # small values aren't worth compressing with any of them
+        assert codec.encode({'count': 12}, 'lzma')[0] == codec.FORMAT_PICKLE
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            codec.encode({'count': 12}, 'rot13')
+
+    def test_missing_optional_codec(self):
+        big = {'counts': [{'date': '2022-01-01', 'count': i} for i in range(1000)]}
+        zstd_encoded = bytes([codec.FORMAT_PICKLE_ZSTD]) + b'abc'
+        with mock.patch.dict(codec._COMPRESSORS):
+            codec._COMPRESSORS.pop(codec.FORMAT_PICKLE_ZSTD, None)
+            assert 'zstd' not in codec.available_codecs()
+            self.assertRaises(ValueError, codec.encode, big, 'zstd')
+            self.assertRaises(ValueError, codec.decode, zstd_encoded)
@@ -0,0 +1,47 @@
+import unittest
+import threading
+import time
+from functools import partial
+
+from server.util.concurrency import run_with_deadlines, STATUS_OK, STATUS_ERROR, STATUS_TIMEOUT
+
+
+class RunWithDeadlinesTest(unittest.TestCase):
+
+    def test_statuses(self):
+        def fail():
+            raise RuntimeError("broken")
+        results = run_with_deadlines(dict(ok=lambda: 1, fail=fail, slow=lambda: time.sleep(1)),
+                                     dict(ok=1, fail=1, slow=0.05))
+        assert results['ok']['status'] == STATUS_OK and results['ok']['result'] == 1
+        assert results['fail']['status'] == STATUS_ERROR and results['fail']['error'] == "broken"
+        assert results['slow']['status'] == STATUS_TIMEOUT
+
+    def test_max_workers(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def task():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.pop()
+        tasks = {str(i): task for i in range(8)}
+        results = run_with_deadlines(tasks, {name: 5 for name in tasks}, max_workers=2)
+        assert all(r['status'] == STATUS_OK for r in results.values())
+        assert max(peak) <= 2
+
+    def test_queued_tasks_cancelled(self):
+        ran = []
+
+        def task(name):
+            ran.append(name)
+            time.sleep(0.2)
+        tasks = {name: partial(task, name) for name in ['first', 'second', 'third']}
+        results = run_with_deadlines(tasks, {name: 0.05 for name in tasks}, max_workers=1)
+        assert all(r['status'] == STATUS_TIMEOUT for r in results.values())
+        time.sleep(0.5)
+        assert ran == ['first']
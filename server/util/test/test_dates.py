@@ -0,0 +1,24 @@
+import unittest
+import datetime as dt
+
+from server.util.dates import parse_iso_date, parse_epoch_millis, solr_date_to_date
+
+
+class DatesTest(unittest.TestCase):
+
+    def test_iso_fast_path(self):
+        assert parse_iso_date("2021-09-01T12:30:05.000Z") == dt.datetime(2021, 9, 1, 12, 30, 5)
+        assert parse_iso_date("2014-09-21T00:00:00Z") == dt.datetime(2014, 9, 21)
+        assert parse_iso_date("2014-09-21T00:00:00") == dt.datetime(2014, 9, 21)
+
+    def test_iso_fallback(self):
+        # offsets get converted to UTC rather than dropped
+        assert parse_iso_date("2021-09-01T12:00:00+02:00") == dt.datetime(2021, 9, 1, 10)
+        assert parse_iso_date("Sep 1 2021") == dt.datetime(2021, 9, 1)
+
+    def test_epoch_millis(self):
+        assert parse_epoch_millis(1640995200000) == dt.datetime(2022, 1, 1)
+
+    def test_solr_dates(self):
+        assert solr_date_to_date("2022-01-01") == dt.datetime(2022, 1, 1)
+        assert solr_date_to_date("2022-01-01 00:00:00") == dt.datetime(2022, 1, 1)
@@ -0,0 +1,39 @@
+import unittest
+
+from server.util import metrics
+
+
+class UpstreamCallTest(unittest.TestCase):
+
+    @staticmethod
+    def _calls(host: str, status: str) -> float:
+        return metrics.UPSTREAM_CALLS.labels(host, status)._value.get()
+
+    def test_counts_status(self):
+        before = self._calls('ok.example.com', '200')
+        with metrics.upstream_call('https://ok.example.com/search?q=x') as call:
+            call['status'] = 200
+        assert self._calls('ok.example.com', '200') == before + 1
+
+    def test_counts_exceptions(self):
+        class StatusError(Exception):
+            status_code = 429
+        before_429 = self._calls('fail.example.com', '429')
+        before_error = self._calls('fail.example.com', 'error')
+        for error in [StatusError(), RuntimeError()]:
+            try:
+                with metrics.upstream_call('https://fail.example.com/search'):
+                    raise error
+            except Exception as e:
+                assert e is error
+        assert self._calls('fail.example.com', '429') == before_429 + 1
+        assert self._calls('fail.example.com', 'error') == before_error + 1
+
+
+class RenderTest(unittest.TestCase):
+
+    def test_text_format(self):
+        metrics.CACHE_COALESCED.inc()
+        body, content_type = metrics.render()
+        assert content_type.startswith('text/plain')
+        assert b'glimpse_cache_coalesced_total' in body
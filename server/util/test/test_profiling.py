@@ -0,0 +1,45 @@
+import unittest
+
+from server.util import profiling
+
+
+class SpanTest(unittest.TestCase):
+
+    def test_off(self):
+        assert profiling.span('cache', 'get') is profiling._NO_SPAN
+
+    def test_nesting(self):
+        profile = profiling.RequestProfile()
+        token = profiling._current.set((profile, ('request',)))
+        try:
+            with profiling.span('regenerate', 'count'):
+                with profiling.span('upstream', 'example.com'):
+                    pass
+                with profiling.span('upstream', 'example.com'):
+                    pass
+        finally:
+            profiling._current.reset(token)
+        assert profile.span_counts[('request', 'regenerate:count', 'upstream:example.com')] == 2
+        breakdown = {s['span']: s for s in profile.span_breakdown()}
+        assert breakdown['upstream:example.com']['calls'] == 2
+        assert breakdown['regenerate:count']['seconds'] >= breakdown['upstream:example.com']['seconds']
+
+
+class CollapsedStacksTest(unittest.TestCase):
+
+    def test_self_time(self):
+        profile = profiling.RequestProfile()
+        profile.add_span(('request', 'regenerate:count'), 0.5)
+        profile.add_span(('request', 'regenerate:count', 'upstream:example.com'), 0.3)
+        assert profile.collapsed_stacks(1.0) == [
+            'request 500000',
+            'request;regenerate:count 200000',
+            'request;regenerate:count;upstream:example.com 300000',
+        ]
+
+
+class ProfilePathTest(unittest.TestCase):
+
+    def test_rejects_bad_ids(self):
+        assert profiling.profile_path('../../etc/passwd', 'json') is None
+        assert profiling.profile_path('20220301T142501123-0f3a9c2e', 'exe') is None
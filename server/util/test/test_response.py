@@ -0,0 +1,70 @@
+import unittest
+import datetime as dt
+import gzip
+import numpy as np
+
+from server import app
+from server.util.response import encode_json, json_bytes_response, compress_response, conditional_response, \
+    http_max_age, export_response
+
+
+class ResponseTest(unittest.TestCase):
+
+    def test_encode_json(self):
+        encoded = encode_json({'date': dt.datetime(2022, 1, 2, 3, 4, 5), 'count': np.int64(7),
+                               dt.date(2022, 1, 1): 1})
+        assert encoded == b'{"date":"2022-01-02T03:04:05Z","count":7,"2022-01-01":1}'
+
+    def test_compress(self):
+        body = encode_json([{'count': i} for i in range(1000)])
+        with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+            response = compress_response(json_bytes_response(body))
+            assert response.headers['Content-Encoding'] == 'gzip'
+            assert gzip.decompress(response.get_data()) == body
+
+    def test_small_or_unaccepted(self):
+        with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+            response = compress_response(json_bytes_response(b'{}'))
+            assert 'Content-Encoding' not in response.headers
+        with app.test_request_context():
+            response = compress_response(json_bytes_response(encode_json(list(range(1000)))))
+            assert 'Content-Encoding' not in response.headers
+
+    def test_conditional(self):
+        with app.test_request_context():
+            response = conditional_response(json_bytes_response(b'[1]'), 'key', 60)
+            assert response.status_code == 200
+            assert response.cache_control.max_age == 60
+            etag = response.headers['ETag']
+        with app.test_request_context(headers={'If-None-Match': etag}):
+            not_modified = conditional_response(json_bytes_response(b'[1]'), 'key', 60)
+            assert not_modified.status_code == 304
+            assert not_modified.get_data() == b''
+            assert 'Content-Type' not in not_modified.headers
+            assert not_modified.headers['ETag'] == etag
+            assert not_modified.cache_control.max_age == 60
+            assert not_modified.headers['Vary'] == 'Accept-Encoding'
+            assert conditional_response(json_bytes_response(b'[2]'), 'key', 60).status_code == 200
+            assert conditional_response(json_bytes_response(b'[1]'), 'other key', 60).status_code == 200
+
+    def test_max_age(self):
+        assert http_max_age(dt.datetime(2020, 1, 1)) > http_max_age(dt.datetime.utcnow())
+
+    def test_csv_export(self):
+        rows = ({'date': dt.datetime(2022, 1, 1), 'count': i, 'extra': 'ignored'} for i in range(3))
+        with app.test_request_context():
+            response = export_response(rows, 'csv', 'counts', ['date', 'count'])
+            assert response.is_streamed
+            assert response.get_data().decode().splitlines() == [
+                'date,count', '2022-01-01 00:00:00,0', '2022-01-01 00:00:00,1', '2022-01-01 00:00:00,2']
+
+    def test_empty_export(self):
+        with app.test_request_context():
+            assert export_response(iter([]), 'csv', 'counts', ['date', 'count']).get_data() == b'date,count\r\n'
+            assert export_response(iter([]), 'ndjson', 'sample').get_data() == b''
+
+    def test_ndjson_export(self):
+        with app.test_request_context():
+            response = export_response(({'count': i} for i in range(2)), 'ndjson', 'counts')
+            assert response.mimetype == 'application/x-ndjson'
+            assert response.get_data() == b'{"count":0}\n{"count":1}\n'
@@ -0,0 +1,54 @@
+import threading
+import time
+import unittest
+
+from server.util import singleflight
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def _run_concurrently(self, fn, callers=40):
+        results = []
+        errors = []
+
+        def caller():
+            try:
+                results.append(singleflight.do('test-key', fn))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=caller) for _ in range(callers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results, errors
+
+    def test_coalesces(self):
+        calls = []
+
+        def slow_upstream():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'count': 12}
+        results, errors = self._run_concurrently(slow_upstream)
+        assert len(calls) == 1
+        assert len(errors) == 0
+        assert results == [{'count': 12}] * 40
+
+    def test_shares_errors(self):
+        calls = []
+
+        def failing_upstream():
+            calls.append(1)
+            time.sleep(0.2)
+            raise RuntimeError("upstream down")
+        results, errors = self._run_concurrently(failing_upstream)
+        assert len(calls) == 1
+        assert len(results) == 0
+        assert len(errors) == 40
+
+    def test_sequential_calls_run_again(self):
+        calls = []
+        singleflight.do('test-key', lambda: calls.append(1))
+        singleflight.do('test-key', lambda: calls.append(1))
+        assert len(calls) == 2
@@ -0,0 +1,113 @@
+import unittest
+import datetime as dt
+import operator
+
+from server.util.timeseries import TimeSeries, HOUR, DAY, WEEK, MONTH, YEAR
+
+
+class TimeSeriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self._series = TimeSeries.from_daily_counts({
+            dt.date(2022, 1, 3): 30,
+            dt.date(2022, 1, 1): 10,
+            dt.date(2022, 1, 5): 0,
+        })
+
+    def test_sorted(self):
+        assert [d.day for d in self._series.dates()] == [1, 3, 5]
+        assert self._series.counts.tolist() == [10, 30, 0]
+        assert self._series.total() == 40
+
+    def test_fill_gaps(self):
+        filled = self._series.fill_gaps(dt.date(2021, 12, 31), dt.date(2022, 1, 6))
+        assert len(filled) == 7
+        assert filled.counts.tolist() == [0, 10, 0, 30, 0, 0, 0]
+        assert filled.total() == self._series.total()
+
+    def test_sum(self):
+        other = TimeSeries.from_daily_counts({dt.date(2022, 1, 2): 5, dt.date(2022, 1, 3): 5})
+        combined = self._series + other
+        assert [d.day for d in combined.dates()] == [1, 2, 3, 5]
+        assert combined.counts.tolist() == [10, 5, 35, 0]
+
+    def test_ratio(self):
+        totals = TimeSeries.from_daily_counts({dt.date(2022, 1, 1): 100, dt.date(2022, 1, 2): 0,
+                                               dt.date(2022, 1, 3): 60, dt.date(2022, 1, 5): 10})
+        assert self._series.ratio(totals).tolist() == [0.1, 0, 0.5, 0]
+        normalized = self._series.to_normalized_counts(totals)
+        assert [d['count'] for d in normalized] == [10, 0, 30, 0]
+        assert [d['total_count'] for d in normalized] == [100, 0, 60, 10]
+
+    def test_counts_round_trip(self):
+        counts = self._series.to_counts()
+        assert counts[0] == {'date': dt.datetime(2022, 1, 1), 'timestamp': 1640995200, 'count': 10}
+        assert TimeSeries.from_counts(counts) == self._series
+        assert isinstance(counts[0]['count'], int)
+
+    def test_empty(self):
+        empty = TimeSeries.from_daily_counts({})
+        assert empty.total() == 0
+        assert empty.fill_gaps(dt.date(2022, 1, 1), dt.date(2022, 1, 2)).counts.tolist() == [0, 0]
+        assert empty.to_counts() == []
+
+    def test_resample(self):
+        filled = self._series.fill_gaps(dt.date(2021, 12, 25), dt.date(2022, 2, 2))
+        assert filled.resample(DAY) == filled
+        weekly = filled.resample(WEEK)
+        # 2021-12-20 and 2022-01-03 are Mondays
+        assert weekly.dates()[0] == dt.datetime(2021, 12, 20)
+        assert weekly.dates()[2] == dt.datetime(2022, 1, 3)
+        assert weekly.counts.tolist()[:3] == [0, 10, 30]
+        assert weekly.total() == self._series.total()
+        monthly = filled.resample(MONTH)
+        assert monthly.dates() == [dt.datetime(2021, 12, 1), dt.datetime(2022, 1, 1), dt.datetime(2022, 2, 1)]
+        assert monthly.counts.tolist() == [0, 40, 0]
+        assert filled.resample(YEAR).counts.tolist() == [0, 40]
+        assert TimeSeries.from_daily_counts({}).resample(MONTH).to_counts() == []
+        with self.assertRaises(ValueError):
+            filled.resample(HOUR)
+
+    def test_hourly(self):
+        hourly = TimeSeries.from_hourly_counts({dt.datetime(2022, 1, 1, 23): 2, dt.datetime(2022, 1, 1, 1): 3,
+                                                dt.datetime(2022, 1, 2, 0): 4})
+        filled = hourly.fill_gaps(dt.date(2022, 1, 1), dt.date(2022, 1, 2))
+        assert len(filled) == 48
+        assert filled.to_counts()[1] == {'date': dt.datetime(2022, 1, 1, 1), 'timestamp': 1640998800, 'count': 3}
+        assert filled.resample(HOUR) == filled
+        assert filled.resample(DAY).counts.tolist() == [5, 4]
+
+    def test_resample_empty(self):
+        # an empty series comes back counted in the same periods as a non-empty one
+        for empty in [TimeSeries.from_daily_counts({}), TimeSeries.from_hourly_counts({})]:
+            for granularity in [DAY, WEEK, MONTH, YEAR]:
+                resampled = empty.resample(granularity)
+                expected = self._series.resample(granularity)
+                assert len(resampled) == 0
+                assert (resampled.period_seconds, resampled.granularity) == \
+                    (expected.period_seconds, expected.granularity)
+        assert TimeSeries.from_hourly_counts({}).resample(HOUR).period_seconds == 60 * 60
+
+    def test_resample_coarse(self):
+        weekly = self._series.resample(WEEK)
+        assert weekly.resample(WEEK) == weekly
+        with self.assertRaises(ValueError):
+            weekly.resample(MONTH)
+        with self.assertRaises(ValueError):
+            weekly.resample(DAY)
+
+    def test_sum_mismatched(self):
+        hourly = TimeSeries.from_hourly_counts({dt.datetime(2022, 1, 1, 1): 3})
+        self.assertRaises(ValueError, operator.add, self._series, hourly)
+        # the same period numbers, but a week long instead of a day
+        self.assertRaises(ValueError, operator.add, self._series, self._series.resample(WEEK))
+        weekly = self._series.resample(WEEK)
+        assert (weekly + weekly).counts.tolist() == [20, 60]
+        assert (weekly + weekly).granularity == WEEK
+
+    def test_equality(self):
+        assert self._series == TimeSeries.from_counts(self._series.to_counts())
+        assert self._series != self._series.resample(WEEK)
+        assert (self._series == 'not a series') is False
+        assert self._series != [10, 30, 0]
+        self.assertRaises(TypeError, operator.add, self._series, 1)
@@ -0,0 +1,36 @@
+import unittest
+from unittest import mock
+import requests
+
+from server.util import transport
+
+
+def _response(status_code: int, reason: str) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = reason
+    response.url = 'https://api.example.com/search?q=robots&key=secret'
+    return response
+
+
+class GetTest(unittest.TestCase):
+
+    def _get(self, response: requests.Response) -> requests.Response:
+        session = mock.Mock()
+        session.get.return_value = response
+        with mock.patch.object(transport, 'session_for', return_value=session):
+            return transport.get(response.url)
+
+    def test_success(self):
+        response = _response(200, 'OK')
+        assert self._get(response) is response
+
+    def test_error_status_raises(self):
+        for status_code, reason in [(429, 'Too Many Requests'), (503, 'Service Unavailable')]:
+            try:
+                self._get(_response(status_code, reason))
+                self.fail("Expected an UpstreamError for {}".format(status_code))
+            except transport.UpstreamError as e:
+                assert e.status_code == status_code
+                assert str(e) == "api.example.com/search answered {} {}".format(status_code, reason)
+                assert 'secret' not in str(e)
@@ -0,0 +1,220 @@
+import datetime as dt
+from typing import Dict, Iterator, List, Tuple
+import numpy as np
+
+from server.util.dates import solr_date_to_date
+
+EPOCH_ORDINAL = dt.date(1970, 1, 1).toordinal()
+SECONDS_PER_HOUR = 60 * 60
+SECONDS_PER_DAY = SECONDS_PER_HOUR * 24
+
+# the sizes of bucket a series can be resampled into
+HOUR = 'hour'
+DAY = 'day'
+WEEK = 'week'
+MONTH = 'month'
+YEAR = 'year'
+GRANULARITIES = [HOUR, DAY, WEEK, MONTH, YEAR]
+
+
+def day_number(day: dt.date) -> int:
+    """
+    :return: the number of days since the Unix epoch
+    """
+    return day.toordinal() - EPOCH_ORDINAL
+
+
+def day_from_number(number: int) -> dt.date:
+    return dt.date.fromordinal(int(number) + EPOCH_ORDINAL)
+
+
+def hour_number(hour: dt.datetime) -> int:
+    """
+    :return: the number of hours since the Unix epoch (for a naive datetime in UTC)
+    """
+    return day_number(hour.date()) * 24 + hour.hour
+
+
+class TimeSeries:
+    """
+    Counts of content per period (a day, unless otherwise specified), stored as parallel NumPy arrays of periods
+    (since the Unix epoch) and counts, sorted by period. Operations that combine series line them up by period with
+    vectorized lookups, instead of scanning lists of dicts. Use `to_counts` to turn one into the JSON-friendly list of
+    dicts our API returns.
+    Periods are numbered in units of `period_seconds`, and each one holds the counts for a bucket of `granularity`
+    (so a weekly series has day numbers for periods, one per Monday).
+    """
+
+    def __init__(self, periods: np.ndarray, counts: np.ndarray, period_seconds: int = SECONDS_PER_DAY,
+                 granularity: str = None):
+        self.periods = np.asarray(periods, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.period_seconds = period_seconds
+        self.granularity = granularity or (HOUR if period_seconds == SECONDS_PER_HOUR else DAY)
+
+    @classmethod
+    def from_daily_counts(cls, daily_counts: Dict[dt.date, int]) -> 'TimeSeries':
+        days = np.fromiter((day_number(d) for d in daily_counts.keys()), dtype=np.int64, count=len(daily_counts))
+        counts = np.fromiter(daily_counts.values(), dtype=np.int64, count=len(daily_counts))
+        order = np.argsort(days, kind='stable')
+        return cls(days[order], counts[order])
+
+    @classmethod
+    def from_hourly_counts(cls, hourly_counts: Dict[dt.datetime, int]) -> 'TimeSeries':
+        hours = np.fromiter((hour_number(h) for h in hourly_counts.keys()), dtype=np.int64, count=len(hourly_counts))
+        counts = np.fromiter(hourly_counts.values(), dtype=np.int64, count=len(hourly_counts))
+        order = np.argsort(hours, kind='stable')
+        return cls(hours[order], counts[order], period_seconds=SECONDS_PER_HOUR)
+
+    @classmethod
+    def from_counts(cls, counts: List[Dict]) -> 'TimeSeries':
+        """
+        The inverse of `to_counts` (for daily series)
+        """
+        return cls.from_daily_counts({_as_date(c['date']): c['count'] for c in counts})
+
+    def __len__(self) -> int:
+        return len(self.periods)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, TimeSeries):
+            return NotImplemented
+        return self._same_buckets(other) and np.array_equal(self.periods, other.periods) and \
+            np.array_equal(self.counts, other.counts)
+
+    def __add__(self, other: 'TimeSeries') -> 'TimeSeries':
+        if not isinstance(other, TimeSeries):
+            return NotImplemented
+        if not self._same_buckets(other):
+            raise ValueError("Can't add a series by {} to one by {}".format(other.granularity, self.granularity))
+        mine, theirs = self.align(other)
+        return TimeSeries(mine.periods, mine.counts + theirs.counts, self.period_seconds, self.granularity)
+
+    def _same_buckets(self, other: 'TimeSeries') -> bool:
+        # buckets of the same granularity always start at the same times (ie. weeks on Mondays), so periods with the
+        # same number cover the same time
+        return (self.period_seconds == other.period_seconds) and (self.granularity == other.granularity)
+
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def reindex(self, periods: np.ndarray) -> 'TimeSeries':
+        """
+        :param periods: sorted period numbers
+        :return: a series with exactly these periods, with 0 for any we don't have a count for
+        """
+        periods = np.asarray(periods, dtype=np.int64)
+        counts = np.zeros(len(periods), dtype=np.int64)
+        if len(periods) > 0 and len(self.periods) > 0:
+            positions = np.searchsorted(periods, self.periods)
+            found = positions < len(periods)
+            found[found] = periods[positions[found]] == self.periods[found]
+            counts[positions[found]] = self.counts[found]
+        return TimeSeries(periods, counts, self.period_seconds, self.granularity)
+
+    def fill_gaps(self, first_day: dt.date, last_day: dt.date) -> 'TimeSeries':
+        """
+        :return: a series with every period from the start of first_day through the end of last_day, with 0 for any
+        missing ones
+        """
+        per_day = SECONDS_PER_DAY // self.period_seconds
+        return self.reindex(np.arange(day_number(first_day) * per_day, (day_number(last_day) + 1) * per_day,
+                                      dtype=np.int64))
+
+    def resample(self, granularity: str) -> 'TimeSeries':
+        """
+        Add up the counts into coarser buckets. Weeks start on Monday, and each bucket is labelled with the day it
+        starts on, so the first and last buckets may start before (or end after) the data they hold. Fill in gaps
+        first if you want a bucket for every period in a range.
+        :param granularity: one of GRANULARITIES
+        :return: a new series, with one period per bucket
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError("Unsupported granularity {} (use one of {})".format(granularity, GRANULARITIES))
+        if granularity == self.granularity:
+            return self
+        if granularity == HOUR:
+            raise ValueError("Can't resample a series by {} into hours".format(self.granularity))
+        if self.granularity not in [HOUR, DAY]:
+            # its buckets may straddle the new ones
+            raise ValueError("Can't resample a series by {} (only by hour or day)".format(self.granularity))
+        days = self.periods // (SECONDS_PER_DAY // self.period_seconds)
+        if granularity == DAY:
+            starts = days
+        elif granularity == WEEK:
+            starts = days - (days + 3) % 7  # the epoch was a Thursday
+        else:
+            unit = 'M' if granularity == MONTH else 'Y'
+            starts = days.astype('datetime64[D]').astype('datetime64[{}]'.format(unit)).astype('datetime64[D]')\
+                .astype(np.int64)
+        # buckets are labelled with the number of the day they start on
+        if len(starts) == 0:
+            return TimeSeries(starts, self.counts, SECONDS_PER_DAY, granularity)
+        # periods are sorted, so each bucket's counts are one contiguous run we can sum in place
+        bucket_starts, first_indexes = np.unique(starts, return_index=True)
+        return TimeSeries(bucket_starts, np.add.reduceat(self.counts, first_indexes), SECONDS_PER_DAY, granularity)
+
+    def align(self, other: 'TimeSeries') -> Tuple['TimeSeries', 'TimeSeries']:
+        """
+        :return: both series reindexed to cover all the periods in either one of them
+        """
+        periods = np.union1d(self.periods, other.periods)
+        return self.reindex(periods), other.reindex(periods)
+
+    def ratio(self, other: 'TimeSeries') -> np.ndarray:
+        """
+        :param other: the denominator
+        :return: the fraction of the other series' count that this one is in each of the other series' periods (0
+        when either is 0)
+        """
+        mine = self.reindex(other.periods)
+        ratios = np.zeros(len(other.periods), dtype=np.float64)
+        nonzero = (mine.counts != 0) & (other.counts != 0)
+        ratios[nonzero] = mine.counts[nonzero] / other.counts[nonzero]
+        return ratios
+
+    def timestamps(self) -> np.ndarray:
+        """
+        :return: the start of each period, in seconds since the Unix epoch
+        """
+        return self.periods * self.period_seconds
+
+    def dates(self) -> List[dt.datetime]:
+        return self.timestamps().astype('datetime64[s]').tolist()
+
+    def to_counts(self) -> List[Dict]:
+        """
+        :return: the list-of-dicts format our API returns (`date`, `timestamp` and `count` for each period)
+        """
+        return list(self.iter_counts())
+
+    def iter_counts(self) -> Iterator[Dict]:
+        """
+        Like `to_counts`, but one period at a time.
+        """
+        for date, timestamp, count in zip(self.dates(), self.timestamps().tolist(), self.counts.tolist()):
+            yield {'date': date, 'timestamp': timestamp, 'count': count}
+
+    def to_normalized_counts(self, totals: 'TimeSeries') -> List[Dict]:
+        """
+        :param totals: the denominator, ie. counts of all content
+        :return: the list-of-dicts format our API returns for normalized results, for each of the periods in totals
+        """
+        return list(self.iter_normalized_counts(totals))
+
+    def iter_normalized_counts(self, totals: 'TimeSeries') -> Iterator[Dict]:
+        """
+        Like `to_normalized_counts`, but one period at a time.
+        """
+        mine = self.reindex(totals.periods)
+        for date, total_count, count, ratio in zip(totals.dates(), totals.counts.tolist(), mine.counts.tolist(),
+                                                   self.ratio(totals).tolist()):
+            yield {'date': date, 'total_count': total_count, 'count': count, 'ratio': ratio}
+
+
+def _as_date(value) -> dt.date:
+    if isinstance(value, dt.datetime):
+        return value.date()
+    if isinstance(value, dt.date):
+        return value
+    return solr_date_to_date(str(value)[:10]).date()  # ie. "2022-01-01 00:00:00" from Media Cloud
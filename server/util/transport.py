@@ -0,0 +1,100 @@
+import logging
+import threading
+from typing import Dict
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from server import HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_RETRIES, HTTP_RETRY_BACKOFF
+from server.util import metrics
+
+logger = logging.getLogger(__name__)
+
+# rate limits and transient upstream failures we are willing to retry
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+# one long-lived session per upstream host, so connections (and their TLS handshakes) get reused across requests
+_sessions: Dict[str, requests.Session] = {}
+# under the gevent worker this is monkey-patched into a greenlet-aware lock
+_sessions_lock = threading.Lock()
+
+
+class UpstreamError(requests.HTTPError):
+    """
+    An upstream API answered with an error status (after any retries). The message leaves out the query string, which
+    can include API keys.
+    """
+
+    def __init__(self, response: requests.Response):
+        url = urlsplit(response.url)
+        super(UpstreamError, self).__init__("{}{} answered {} {}".format(url.netloc, url.path, response.status_code,
+                                                                         response.reason), response=response)
+        self.status_code = response.status_code
+
+
+def _new_session() -> requests.Session:
+    retries = Retry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(['GET', 'POST']),
+        # Twitter's rate limit windows are minutes long - don't hold a worker sleeping on them
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+    # pool_block=False means that if more greenlets than HTTP_POOL_SIZE hit the same host at once the extras get
+    # a throwaway connection instead of waiting on the pool
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=retries, pool_block=False)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def session_for(url: str) -> requests.Session:
+    """
+    Return the shared session for the host in this url, creating it on first use. Sessions are created lazily, so
+    each gunicorn worker builds its own after forking.
+    :param url:
+    :return:
+    """
+    host = urlsplit(url).netloc
+    session = _sessions.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host)
+            if session is None:
+                logger.debug("Creating pooled session for {}".format(host))
+                session = _new_session()
+                _sessions[host] = session
+    return session
+
+
+def get(url: str, headers: Dict = None, params: Dict = None) -> requests.Response:
+    """
+    Replacement for `requests.get` that reuses pooled keep-alive connections, applies our connect/read timeouts and
+    retries with backoff on rate limits and server errors. Unlike `requests.get` it raises an `UpstreamError` if the
+    final response isn't a success, so callers can't mistake (and cache) an error body for results.
+    :param url:
+    :param headers:
+    :param params:
+    :return:
+    """
+    with metrics.upstream_call(url) as call:
+        response = session_for(url).get(url, headers=headers, params=params,
+                                        timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        call['status'] = response.status_code
+        if not response.ok:
+            raise UpstreamError(response)
+    return response
+
+
+def close_all() -> None:
+    """
+    Close every pooled connection (useful when a worker is shutting down or config changes)
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
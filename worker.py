@@ -0,0 +1,9 @@
+"""
+Runs queued jobs (see `server/jobs.py`) in their own process, separate from the web workers:
+
+    python worker.py
+"""
+from server.jobs import run_worker
+
+if __name__ == '__main__':
+    run_worker()